@@ -5,13 +5,23 @@ License:
 See the Python 2.6 License (http://www.python.org/2.6/license.html)
 """
 
+import base64
 import datetime
+import os
+import threading
+import urllib
+import urllib2
 
-wsdl = 'http://msrmaps.com/TerraService2.asmx?WSDL'
+import projection
+import retry
 
-from suds.client import Client
+wsdl = 'http://msrmaps.com/TerraService2.asmx?WSDL'
 
-client = Client(wsdl)
+# Directory holding the WSDL snapshot and the suds object cache.  The WSDL
+# is fetched once and read from here afterwards, so building the client
+# does not need the network.  Set PYTERRA_WSDL to use a snapshot of your own.
+wsdlCacheDir = os.environ.get('PYTERRA_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.pyTerra'))
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -27,26 +37,258 @@ url = "http://msrmaps.com/TerraService2.asmx"
 ns = "http://msrmaps.com/"
 
 
+# The retry.RetryPolicy every TerraServer call is made with
+retryPolicy = retry.RetryPolicy(breaker=retry.CircuitBreaker())
+
+# A pyTerra.meta.MetadataCache keeping the responses of the read operations
+metadataCache = None
+
+# Whether GetTileData takes the fast path of pyTerra.fastpath by default
+fastGetTile = True
+
+# Do ConvertUtmPtToLonLatPt and ConvertLonLatPtToUtmPt on the TerraServer
+# instead of locally.  Useful for cross-checking pyTerra.projection.
+remoteConversions = False
+
+
 class pyTerraError(Exception):
     """Custom exception for PyTerra"""
 
-    
-def GetPlaceList(placeName, MaxItems=10, imagePresence=True):
-    """Returns a list of PlaceItems that have the same placeName"""
+
+class LonLatPt(object):
+    """A WGS84 point as returned by the local coordinate conversions"""
+    __slots__ = ('Lon', 'Lat')
+    def __init__(self, Lon, Lat):
+        self.Lon = Lon
+        self.Lat = Lat
+    def __repr__(self):
+        return 'LonLatPt(Lon=%r, Lat=%r)' % (self.Lon, self.Lat)
+
+class UtmPt(object):
+    """A UTM point as returned by the local coordinate conversions"""
+    __slots__ = ('X', 'Y', 'Zone')
+    def __init__(self, X, Y, Zone):
+        self.X = X
+        self.Y = Y
+        self.Zone = Zone
+    def __repr__(self):
+        return 'UtmPt(X=%r, Y=%r, Zone=%r)' % (self.X, self.Y, self.Zone)
+
+
+def get_wsdl_location():
+    """Returns the location the WSDL is loaded from.  This is a local
+    snapshot whenever one exists or can be saved, and the remote
+    :data:`wsdl` url otherwise"""
+    snapshot = os.environ.get('PYTERRA_WSDL')
+    if not snapshot:
+        snapshot = os.path.join(wsdlCacheDir, 'TerraService2.wsdl')
+        if not os.path.isfile(snapshot):
+            try:
+                save_wsdl(snapshot)
+            except (IOError, OSError, urllib2.URLError):
+                return wsdl
+    return 'file://' + urllib.pathname2url(os.path.abspath(snapshot))
+
+def save_wsdl(filename):
+    """Downloads the WSDL and saves a snapshot of it to filename"""
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    data = urllib2.urlopen(wsdl, timeout=retryPolicy.timeout or 90).read()
+    # write to a temporary name first so a partial download is never used
+    tmp = '%s.%d' % (filename, os.getpid())
+    f = open(tmp, 'wb')
+    f.write(data)
+    f.close()
+    os.rename(tmp, filename)
+
+# Makes the transport for each thread's client, see set_transport
+transportFactory = None
+
+_client = None
+_client_lock = threading.Lock()
+_local = threading.local()
+_generation = 0
+
+def make_transport():
+    """Returns a new suds transport from :data:`transportFactory`, or a
+    :class:`pyTerra.transport.KeepAliveTransport` by default"""
+    if transportFactory is not None:
+        return transportFactory()
+    import transport
+    return transport.KeepAliveTransport()
+
+def get_prototype():
+    """Returns the suds Client that the per-thread clients are cloned from,
+    building it on first use.  Loading the WSDL is retried under
+    :data:`retryPolicy` and raises a pyTerraError when it fails"""
+    global _client
+    if _client is None:
+        _client_lock.acquire()
+        try:
+            if _client is None:
+                # suds is imported here as well, it is slow to load
+                from suds.client import Client
+                from suds.cache import ObjectCache
+                cache = ObjectCache(location=os.path.join(wsdlCacheDir, 'suds'),
+                                    days=365)
+                def load():
+                    # a transport belongs to one client, even a failed one
+                    transport = make_transport()
+                    if retryPolicy.timeout is not None:
+                        transport.options.timeout = retryPolicy.timeout
+                    return Client(get_wsdl_location(), cache=cache,
+                                  transport=transport)
+                try:
+                    _client = retryPolicy.call(load)
+                except pyTerraError:
+                    raise
+                except Exception, e:
+                    raise pyTerraError("Cannot load the TerraServer WSDL: %s"
+                                       % e)
+        finally:
+            _client_lock.release()
+    return _client
+
+def get_client():
+    """Returns the calling thread's suds Client.  suds clients cannot be
+    shared between threads, so each thread gets a clone of the prototype
+    with a transport of its own, which then keeps its connection open"""
+    client = getattr(_local, 'client', None)
+    if client is None or _local.generation != _generation:
+        client = get_prototype().clone()
+        client.set_options(transport=make_transport())
+        _local.client = client
+        _local.generation = _generation
+    return client
+
+def set_transport(factory):
+    """Sets the callable that makes the suds transport for each thread's
+    client.  Clients made before are replaced on their next use.  Pass None
+    to go back to :class:`pyTerra.transport.KeepAliveTransport`"""
+    global transportFactory, _generation
+    transportFactory = factory
+    _generation += 1
+
+def transport_stats():
+    """Returns the request and connection counts of the default
+    transports, see :class:`pyTerra.transport.TransportStats`"""
+    import transport
+    return transport.stats.snapshot()
+
+class LazyClient(object):
+    """Stands in for the suds Client so that importing pyTerra does not
+    load the WSDL.  Attribute access is forwarded to the calling thread's
+    client from :func:`get_client`"""
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+client = LazyClient()
+
+def retried(fn, *args):
+    """Returns fn(*args), called under :data:`retryPolicy` with the calling
+    thread's client set to its timeout"""
+    policy = retryPolicy
+    if policy.timeout is not None and client.options.timeout != policy.timeout:
+        client.set_options(timeout=policy.timeout)
     try:
-        resp = client.service.GetPlaceList(placeName, int(MaxItems), str(bool(imagePresence)).lower())
+        return policy.call(fn, *args)
+    except pyTerraError:
+        raise
     except Exception, e:
         raise pyTerraError(e)
 
+def send(operation, *args):
+    """Calls the named TerraServer operation under :data:`retryPolicy`"""
+    return retried(getattr(client.service, operation), *args)
+
+def call(operation, *args):
+    """Calls the named TerraServer operation.  With a :data:`metadataCache`,
+    the response of a read operation is looked up there first, and cached"""
+    cache = metadataCache
+    if cache is None or operation not in cache.operations:
+        return send(operation, *args)
+
+    import meta
+    key = meta.key(args)
+    try:
+        return cache.get(operation, key)
+    except KeyError:
+        pass
+    resp = meta.to_record(send(operation, *args))
+    cache.put(operation, key, resp)
+    return resp
+
+    
+def GetPlaceList(placeName, MaxItems=10, imagePresence=True):
+    """Returns a list of PlaceItems that have the same placeName"""
+    resp = call("GetPlaceList", placeName, int(MaxItems), str(bool(imagePresence)).lower())
+
     return resp
 
 def GetPlaceTypes():
-    t = client.factory.create("PlaceType")
-    return [i[0] for i in t]
+    """Returns the names of the PlaceType enumeration"""
+    return list(get_enum("PlaceType"))
 
 def GetScales():
-    t = client.factory.create("Scale")
-    return [i[0] for i in t]
+    """Returns the names of the Scale enumeration"""
+    return list(get_enum("Scale"))
+
+_enums = {}
+_enum_sets = {}
+
+def get_enum(name):
+    """Returns the values of the named WSDL enumeration as a tuple.  The
+    enumeration is only built from the WSDL the first time it is asked for"""
+    try:
+        return _enums[name]
+    except KeyError:
+        values = tuple([i[0] for i in client.factory.create(name)])
+        _enum_sets[name] = frozenset(values)
+        _enums[name] = values
+        return values
+
+def in_enum(name, value):
+    """Tests whether value is a member of the named WSDL enumeration"""
+    try:
+        return value in _enum_sets[name]
+    except KeyError:
+        get_enum(name)
+        return value in _enum_sets[name]
+
+def normalize_theme(theme):
+    """Returns the theme to send to the TerraServer.  Numeric themes are
+    returned as ints and names are looked up in :data:`themes`"""
+    try:
+        return int(theme)
+    except ValueError:
+        try:
+            return themes[theme.upper()]
+        except KeyError:
+            raise pyTerraError("Theme %s not found" % theme)
+
+def normalize_scale(scale):
+    """Returns scale if it is a member of the Scale enumeration"""
+    if not in_enum("Scale", scale):
+        raise pyTerraError("Scale '%s' is not a valid scale" % scale)
+    return scale
+
+def normalize_place_type(ptype):
+    """Returns ptype if it is a member of the PlaceType enumeration"""
+    if not in_enum("PlaceType", ptype):
+        raise pyTerraError("type %s not available" % ptype)
+    return ptype
+
+def make_tile_id(id):
+    """Builds a suds TileId from any object with X, Y, Scene, Theme and
+    Scale attributes"""
+    t = client.factory.create("TileId")
+    t.X = int(id.X)
+    t.Y = int(id.Y)
+    t.Scene = int(id.Scene)
+    t.Scale = normalize_scale(id.Scale)
+    t.Theme = normalize_theme(id.Theme)
+    return t
 
 def GetPlaceListInRect(upperLeft, lowerRight, ptype, MaxItems):
     """Returns a list of places inside the bounding box"""
@@ -60,12 +302,8 @@ def GetPlaceListInRect(upperLeft, lowerRight, ptype, MaxItems):
     lr.Lat = float(lowerRight.Lat)
     lr.Lon = float(lowerRight.Lon)
 
-    if (ptype not in GetPlaceTypes()):
-        raise pyTerraError("type %s not available" % ptype)
-    try:
-        resp = client.service.GetPlaceListInRect(ul, lr, ptype, MaxItems)
-    except Exception, e:
-        raise pyTerraError(e)
+    ptype = normalize_place_type(ptype)
+    resp = call("GetPlaceListInRect", ul, lr, ptype, MaxItems)
 
     return resp
 
@@ -78,10 +316,7 @@ def GetPlaceFacts(place):
     p.State = place.State
     p.Country = place.Country
     
-    try:
-        resp = client.service.GetPlaceFacts(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("GetPlaceFacts", p)
 
     return resp
 
@@ -96,22 +331,10 @@ def GetAreaFromPt(center, theme, scale, displayPixWidth, displayPixHeight):
     displayPixHeight = int(displayPixHeight)
     displayPixWidth = int(displayPixHeight)
     
-    if (scale not in GetScales()):
-        raise pyTerraError("Scale '%s' is not a valid scale" % scale)
+    scale = normalize_scale(scale)
+    theme = normalize_theme(theme)
 
-    try:
-        int(theme)
-    except ValueError:
-        try:
-            theme = themes[theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % theme)
-
-
-    try:
-        resp = client.service.GetAreaFromPt(p, theme, scale, displayPixWidth, displayPixHeight)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("GetAreaFromPt", p, theme, scale, displayPixWidth, displayPixHeight)
 
     return resp
     
@@ -119,31 +342,12 @@ def GetAreaFromPt(center, theme, scale, displayPixWidth, displayPixHeight):
 def GetAreaFromTileId(id, displayPixWidth=200, displayPixHeight=200):
     """Returns the bounding box for a TileMeta.Id"""
 
-    t = client.factory.create("TileId")
-    t.X = int(id.X)
-    t.Y = int(id.Y)
-    t.Scene = int(id.Scene)
-    t.Theme = id.Theme
-    t.Scale = id.Scale
+    t = make_tile_id(id)
     
     displayPixHeight = int(displayPixHeight)
     displayPixWidth = int(displayPixHeight)
     
-    if (t.Scale not in GetScales()):
-        raise pyTerraError("Scale '%s' is not a valid scale" % t.Scale)
-
-    try:
-        int(id.Theme)
-    except ValueError:
-        try:
-            t.Theme = themes[id.Theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % id.Theme)
-
-    try:
-        resp = client.service.GetAreaFromTileId(t, displayPixWidth, displayPixHeight)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("GetAreaFromTileId", t, displayPixWidth, displayPixHeight)
 
     return resp
             
@@ -175,19 +379,9 @@ def GetAreaFromRect(upperLeft, lowerRight, theme, scale):
     lr.Lat = float(lowerRight.Lat)
     lr.Lon = float(lowerRight.Lon)
 
-    try:
-        int(theme)
-    except ValueError:
-        try:
-            theme = themes[theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % theme)
-    if (scale not in GetScales()):
-        raise pyTerraError("scale %s not available" % scale)
-    try:
-        resp = client.service.GetAreaFromRect(ul, lr, theme, scale)
-    except Exception, e:
-        raise pyTerraError(e)
+    theme = normalize_theme(theme)
+    scale = normalize_scale(scale)
+    resp = call("GetAreaFromRect", ul, lr, theme, scale)
 
     return resp
 
@@ -195,28 +389,8 @@ def GetAreaFromRect(upperLeft, lowerRight, theme, scale):
 def GetTileMetaFromTileId(id):
     """Gets the metadata for a TileMeta.Id"""
 
-    t = client.factory.create("TileId")
-    t.X = int(id.X)
-    t.Y = int(id.Y)
-    t.Scene = int(id.Scene)
-    t.Theme = id.Theme
-    t.Scale = id.Scale
-    
-    if (t.Scale not in GetScales()):
-        raise pyTerraError("Scale '%s' is not a valid scale" % t.Scale)
-
-    try:
-        int(id.Theme)
-    except ValueError:
-        try:
-            t.Theme = themes[id.Theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % id.Theme)
-
-    try:
-        resp = client.service.GetTileMetaFromTileId(t)
-    except Exception, e:
-        raise pyTerraError(e)
+    t = make_tile_id(id)
+    resp = call("GetTileMetaFromTileId", t)
 
     return resp    
 
@@ -228,18 +402,8 @@ def GetTileMetaFromLonLatPt(point, theme, scale):
     p.Lat = float(point.Lat)
     p.Lon = float(point.Lon)
 
-    try:
-        int(theme)
-    except ValueError:
-        try:
-            theme = themes[theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % theme)
-
-    try:
-        resp = client.service.GetTileMetaFromLonLatPt(p, theme, scale)
-    except Exception, e:
-        raise pyTerraError(e)
+    theme = normalize_theme(theme)
+    resp = call("GetTileMetaFromLonLatPt", p, theme, scale)
 
     return resp
 
@@ -247,30 +411,35 @@ def GetTileMetaFromLonLatPt(point, theme, scale):
 def GetTile(id):
     """Returns the tile image data"""
 
-    t = client.factory.create("TileId")
-    t.X = int(id.X)
-    t.Y = int(id.Y)
-    t.Scene = int(id.Scene)
-    t.Theme = id.Theme
-    t.Scale = id.Scale
-    
-    if (t.Scale not in GetScales()):
-        raise pyTerraError("Scale '%s' is not a valid scale" % t.Scale)
-
-    try:
-        int(id.Theme)
-    except ValueError:
-        try:
-            t.Theme = themes[id.Theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % id.Theme)
-            
-    try:
-        resp = client.service.GetTile(t)
-    except Exception, e:
-        raise pyTerraError(e)
+    t = make_tile_id(id)
+    resp = call("GetTile", t)
 
     return resp
+
+def GetTileData(id, fast=None):
+    """Returns the decoded image data of a tile.  Unless fast is false, or
+    None and :data:`fastGetTile` is false, the request is made by
+    :mod:`pyTerra.fastpath` instead of suds, which is much cheaper and gives
+    the same bytes.  The fast path needs a transport with a post method,
+    such as the default :class:`pyTerra.transport.KeepAliveTransport`;
+    suds is used with any other"""
+    if fast is None:
+        fast = fastGetTile
+    transport = client.options.transport
+    if fast and hasattr(transport, 'post'):
+        import fastpath
+        x, y, scene = int(id.X), int(id.Y), int(id.Scene)
+        data = retried(fastpath.get_tile, transport, normalize_theme(id.Theme),
+                       normalize_scale(id.Scale), scene, x, y)
+    else:
+        data = GetTile(id)
+        if data:
+            data = base64.decodestring(data)
+    if not data:
+        raise pyTerraError("There is no image for tile %s, %s of scene %s" %
+                           (id.X, id.Y, id.Scene))
+    return data
+
 def ConvertLonLatPtToNearestPlace(point):
     """Converts a lat/lon point into a place"""
 
@@ -278,41 +447,58 @@ def ConvertLonLatPtToNearestPlace(point):
     p.Lat = float(point.Lat)
     p.Lon = float(point.Lon)
 
-    try:
-        resp = client.service.ConvertLonLatPtToNearestPlace(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("ConvertLonLatPtToNearestPlace", p)
 
     return resp
 
 
-def ConvertUtmPtToLonLatPt(utm):
-    """Converts a UTM point into lat/lon"""
+def ConvertUtmPtToLonLatPt(utm, remote=None):
+    """Converts a UTM point into lat/lon.  The conversion is done locally
+    by :mod:`pyTerra.projection` unless remote (or :data:`remoteConversions`
+    when remote is None) is true"""
+
+    x = float(utm.X)
+    y = float(utm.Y)
+    zone = int(utm.Zone)
+
+    if remote is None:
+        remote = remoteConversions
+    if not remote:
+        lon, lat = projection.utm_to_lonlat(x, y, zone)
+        return LonLatPt(lon, lat)
 
     p = client.factory.create("UtmPt")
-    p.X = float(utm.X)
-    p.Y = float(utm.Y)
-    p.Zone = int(utm.Zone)
+    p.X = x
+    p.Y = y
+    p.Zone = zone
 
-    try:
-        resp = client.service.ConvertUtmPtToLonLatPt(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("ConvertUtmPtToLonLatPt", p)
 
     return resp
 
 
-def ConvertLonLatPtToUtmPt(point):
-    """Converts a lat/lon point into UTM"""
+def ConvertLonLatPtToUtmPt(point, zone=None, remote=None):
+    """Converts a lat/lon point into UTM.  The zone is chosen from the
+    longitude unless one is given.  The conversion is done locally by
+    :mod:`pyTerra.projection` unless remote (or :data:`remoteConversions`
+    when remote is None) is true"""
+
+    lat = float(point.Lat)
+    lon = float(point.Lon)
+
+    if remote is None:
+        remote = remoteConversions
+    if not remote:
+        x, y, zone = projection.lonlat_to_utm(lon, lat, zone)
+        return UtmPt(x, y, zone)
+    if zone is not None:
+        raise pyTerraError("The TerraServer does not convert into a given zone")
 
     p = client.factory.create("LonLatPt")
-    p.Lat = float(point.Lat)
-    p.Lon = float(point.Lon)
+    p.Lat = lat
+    p.Lon = lon
 
-    try:
-        resp = client.service.ConvertLonLatPtToUtmPt(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("ConvertLonLatPtToUtmPt", p)
 
     return resp
 
@@ -324,28 +510,15 @@ def ConvertPlaceToLonLatPt(place):
     p.State = place.State
     p.Country = place.Country
     
-    try:
-        resp = client.service.ConvertPlaceToLonLatPt(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("ConvertPlaceToLonLatPt", p)
 
     return resp
 
 def GetTheme(theme):
     """Returns theme information about a theme (Photo, Topo, or Relief)"""
 
-    try:
-        int(theme)
-    except ValueError:
-        try:
-            theme = themes[theme.upper()]
-        except KeyError:
-            raise pyTerraError("Theme %s not found" % theme)
-
-    try:
-        resp = client.service.GetTheme(theme=theme)
-    except Exception, e:
-        raise pyTerraError(e)
+    theme = normalize_theme(theme)
+    resp = call("GetTheme", theme)
 
     return resp
 
@@ -361,13 +534,9 @@ def CountPlacesInRect(upperLeft, lowerRight, ptype):
     lr.Lat = float(lowerRight.Lat)
     lr.Lon = float(lowerRight.Lon)
 
-    if (ptype not in GetPlaceTypes()):
-        raise pyTerraError("type %s not available" % ptype)    
+    ptype = normalize_place_type(ptype)
 
-    try:
-        resp = client.service.CountPlacesInRect(ul, lr, ptype)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("CountPlacesInRect", ul, lr, ptype)
 
     return resp
 
@@ -379,9 +548,6 @@ def GetLatLonMetrics(point):
     p.Lat = float(point.Lat)
     p.Lon = float(point.Lon)
 
-    try:
-        resp = client.service.GetLatLonMetrics(p)
-    except Exception, e:
-        raise pyTerraError(e)
+    resp = call("GetLatLonMetrics", p)
 
     return resp
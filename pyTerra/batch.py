@@ -0,0 +1,231 @@
+"""Downloading many extents at once.
+
+A :class:`Batch` takes any number of extents, each at its own Scale and
+Theme if need be, works out the tiles of all of them, and fetches each
+distinct tile once, through one pool of
+downloads, into a tile cache they share.  Extents that overlap, as
+neighbouring parcels or the pieces of a corridor do, no longer fetch
+their common tiles again and again.  Each extent's mosaic is made from
+the cache as soon as all of its tiles are in::
+
+    from pyTerra import batch
+
+    b = batch.Batch('Scale1m', 'DOQ', '/data/tiles')
+    for name, upperLeft, lowerRight in batch.read_geojson('parcels.json'):
+        b.add(name, upperLeft, lowerRight)
+    b.write('/data/out')
+
+Extents are given by their upper left and lower right corners, as for a
+TerraImage, and can be read from CSV files with :func:`read_csv` or
+GeoJSON files with :func:`read_geojson`.
+"""
+
+import csv
+import os
+import Queue
+import threading
+
+try:
+    import json
+except ImportError:
+    json = None
+
+import api
+import image
+import projection
+
+
+def read_csv(filename):
+    """Reads extents from a CSV file with a header row.  Each row has a
+    name and either west, south, east and north longitudes and latitudes
+    or minx, miny, maxx, maxy and zone in UTM.  Returns a list of
+    (name, upperLeft, lowerRight)"""
+    extents = []
+    f = open(filename, 'rb')
+    try:
+        for i, row in enumerate(csv.DictReader(f)):
+            name = row.get('name') or str(i)
+            if row.get('zone'):
+                zone = int(row['zone'])
+                ul = api.UtmPt(float(row['minx']), float(row['maxy']), zone)
+                lr = api.UtmPt(float(row['maxx']), float(row['miny']), zone)
+            else:
+                ul = api.LonLatPt(float(row['west']), float(row['north']))
+                lr = api.LonLatPt(float(row['east']), float(row['south']))
+            extents.append((name, ul, lr))
+    finally:
+        f.close()
+    return extents
+
+def _positions(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+        return
+    for c in coordinates:
+        for position in _positions(c):
+            yield position
+
+def read_geojson(filename):
+    """Reads extents from a GeoJSON FeatureCollection in longitude and
+    latitude.  The extent of each feature is its bbox, or the bounds of its
+    geometry, and its name the name property or its id.  Returns a list of
+    (name, upperLeft, lowerRight)"""
+    if json is None:
+        raise ImportError("json is required to read GeoJSON")
+    f = open(filename)
+    try:
+        collection = json.load(f)
+    finally:
+        f.close()
+    extents = []
+    for i, feature in enumerate(collection.get('features', [])):
+        properties = feature.get('properties') or {}
+        name = properties.get('name') or feature.get('id') or i
+        bbox = feature.get('bbox')
+        if bbox is None:
+            positions = list(_positions(feature['geometry']['coordinates']))
+            lons = [p[0] for p in positions]
+            lats = [p[1] for p in positions]
+            bbox = (min(lons), min(lats), max(lons), max(lats))
+        extents.append((unicode(name), api.LonLatPt(bbox[0], bbox[3]),
+                        api.LonLatPt(bbox[2], bbox[1])))
+    return extents
+
+
+class Batch(object):
+    """Many extents downloaded together, by default at Scale and Theme.
+    cache is the tile cache, a directory or cache object as for a
+    TerraImage, that the tiles are fetched into and the mosaics made from"""
+    def __init__(self, Scale, Theme, cache, memoryCache=None):
+        self.Scale = Scale
+        self.Theme = Theme
+        self.images = []      # (name, TerraImage)
+        self.progress = None  # called as progress(done, failed, total)
+        self.fetcher = image.TerraImage(None, None, Scale, Theme, None, cache,
+                                        memoryCache)
+        if self.fetcher.cache is None:
+            raise api.pyTerraError("A batch needs a tile cache")
+
+    def add(self, name, upperLeft, lowerRight, zone=None, Scale=None,
+            Theme=None):
+        """Adds an extent, at the batch's Scale and Theme unless others are
+        given.  Its UTM zone is that of the corners, if they are UTM, or
+        else the one its center falls in, unless zone is given.  Returns its
+        TerraImage"""
+        if zone is None:
+            zone = getattr(upperLeft, 'Zone', None)
+        if zone is None:
+            zone = projection.zone_for((float(upperLeft.Lon) +
+                                        float(lowerRight.Lon)) / 2)
+        # share the fetcher's cache, so that the tiles it fetches are found
+        img = image.TerraImage(upperLeft, lowerRight, Scale or self.Scale,
+                               Theme or self.Theme, zone, self.fetcher.cache)
+        img.memoryCache = self.fetcher.memoryCache
+        img.get_extent()
+        self.images.append((name, img))
+        return img
+
+    def __len__(self):
+        return len(self.images)
+
+    def plan(self):
+        """Returns the distinct tiles of all the extents, in the order they
+        are first needed, and a dict of the indexes in :attr:`images` of the
+        extents each tile is in, keyed on tile.key().  The key holds the
+        tile's Theme, zone and Scale, so extents share only the very same
+        tiles"""
+        tiles = []
+        owners = {}
+        for i, (name, img) in enumerate(self.images):
+            for tile in img.tileslist:
+                key = tile.key()
+                if key not in owners:
+                    owners[key] = []
+                    tiles.append(tile)
+                owners[key].append(i)
+        return tiles, owners
+
+    def iter_mosaics(self):
+        """Fetches every distinct tile once, and yields (name, image,
+        failures) for each extent as soon as all of its tiles have been
+        dealt with.  The image is the extent's TerraImage, whose tiles are
+        now in the cache, and failures the (tile, error) of those of its
+        tiles that could not be fetched.  At most the fetcher's queueSize
+        fetched tiles wait while the mosaics are being written"""
+        tiles, owners = self.plan()
+        remaining = [len(img.tileslist) for name, img in self.images]
+        failures = [[] for i in self.images]
+        for i, count in enumerate(remaining):
+            if count == 0:
+                yield self.images[i] + (failures[i],)
+        doneQueue = image.DoneQueue(self.fetcher.queueSize)
+        feeder = threading.Thread(target=self.feed_tiles,
+                                  args=(tiles, doneQueue))
+        feeder.setDaemon(1)
+        feeder.start()
+        done = failed = 0
+        try:
+            for n in xrange(len(tiles)):
+                tile, error = doneQueue.get()
+                # the mosaics are made from the cache, do not hold on to the
+                # data of every tile until the batch is done
+                tile.imagedata = None
+                if error is None:
+                    done += 1
+                else:
+                    failed += 1
+                if self.progress is not None:
+                    self.progress(done, failed, len(tiles))
+                for i in owners[tile.key()]:
+                    if error is not None:
+                        failures[i].append((tile, error))
+                    remaining[i] -= 1
+                    if remaining[i] == 0:
+                        yield self.images[i] + (failures[i],)
+        finally:
+            doneQueue.stop()
+
+    def feed_tiles(self, tiles, doneQueue):
+        """Puts the cached tiles on the doneQueue and hands the others to
+        one Retriever pool, which puts them on the doneQueue once
+        downloaded"""
+        fetcher = self.fetcher
+        threads = fetcher.pool_size(tiles)
+        tileQueue = Queue.Queue(threads * 2)
+        for i in range(threads):
+            image.Retriever(tileQueue, doneQueue,
+                            fetch=fetcher.fetch_tile).start()
+        for tile in tiles:
+            if doneQueue.stopped:
+                break
+            if tile.key() in fetcher.cache:
+                doneQueue.put((tile, None))
+            else:
+                tileQueue.put(tile)
+        if doneQueue.stopped:
+            # the tiles still queued are not wanted
+            while True:
+                try:
+                    tileQueue.get_nowait()
+                except Queue.Empty:
+                    break
+        for i in range(threads):
+            tileQueue.put(None)
+
+    def write(self, directory, ext='.tif', stream=False, worldfile=True):
+        """Fetches the tiles and writes each extent's mosaic to
+        directory/name + ext, with a worldfile unless worldfile is false.
+        Extents with tiles that could not be fetched are not written.
+        Returns a dict of the failures of those, keyed on their names"""
+        failed = {}
+        for name, img, failures in self.iter_mosaics():
+            if failures:
+                failed[name] = failures
+                continue
+            filename = os.path.join(directory, '%s%s' % (name, ext))
+            img.write(filename, stream)
+            if worldfile:
+                img.write_worldfile(os.path.splitext(filename)[0] + '.wld')
+            # the mosaic is on disk, free it
+            img.__dict__.pop('image', None)
+        return failed
@@ -0,0 +1,542 @@
+"""Tile caches for :class:`pyTerra.image.TerraImage`.
+
+A cache maps a tile key, (Theme, Scene, X, Y, Scale), to the tile's
+encoded image data with :meth:`get` and :meth:`put`.
+
+:class:`DirectoryCache` is the original layout, one file per tile in a
+single directory, and is what a ``cacheDir`` path gives you.
+:class:`ManagedCache` spreads the files over hashed subdirectories, keeps
+an index so that lookups do not touch the filesystem, and evicts the
+least recently (or least frequently) used tiles to stay within a byte
+budget.
+
+:class:`MemoryCache` keeps tiles in memory and is meant to be shared by
+every TerraImage in a process.  :class:`TieredCache` puts it in front of
+a disk cache and counts the hits of each tier.
+"""
+
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+def tile_key(tile):
+    """Returns the cache key of a tile or TileId"""
+    return (tile.Theme, tile.Scene, tile.X, tile.Y, tile.Scale)
+
+def key_name(key):
+    """Returns the Theme-Scene-X-Y-Scale name of a key"""
+    return '%s-%s-%s-%s-%s' % tuple(key)
+
+def _write(filename, data):
+    # write to a temporary name first so a partial tile is never read
+    tmp = '%s.%d.%d' % (filename, os.getpid(), threading.current_thread().ident)
+    f = open(tmp, 'wb')
+    f.write(data)
+    f.close()
+    os.rename(tmp, filename)
+
+
+class DirectoryCache(object):
+    """Caches each tile as root/Theme-Scene-X-Y-Scale.gif"""
+    def __init__(self, root):
+        self.root = root
+
+    def filename(self, key):
+        return os.path.join(self.root, key_name(key) + '.gif')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def get(self, key):
+        """Returns the tile's data, or None if it is not cached"""
+        try:
+            f = open(self.filename(key), 'rb')
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def put(self, key, data):
+        _write(self.filename(key), data)
+
+
+class ManagedCache(object):
+    """Caches tiles under root in two levels of hashed subdirectories, and
+    keeps their total size under maxBytes.  policy is 'lru' or 'lfu'.
+
+    The index of cached tiles is held in memory and journaled to
+    root/index, so hits and misses are answered without a stat.  When the
+    budget is exceeded, tiles are evicted until the cache is back down to
+    lowWater of it.  Call :meth:`flush` (or :meth:`close`) to save the
+    current use order and hit counts, and to compact the journal;
+    :class:`pyTerra.image.TerraImage` does after each download.
+
+    Several ManagedCaches, in one process or many, can share root.  The
+    journal is written under an exclusive lock on root/index.lock, after
+    reading in what the others wrote since, so the budget holds for all of
+    them together, and flush merges their entries into the index it saves.
+    Without fcntl (on Windows) there is no lock, and only one ManagedCache
+    may use root at a time"""
+    lowWater = 0.9
+
+    def __init__(self, root, maxBytes=2**30, policy='lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("Unknown cache policy %s" % policy)
+        if OrderedDict is None:
+            raise ImportError("ManagedCache needs collections.OrderedDict")
+        self.root = root
+        self.maxBytes = maxBytes
+        self.policy = policy
+        self.size = 0
+        self.evictions = 0
+        self.entries = OrderedDict()   # name -> [size, hits], oldest first
+        self._lock = threading.RLock()
+        self._depth = 0
+        self.lockfile = None
+        self.journal = None
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.indexfile = os.path.join(root, 'index')
+        self._lock_index()
+        try:
+            if os.path.isfile(self.indexfile):
+                self.load()
+            else:
+                self.rebuild()
+        finally:
+            self._unlock_index()
+
+    def filename(self, key):
+        return self._filename(key_name(key))
+
+    def _filename(self, name):
+        h = hashlib.md5(name).hexdigest()
+        return os.path.join(self.root, h[:2], h[2:4], name + '.gif')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key_name(key) in self.entries
+
+    def get(self, key):
+        """Returns the tile's data, or None if it is not cached"""
+        name = key_name(key)
+        self._lock.acquire()
+        try:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                return None
+            entry[1] += 1
+            self.entries[name] = entry
+        finally:
+            self._lock.release()
+        try:
+            f = open(self._filename(name), 'rb')
+        except IOError:
+            # removed behind our back
+            self._discard(name)
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def put(self, key, data):
+        name = key_name(key)
+        filename = self._filename(name)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # made by another thread
+                if not os.path.isdir(dirname):
+                    raise
+        tmp = '%s.%d.%d' % (filename, os.getpid(),
+                            threading.current_thread().ident)
+        f = open(tmp, 'wb')
+        f.write(data)
+        f.close()
+        self._lock_index()
+        try:
+            self._catch_up()
+            # journaled before the rename, so that a crash in between leaves
+            # an entry without a tile, which get drops, rather than a tile
+            # that is never evicted
+            self._journal('+ %s %d\n' % (name, len(data)))
+            os.rename(tmp, filename)
+            self._set(name, len(data))
+            if self.size > self.maxBytes:
+                self.evict()
+        finally:
+            self._unlock_index()
+
+    def refresh(self, key):
+        """Brings the index entry of key up to date with the tile on disk,
+        which another process may have stored or removed.  Returns whether
+        the tile is cached"""
+        name = key_name(key)
+        try:
+            size = os.path.getsize(self._filename(name))
+        except OSError:
+            self._discard(name)
+            return False
+        self._lock_index()
+        try:
+            self._catch_up()
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != size:
+                self._journal('+ %s %d\n' % (name, size))
+                self._set(name, size)
+                if self.size > self.maxBytes:
+                    self.evict()
+        finally:
+            self._unlock_index()
+        return True
+
+    def _set(self, name, size, hits=None):
+        old = self.entries.pop(name, None)
+        if old is not None:
+            self.size -= old[0]
+            if hits is None:
+                hits = old[1]
+        self.entries[name] = [size, hits or 0]
+        self.size += size
+
+    def evict(self):
+        """Removes tiles until the cache is down to lowWater of maxBytes"""
+        target = self.maxBytes * self.lowWater
+        self._lock_index()
+        try:
+            self._catch_up()
+            if self.policy == 'lru':
+                victims = self.entries.keys()
+            else:
+                victims = sorted(self.entries,
+                                 key=lambda n: self.entries[n][1])
+            for name in victims:
+                if self.size <= target:
+                    break
+                self._remove(name)
+                self.evictions += 1
+        finally:
+            self._unlock_index()
+
+    def _discard(self, name):
+        self._lock_index()
+        try:
+            self._catch_up()
+            self._remove(name)
+        finally:
+            self._unlock_index()
+
+    def _remove(self, name):
+        # called with the index locked
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+        self.size -= entry[0]
+        self._journal('- %s\n' % name)
+        try:
+            os.remove(self._filename(name))
+        except OSError:
+            pass
+
+    def _lock_index(self):
+        """Takes the lock on the index against other ManagedCaches.  It may
+        be taken again by the thread that holds it"""
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            if self.lockfile is None:
+                self.lockfile = open(os.path.join(self.root, 'index.lock'),
+                                     'a+b')
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_index(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _journal(self, line):
+        # called with the index locked and caught up
+        self.journal.write(line)
+        self.journal.flush()
+        self._offset = self.journal.tell()
+
+    def _open_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.indexfile, 'a')
+        self.journal.seek(0, 2)
+        self._offset = self.journal.tell()
+        self._inode = os.fstat(self.journal.fileno()).st_ino
+
+    def _catch_up(self):
+        """Reads in what other ManagedCaches journaled since, or the whole
+        index when one of them saved it afresh.  Called with the index
+        locked"""
+        try:
+            st = os.stat(self.indexfile)
+        except OSError:
+            st = None
+        if st is None:
+            # removed, save what we know
+            self._snapshot()
+        elif st.st_ino != self._inode:
+            # keep our hit counts of the tiles that are still there
+            old = self.entries
+            self.entries = OrderedDict()
+            self.size = 0
+            self.load()
+            for name, entry in self.entries.iteritems():
+                if name in old:
+                    entry[1] = max(entry[1], old[name][1])
+        elif st.st_size > self._offset:
+            f = open(self.indexfile)
+            f.seek(self._offset)
+            self._apply(f)
+            self._offset = f.tell()
+            f.close()
+
+    def _apply(self, lines):
+        for line in lines:
+            parts = line.split()
+            try:
+                if parts[0] == '-' and len(parts) == 2:
+                    entry = self.entries.pop(parts[1], None)
+                    if entry is not None:
+                        self.size -= entry[0]
+                elif parts[0] == '+' and len(parts) in (3, 4):
+                    # a snapshot line also carries the hit count
+                    hits = len(parts) > 3 and int(parts[3]) or None
+                    self._set(parts[1], int(parts[2]), hits)
+            except (IndexError, ValueError):
+                # a torn line, from a process that died mid-write
+                pass
+
+    def load(self):
+        """Reads the index journal"""
+        f = open(self.indexfile)
+        self._apply(f)
+        f.close()
+        self._open_journal()
+
+    def rebuild(self):
+        """Rebuilds the index from the tiles on disk, in the order they
+        were last modified"""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for fname in filenames:
+                if fname.endswith('.gif'):
+                    st = os.stat(os.path.join(dirpath, fname))
+                    found.append((st.st_mtime, fname[:-4], st.st_size))
+        found.sort()
+        for mtime, name, size in found:
+            self.entries[name] = [size, 0]
+            self.size += size
+        self._snapshot()
+
+    def _snapshot(self):
+        tmp = '%s.%d.tmp' % (self.indexfile, os.getpid())
+        f = open(tmp, 'w')
+        for name, (size, hits) in self.entries.items():
+            f.write('+ %s %d %d\n' % (name, size, hits))
+        f.close()
+        os.rename(tmp, self.indexfile)
+        self._open_journal()
+
+    def flush(self):
+        """Saves the index, with use order and hit counts, and compacts
+        the journal"""
+        self._lock_index()
+        try:
+            self._catch_up()
+            self._snapshot()
+        finally:
+            self._unlock_index()
+
+    def close(self):
+        self._lock_index()
+        try:
+            self.flush()
+            self.journal.close()
+        finally:
+            self._unlock_index()
+        if self.lockfile is not None:
+            self.lockfile.close()
+            self.lockfile = None
+
+
+class MemoryCache(object):
+    """Keeps up to maxBytes of tiles in memory, dropping the least recently
+    used.  With decoded it also keeps decoded PIL images of the tiles, see
+    :meth:`get_image`, which count towards maxBytes as well"""
+    def __init__(self, maxBytes=64 * 2**20, decoded=False):
+        if OrderedDict is None:
+            raise ImportError("MemoryCache needs collections.OrderedDict")
+        self.maxBytes = maxBytes
+        self.decoded = decoded
+        self.size = 0
+        self.entries = OrderedDict()   # (kind, key) -> (value, size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return ('data', key) in self.entries
+
+    def _get(self, ekey):
+        self._lock.acquire()
+        try:
+            entry = self.entries.pop(ekey, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[ekey] = entry
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def _put(self, ekey, value, size):
+        if size > self.maxBytes:
+            return
+        self._lock.acquire()
+        try:
+            old = self.entries.pop(ekey, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[ekey] = (value, size)
+            self.size += size
+            while self.size > self.maxBytes:
+                oldest, (value, size) = self.entries.popitem(last=False)
+                self.size -= size
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """Returns the tile's data, or None if it is not cached"""
+        return self._get(('data', key))
+
+    def put(self, key, data):
+        self._put(('data', key), data, len(data))
+
+    def get_image(self, key):
+        """Returns the tile's decoded image, or None if it is not cached"""
+        return self._get(('image', key))
+
+    def put_image(self, key, image):
+        if self.decoded:
+            width, height = image.size
+            self._put(('image', key), image,
+                      width * height * len(image.getbands()))
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.entries.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+
+class TieredCache(object):
+    """Looks tiles up in each tier in turn, fastest first, and copies a hit
+    into the tiers before the one it was found in.  put stores into every
+    tier.  The hits and lookups of each tier are counted, see
+    :meth:`stats`"""
+    def __init__(self, *tiers):
+        self.tiers = tiers
+        self.root = getattr(tiers[-1], 'root', None)
+        self.lookups = [0] * len(tiers)
+        self.hits = [0] * len(tiers)
+        self._lock = threading.Lock()
+
+    def filename(self, key):
+        return self.tiers[-1].filename(key)
+
+    def __contains__(self, key):
+        for tier in self.tiers:
+            if key in tier:
+                return True
+        return False
+
+    def get(self, key):
+        """Returns the tile's data, or None if no tier has it"""
+        for i, tier in enumerate(self.tiers):
+            data = tier.get(key)
+            self._lock.acquire()
+            self.lookups[i] += 1
+            if data is not None:
+                self.hits[i] += 1
+            self._lock.release()
+            if data is not None:
+                for faster in self.tiers[:i]:
+                    faster.put(key, data)
+                return data
+        return None
+
+    def put(self, key, data):
+        for tier in self.tiers:
+            tier.put(key, data)
+
+    def flush(self):
+        """Flushes the tiers that keep an index"""
+        for tier in self.tiers:
+            flush = getattr(tier, 'flush', None)
+            if flush is not None:
+                flush()
+
+    def refresh(self, key):
+        """Refreshes the tiers that keep an index, see
+        :meth:`ManagedCache.refresh`"""
+        found = False
+        for tier in self.tiers:
+            refresh = getattr(tier, 'refresh', None)
+            if refresh is not None and refresh(key):
+                found = True
+        return found
+
+    def stats(self):
+        """Returns a (name, hits, lookups, hit ratio) tuple for each tier"""
+        self._lock.acquire()
+        try:
+            return [(tier.__class__.__name__, hits, lookups,
+                     lookups and float(hits) / lookups or 0.0)
+                    for tier, hits, lookups in zip(self.tiers, self.hits,
+                                                   self.lookups)]
+        finally:
+            self._lock.release()
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_memory_cache(maxBytes=64 * 2**20, decoded=False):
+    """Returns the process wide MemoryCache, making it on the first call.
+    The arguments only matter on that first call"""
+    global _shared
+    _shared_lock.acquire()
+    try:
+        if _shared is None:
+            _shared = MemoryCache(maxBytes, decoded)
+        return _shared
+    finally:
+        _shared_lock.release()
@@ -0,0 +1,179 @@
+"""Decoding tiles into a mosaic with a pool of processes.
+
+Once the tiles are cached, making a large mosaic is mostly decoding JPEGs
+and pasting them, which under the GIL runs on one core however many there
+are.  A :class:`DecodePool` hands the tiles' image data to worker
+processes that decode them, resample them if asked to, and write their
+pixels straight into an RGB buffer in shared memory, so nothing but the
+compressed tiles is passed between processes and assembly scales with the
+number of cores.  :class:`pyTerra.image.TerraImage` uses one when its
+decodeProcesses is set::
+
+    img = image.TerraImage(ul, lr, 'Scale1m', 'DOQ', 15, '/data/tiles')
+    img.decodeProcesses = 0     # one per core
+    img.download()
+"""
+
+import cStringIO
+import ctypes
+import multiprocessing
+import threading
+
+import Image
+
+import api
+import grid
+from image import tobytes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The shared buffer and its geometry, in each worker process
+_buffer = None
+_width = None
+_height = None
+_tileSide = None
+
+def _init(buffer, width, height, tileSide):
+    global _buffer, _width, _height, _tileSide
+    _buffer = buffer
+    _width = width
+    _height = height
+    _tileSide = tileSide
+
+def _paste(data, left, top):
+    """Decodes data and writes its pixels into the shared buffer with its
+    upper left corner at left, top.  Returns None, or the error as a
+    string: the pool only calls back on success"""
+    try:
+        i = Image.open(cStringIO.StringIO(data))
+        if i.mode != "RGB":
+            i = i.convert("RGB")
+        if i.size != (_tileSide, _tileSide):
+            i = i.resize((_tileSide, _tileSide), Image.ANTIALIAS)
+        # clip to the buffer, a resampled edge tile may overhang it
+        w = min(_tileSide, _width - left)
+        h = min(_tileSide, _height - top)
+        if w <= 0 or h <= 0:
+            return None
+        pixels = tobytes(i)
+        source = ctypes.cast(ctypes.c_char_p(pixels), ctypes.c_void_p).value
+        base = ctypes.addressof(_buffer)
+        stride = _tileSide * 3
+        for y in xrange(h):
+            ctypes.memmove(base + ((top + y) * _width + left) * 3,
+                           source + y * stride, w * 3)
+    except Exception, e:
+        return '%s: %s' % (e.__class__.__name__, e)
+    return None
+
+
+class DecodePool(object):
+    """Assembles a width x height RGB mosaic from tiles decoded by
+    processes worker processes, one per core if processes is 0 or None.
+    Tiles are resampled to tileSide pixels a side when they are not that
+    size already.  At most maxPending tiles wait to be decoded.
+
+    A worker that dies, killed say, takes the tile it was decoding with
+    it.  Waiting for that tile raises a pyTerraError instead of hanging"""
+    def __init__(self, width, height, processes=None, tileSide=grid.side,
+                 maxPending=None):
+        self.width = width
+        self.height = height
+        self.tileSide = tileSide
+        self.buffer = multiprocessing.RawArray(ctypes.c_ubyte,
+                                               width * height * 3)
+        processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(processes, _init,
+                                         (self.buffer, width, height,
+                                          tileSide))
+        # the pool replaces a worker that dies, but not its task
+        self.workers = list(self.pool._pool)
+        if maxPending is None:
+            maxPending = 4 * processes
+        self.maxPending = maxPending
+        self.errors = []
+        self.broken = False
+        self._done = threading.Condition()
+        self._inflight = 0
+
+    def paste(self, data, left, top):
+        """Queues the tile image data to be decoded into the mosaic with its
+        upper left corner at pixel left, top"""
+        self._done.acquire()
+        try:
+            while self._inflight >= self.maxPending:
+                self._wait()
+            self._inflight += 1
+        finally:
+            self._done.release()
+        self.pool.apply_async(_paste, (data, left, top),
+                              callback=self._pasted)
+
+    def paste_tile(self, tile):
+        """Queues a tile of a TerraImage, placed by its xind and yind"""
+        self.paste(tile.imagedata, tile.xind * self.tileSide,
+                   tile.yind * self.tileSide)
+
+    def _pasted(self, error):
+        self._done.acquire()
+        try:
+            if error is not None:
+                self.errors.append(error)
+            self._inflight -= 1
+            self._done.notifyAll()
+        finally:
+            self._done.release()
+
+    def _wait(self):
+        # called with self._done held
+        self._done.wait(1)
+        if self._inflight and not self.broken:
+            for worker in self.workers:
+                if worker.exitcode is not None:
+                    self.broken = True
+        if self.broken:
+            raise api.pyTerraError("A decoding process died, %d tiles were "
+                                   "not decoded" % self._inflight)
+
+    def wait(self):
+        """Waits for the queued tiles to be decoded.  Raises a pyTerraError
+        if any of them could not be"""
+        self._done.acquire()
+        try:
+            while self._inflight:
+                self._wait()
+        finally:
+            self._done.release()
+        if self.errors:
+            raise api.pyTerraError("%d tiles could not be decoded: %s" %
+                                   (len(self.errors), self.errors[0]))
+
+    def image(self):
+        """Waits for the tiles and returns the mosaic as a PIL image.  The
+        image shares its pixels with the buffer and is read only, PIL copies
+        it on the first change"""
+        self.wait()
+        return Image.frombuffer("RGB", (self.width, self.height), self.buffer,
+                                "raw", "RGB", 0, 1)
+
+    def array(self):
+        """Waits for the tiles and returns the mosaic as a (height, width,
+        3) uint8 NumPy array sharing the buffer"""
+        if numpy is None:
+            raise ImportError("numpy is required for DecodePool.array")
+        self.wait()
+        return numpy.frombuffer(self.buffer, dtype=numpy.uint8).reshape(
+            self.height, self.width, 3)
+
+    def close(self):
+        """Stops the worker processes.  The buffer stays valid"""
+        if self.broken:
+            # a lost task would keep join waiting for ever
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
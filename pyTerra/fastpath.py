@@ -0,0 +1,169 @@
+"""A fast path for GetTile.
+
+GetTile is called far more often than any other operation, and its
+response is little more than one large base64 string.  Through suds each
+call builds the request from the WSDL types, parses the whole response
+into a document, and the image data is then decoded from base64 once
+more, which costs more than the imagery itself.  :func:`get_tile` sends
+an :class:`Envelope` that suds made once, with the tile's fields filled
+in, and decodes the base64 of the response as it streams in, without
+parsing the rest of it.  :func:`pyTerra.api.GetTileData` takes this path
+unless told not to::
+
+    data = api.GetTileData(tile)               # the fast path
+    data = api.GetTileData(tile, fast=False)   # through suds
+
+Both give the same bytes.
+"""
+
+import binascii
+import httplib
+import re
+import socket
+import threading
+from xml.sax.saxutils import unescape
+
+from suds.transport import Transport
+
+import api
+from transport import HTTPStatusError
+
+
+class _Captured(Exception):
+    def __init__(self, request):
+        Exception.__init__(self, request.url)
+        self.request = request
+
+class _CaptureTransport(Transport):
+    """Keeps the request suds would send instead of sending it"""
+    def send(self, request):
+        raise _Captured(request)
+
+# Values suds writes into the captured envelope, where the fields of each
+# tile are put later.  None of them can appear anywhere else in it.
+_placeholders = (('Theme', -7070701), ('Scale', 'pyTerraScale'),
+                 ('Scene', -7070702), ('X', -7070703), ('Y', -7070704))
+
+
+class Envelope(object):
+    """The GetTile request of client, a suds Client, as suds itself would
+    make it: its url, headers and message with the fields of the TileId
+    left as slots"""
+    def __init__(self, client):
+        client = client.clone()
+        client.set_options(transport=_CaptureTransport())
+        t = client.factory.create("TileId")
+        for name, value in _placeholders:
+            setattr(t, name, value)
+        try:
+            client.service.GetTile(t)
+        except _Captured, e:
+            request = e.request
+        else:
+            raise api.pyTerraError("suds did not make a GetTile request")
+        self.url = request.url
+        self.headers = dict([(str(name), str(value))
+                             for name, value in request.headers.items()])
+        message = str(request.message).replace('%', '%%')
+        for name, value in _placeholders:
+            slot = '>%s<' % value
+            if message.count(slot) != 1:
+                raise api.pyTerraError("Cannot find the %s of the GetTile "
+                                       "request" % name)
+            message = message.replace(slot, '>%%(%s)s<' % name)
+        self.template = message
+
+    def message(self, theme, scale, scene, x, y):
+        """Returns the request for the tile"""
+        return self.template % dict(Theme=theme, Scale=scale, Scene=scene,
+                                    X=x, Y=y)
+
+_envelope = None
+_envelope_lock = threading.Lock()
+
+def default_envelope():
+    """Returns the Envelope of :func:`pyTerra.api.get_prototype`, making it
+    on first use"""
+    global _envelope
+    if _envelope is None:
+        _envelope_lock.acquire()
+        try:
+            if _envelope is None:
+                _envelope = Envelope(api.get_prototype())
+        finally:
+            _envelope_lock.release()
+    return _envelope
+
+
+_result = re.compile(r'<(?:[\w.-]+:)?GetTileResult(?:\s[^>]*)?(/?)>')
+_fault = re.compile(r'<(?:[\w.-]+:)?faultstring[^>]*>(.*?)</', re.S)
+_whitespace = ' \t\r\n'
+
+def read_result(response, chunkSize=65536):
+    """Reads a GetTile response from the file-like response and returns the
+    decoded GetTileResult, or None when it is missing or empty.  The data
+    is decoded chunk by chunk as it is read, and the response is read to
+    its end"""
+    tail = ''
+    while True:
+        chunk = response.read(chunkSize)
+        if not chunk:
+            return None
+        tail += chunk
+        match = _result.search(tail)
+        if match is not None:
+            break
+        # keep enough to find a start tag split between chunks
+        tail = tail[-512:]
+    if match.group(1):
+        data = ''
+    else:
+        parts = []
+        pending = tail[match.end():]
+        while True:
+            end = pending.find('<')
+            if end >= 0:
+                pending = pending[:end]
+            pending = pending.translate(None, _whitespace)
+            if end >= 0:
+                parts.append(binascii.a2b_base64(pending))
+                break
+            # base64 decodes in groups of four characters
+            n = len(pending) - len(pending) % 4
+            parts.append(binascii.a2b_base64(pending[:n]))
+            pending = pending[n:]
+            chunk = response.read(chunkSize)
+            if not chunk:
+                raise httplib.IncompleteRead(''.join(parts))
+            pending += chunk
+        data = ''.join(parts)
+    # the connection can only be used again once the response is read
+    while response.read(chunkSize):
+        pass
+    return data or None
+
+def get_tile(transport, theme, scale, scene, x, y, envelope=None):
+    """Requests the tile with transport, which must have a post method like
+    :class:`pyTerra.transport.KeepAliveTransport`, and returns its image
+    data, or None when there is none.  envelope defaults to
+    :func:`default_envelope`"""
+    if envelope is None:
+        envelope = default_envelope()
+    try:
+        response = transport.post(envelope.url,
+                                  envelope.message(theme, scale, scene, x, y),
+                                  envelope.headers)
+        if response.status >= 300:
+            body = response.read()
+            fault = _fault.search(body)
+            if fault is not None:
+                raise api.pyTerraError(unescape(fault.group(1)))
+            if response.status > 500:
+                raise HTTPStatusError(response.status, response.reason)
+            raise api.pyTerraError("%d %s" % (response.status,
+                                              response.reason))
+        return read_result(response)
+    except (httplib.HTTPException, socket.error):
+        # the connection is in an unknown state
+        transport.close()
+        raise
@@ -0,0 +1,120 @@
+"""Coalescing of concurrent tile downloads.
+
+Two TerraImages with overlapping extents, built at the same time, both
+miss the cache for the tiles they share.  :data:`flights` makes sure such
+a tile is only downloaded once per process: whoever asks first fetches
+it, and everyone asking while that is in flight waits for it and shares
+the result.  Between processes sharing a cache directory, :func:`file_locks`
+gives a lock per tile, so the second process finds the tile in the cache
+once the first has stored it.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from futures import Future
+from cache import key_name
+
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time.  A caller asking for a key
+    that is already in flight waits for that call and gets its result, or
+    its exception"""
+    def __init__(self):
+        self.calls = {}      # key -> Future
+        self.shared = 0      # calls answered by another caller's call
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """Returns fn(*args), or the result of the call in flight for key"""
+        self._lock.acquire()
+        try:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        finally:
+            self._lock.release()
+        if leader:
+            try:
+                result = fn(*args)
+            except:
+                exc_info = sys.exc_info()
+                self._forget(key)
+                future.set_exc_info(exc_info)
+            else:
+                self._forget(key)
+                future.set_result(result)
+        return future.result()
+
+    def _forget(self, key):
+        self._lock.acquire()
+        try:
+            del self.calls[key]
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self.calls)
+
+flights = SingleFlight()
+
+
+class FileLocks(object):
+    """Locks tile keys against other processes with byte range locks on
+    filename, one byte per key.  The locks are process wide, so threads
+    are kept apart with :class:`SingleFlight` instead.  Without fcntl
+    nothing is locked"""
+    span = 2**31 - 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self._lock = threading.Lock()
+
+    def offset(self, key):
+        return int(hashlib.md5(key_name(key)).hexdigest()[:8], 16) % self.span
+
+    def acquire(self, key):
+        """Waits for the lock on key and returns its offset"""
+        offset = self.offset(key)
+        if fcntl is None:
+            return offset
+        self._lock.acquire()
+        try:
+            if self.file is None:
+                self.file = open(self.filename, 'a+b')
+        finally:
+            self._lock.release()
+        fcntl.lockf(self.file.fileno(), fcntl.LOCK_EX, 1, offset)
+        return offset
+
+    def release(self, offset):
+        if fcntl is not None:
+            fcntl.lockf(self.file.fileno(), fcntl.LOCK_UN, 1, offset)
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+def file_locks(root):
+    """Returns the FileLocks of the cache directory root.  There is one per
+    directory in a process, as closing any file descriptor of the lock
+    file would drop all of the process' locks on it"""
+    filename = os.path.join(os.path.abspath(root), 'tiles.lock')
+    _file_locks_lock.acquire()
+    try:
+        locks = _file_locks.get(filename)
+        if locks is None:
+            locks = _file_locks[filename] = FileLocks(filename)
+        return locks
+    finally:
+        _file_locks_lock.release()
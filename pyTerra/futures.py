@@ -0,0 +1,178 @@
+"""Non-blocking access to the TerraServer.
+
+:class:`AsyncTerraClient` has the same operations as :mod:`pyTerra.api`,
+but each call returns a :class:`Future` straight away and the request is
+made by a pool of worker threads.  This lets one process keep many
+requests in flight::
+
+    from pyTerra import futures
+
+    client = futures.AsyncTerraClient(maxInFlight=100)
+    pending = [client.GetTile(tile) for tile in tiles]
+    for future in futures.as_completed(pending):
+        data = future.result()
+"""
+
+import Queue
+import sys
+import threading
+
+import api
+
+# The pyTerra.api operations mirrored by AsyncTerraClient
+operations = ['GetPlaceList', 'GetPlaceListInRect', 'GetPlaceFacts',
+              'GetAreaFromPt', 'GetAreaFromTileId', 'GetAreaFromRect',
+              'GetTileMetaFromTileId', 'GetTileMetaFromLonLatPt', 'GetTile',
+              'ConvertLonLatPtToNearestPlace', 'ConvertUtmPtToLonLatPt',
+              'ConvertLonLatPtToUtmPt', 'ConvertPlaceToLonLatPt', 'GetTheme',
+              'CountPlacesInRect', 'GetLatLonMetrics']
+
+
+class Future(object):
+    """The pending result of a call made through :class:`AsyncTerraClient`"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        """Tests whether the call has finished"""
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """Waits for the call and returns its result, or raises its
+        exception"""
+        self.wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Waits for the call and returns its exception, or None"""
+        self.wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise api.pyTerraError("Timed out waiting for the TerraServer")
+
+    def add_done_callback(self, fn):
+        """Calls fn(future) once the call has finished"""
+        self._lock.acquire()
+        try:
+            if not self._done.isSet():
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._lock.release()
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for fn in callbacks:
+            fn(self)
+
+
+def as_completed(futures):
+    """Yields the futures as their calls finish"""
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+    for i in range(len(futures)):
+        yield finished.get()
+
+
+class AsyncTerraClient(object):
+    """Makes :mod:`pyTerra.api` calls on up to maxInFlight worker threads.
+    Every operation in :data:`operations` is available as a method that
+    takes the same arguments and returns a :class:`Future`"""
+    def __init__(self, maxInFlight=64):
+        self.maxInFlight = maxInFlight
+        self.queue = Queue.Queue()
+        self.workers = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        while True:
+            self._lock.acquire()
+            self._idle += 1
+            self._lock.release()
+            job = self.queue.get()
+            self._lock.acquire()
+            self._idle -= 1
+            self._lock.release()
+            if job is None:
+                break
+            future, fn, args, kwargs = job
+            try:
+                result = fn(*args, **kwargs)
+            except:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """Calls fn(*args, **kwargs) on a worker and returns a Future"""
+        self._lock.acquire()
+        try:
+            # start another worker when the backlog outgrows the idle ones
+            if (len(self.workers) < self.maxInFlight and
+                self.queue.qsize() >= self._idle):
+                worker = threading.Thread(target=self._worker)
+                worker.setDaemon(1)
+                worker.start()
+                self.workers.append(worker)
+        finally:
+            self._lock.release()
+        future = Future()
+        self.queue.put((future, fn, args, kwargs))
+        return future
+
+    def map(self, name, *iterables):
+        """Calls the named operation once for each set of arguments and
+        returns the list of Futures"""
+        method = getattr(self, name)
+        return [method(*args) for args in zip(*iterables)]
+
+    def close(self):
+        """Stops the workers once the queued calls are done"""
+        self._lock.acquire()
+        try:
+            workers, self.workers = self.workers, []
+        finally:
+            self._lock.release()
+        for worker in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+
+
+def _operation(name):
+    def call(self, *args, **kwargs):
+        return self.submit(getattr(api, name), *args, **kwargs)
+    call.__name__ = name
+    call.__doc__ = "Calls :func:`pyTerra.api.%s`, returns a Future" % name
+    return call
+
+for _name in operations:
+    setattr(AsyncTerraClient, _name, _operation(_name))
+del _name
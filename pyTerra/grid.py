@@ -0,0 +1,345 @@
+"""TerraServer tile grid arithmetic.
+
+TerraServer tiles are always 200 pixels square.  For a given scale and
+UTM zone (the tile's Scene) the grid starts at the zone's origin, so tile
+X covers eastings ``X * size`` to ``(X + 1) * size`` and tile Y covers
+northings ``Y * size`` to ``(Y + 1) * size``, where size is 200 times the
+ground size of a pixel.  That lets the tiles for an extent be worked out
+without asking the TerraServer.
+"""
+
+import math
+import re
+
+import api
+import projection
+
+#Number of pixels on a side of a tile
+side = 200
+
+_scale_re = re.compile(r'^Scale(\d+)(mm|m|km)$')
+_units = {'mm': 0.001, 'm': 1.0, 'km': 1000.0}
+
+def scale_meters(scale):
+    """Returns the ground size of a pixel in meters for a Scale name such
+    as 'Scale4m' or 'Scale500mm'.  The scales are a power of two pyramid
+    around 1 meter, so 'Scale63mm' is 0.0625 m and 'Scale1km' 1024 m"""
+    m = _scale_re.match(str(scale))
+    if not m:
+        raise api.pyTerraError("Scale '%s' is not a valid scale" % scale)
+    meters = int(m.group(1)) * _units[m.group(2)]
+    return 2.0 ** round(math.log(meters, 2))
+
+def scale_name(meters):
+    """Returns the Scale name for a pixel size in meters, the inverse of
+    :func:`scale_meters`"""
+    meters = 2.0 ** round(math.log(meters, 2))
+    if meters >= 1024:
+        return 'Scale%dkm' % round(meters / 1024)
+    if meters >= 1:
+        return 'Scale%dm' % round(meters)
+    return 'Scale%dmm' % round(meters * 1000)
+
+def coarser(scale):
+    """Returns the Scale name with pixels twice the size of scale's"""
+    return scale_name(2 * scale_meters(scale))
+
+def tile_size(scale):
+    """Returns the ground size of a tile side in meters"""
+    return side * scale_meters(scale)
+
+def to_utm(point, zone):
+    """Returns the (x, y) of a point in the given UTM zone.  The point is
+    either UTM, with X, Y and optionally Zone, or lon/lat with Lon and Lat"""
+    try:
+        x, y = float(point.X), float(point.Y)
+    except AttributeError:
+        x, y, zone = projection.lonlat_to_utm(point.Lon, point.Lat, zone)
+        return x, y
+    pzone = getattr(point, 'Zone', None)
+    if pzone is not None and int(pzone) != int(zone):
+        lon, lat = projection.utm_to_lonlat(x, y, pzone)
+        x, y, zone = projection.lonlat_to_utm(lon, lat, zone)
+    return x, y
+
+
+class TilePlan(object):
+    """The block of tiles from (minx, miny) to (maxx, maxy) inclusive, at
+    one scale and in one zone"""
+    def __init__(self, minx, miny, maxx, maxy, scale, zone):
+        self.minx = int(minx)
+        self.miny = int(miny)
+        self.maxx = int(maxx)
+        self.maxy = int(maxy)
+        self.Scale = scale
+        self.Zone = int(zone)
+        self.numx = self.maxx - self.minx + 1
+        self.numy = self.maxy - self.miny + 1
+        self.width = self.numx * side
+        self.height = self.numy * side
+
+    def __repr__(self):
+        return 'TilePlan(%d, %d, %d, %d, %r, %d)' % (self.minx, self.miny,
+                                self.maxx, self.maxy, self.Scale, self.Zone)
+
+    def __eq__(self, other):
+        return (isinstance(other, TilePlan) and
+                self.key() == other.key())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def key(self):
+        return (self.minx, self.miny, self.maxx, self.maxy, self.Scale,
+                self.Zone)
+
+    def rows(self):
+        """Yields a TilePlan for each row of tiles, north to south"""
+        for y in range(self.maxy, self.miny - 1, -1):
+            yield TilePlan(self.minx, y, self.maxx, y, self.Scale, self.Zone)
+
+    def covering(self, scale):
+        """Returns the TilePlan of the tiles at another scale that cover
+        this one"""
+        factor = tile_size(scale) / tile_size(self.Scale)
+        return TilePlan(math.floor(self.minx / factor),
+                        math.floor(self.miny / factor),
+                        math.ceil((self.maxx + 1) / factor) - 1,
+                        math.ceil((self.maxy + 1) / factor) - 1,
+                        scale, self.Zone)
+
+    def offset(self, x, y):
+        """Returns the (xind, yind) of a tile in the mosaic.  Rows count
+        down from the north, the opposite of the TerraServer's Y"""
+        return x - self.minx, self.maxy - y
+
+    def pixel_box(self, x, y):
+        """Returns the (left, top, right, bottom) pixels of a tile in the
+        mosaic"""
+        xind, yind = self.offset(x, y)
+        return (xind * side, yind * side, (xind + 1) * side, (yind + 1) * side)
+
+    def pixel_window(self, left, top, right, bottom):
+        """Returns the TilePlan of the tiles that the pixel window from
+        (left, top) up to (right, bottom) of the mosaic intersects, or None
+        if it is empty or outside the mosaic"""
+        left, top = max(0, int(left)), max(0, int(top))
+        right, bottom = min(self.width, int(right)), min(self.height,
+                                                         int(bottom))
+        if left >= right or top >= bottom:
+            return None
+        return TilePlan(self.minx + left // side,
+                        self.maxy - (bottom - 1) // side,
+                        self.minx + (right - 1) // side,
+                        self.maxy - top // side, self.Scale, self.Zone)
+
+    def to_pixels(self, minx, miny, maxx, maxy):
+        """Returns the (left, top, right, bottom) pixel window of the mosaic
+        covering a UTM bounding box"""
+        size = scale_meters(self.Scale)
+        west, south, east, north = self.bounds()
+        return (int(math.floor((min(minx, maxx) - west) / size)),
+                int(math.floor((north - max(miny, maxy)) / size)),
+                int(math.ceil((max(minx, maxx) - west) / size)),
+                int(math.ceil((north - min(miny, maxy)) / size)))
+
+    def bounds(self):
+        """Returns the UTM (minx, miny, maxx, maxy) of the whole block"""
+        size = tile_size(self.Scale)
+        return (self.minx * size, self.miny * size,
+                (self.maxx + 1) * size, (self.maxy + 1) * size)
+
+    def tile_bounds(self, x, y):
+        """Returns the UTM (minx, miny, maxx, maxy) of a single tile"""
+        size = tile_size(self.Scale)
+        return (x * size, y * size, (x + 1) * size, (y + 1) * size)
+
+
+class Tile(object):
+    """A single tile.  It has the attributes of a TileId, so it can be
+    passed to the :mod:`pyTerra.api` calls, plus its offset in the mosaic
+    and, once fetched, its imagedata"""
+    __slots__ = ('X', 'Y', 'Scene', 'Theme', 'Scale', 'xind', 'yind',
+                 'imagedata')
+    def __init__(self, X, Y, Scene, Theme, Scale, xind=0, yind=0):
+        self.X = X
+        self.Y = Y
+        self.Scene = Scene
+        self.Theme = Theme
+        self.Scale = Scale
+        self.xind = xind
+        self.yind = yind
+        self.imagedata = None
+
+    def __repr__(self):
+        return 'Tile(%d, %d, %r, %r, %r)' % (self.X, self.Y, self.Scene,
+                                             self.Theme, self.Scale)
+
+    def key(self):
+        """Returns (Theme, Scene, X, Y, Scale), which identifies the tile"""
+        return (self.Theme, self.Scene, self.X, self.Y, self.Scale)
+
+
+class TileSet(object):
+    """The tiles of a :class:`TilePlan` for one theme, in the order x then
+    y.  Only the plan and an index range are stored, the :class:`Tile`
+    objects are made as they are asked for.  Slices with a step of one and
+    :meth:`chunks` give TileSets over part of the range"""
+    def __init__(self, plan, Theme, start=0, stop=None):
+        self.plan = plan
+        self.Theme = Theme
+        total = plan.numx * plan.numy
+        if stop is None or stop > total:
+            stop = total
+        self.start = max(0, min(start, stop))
+        self.stop = stop
+
+    def __repr__(self):
+        return 'TileSet(%r, %r, %d, %d)' % (self.plan, self.Theme,
+                                            self.start, self.stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def tile(self, i):
+        """Returns the :class:`Tile` at index i of the whole plan"""
+        plan = self.plan
+        x = plan.minx + i // plan.numy
+        y = plan.miny + i % plan.numy
+        xind, yind = plan.offset(x, y)
+        return Tile(x, y, plan.Zone, self.Theme, plan.Scale, xind, yind)
+
+    def __iter__(self):
+        for i in xrange(self.start, self.stop):
+            yield self.tile(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return TileSet(self.plan, self.Theme, self.start + start,
+                               self.start + max(start, stop))
+            return [self.tile(self.start + i) for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TileSet index out of range")
+        return self.tile(self.start + index)
+
+    def chunks(self, size):
+        """Yields consecutive TileSets of up to size tiles"""
+        for start in xrange(self.start, self.stop, size):
+            yield TileSet(self.plan, self.Theme, start,
+                          min(start + size, self.stop))
+
+
+class CenterOut(object):
+    """The tiles of a :class:`TilePlan` for one theme, nearest to the
+    center of a (left, top, right, bottom) pixel viewport first: those the
+    viewport intersects, then the others.  Each lot goes ring by ring
+    around the tile at the viewport's center, the tiles of a ring nearest
+    first.  Like a :class:`TileSet`, the :class:`Tile` objects are made as
+    they are iterated over"""
+    def __init__(self, plan, Theme, viewport=None):
+        self.plan = plan
+        self.Theme = Theme
+        if viewport is None:
+            viewport = (0, 0, plan.width, plan.height)
+        self.viewport = viewport
+
+    def __repr__(self):
+        return 'CenterOut(%r, %r, %r)' % (self.plan, self.Theme,
+                                          self.viewport)
+
+    def __len__(self):
+        return self.plan.numx * self.plan.numy
+
+    def __iter__(self):
+        plan = self.plan
+        left, top, right, bottom = self.viewport
+        cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+        # the tile at the center, in mosaic indices
+        a = min(max(int(cx // side), 0), plan.numx - 1)
+        b = min(max(int(cy // side), 0), plan.numy - 1)
+        whole = (0, 0, plan.numx - 1, plan.numy - 1)
+        inside = plan.pixel_window(left, top, right, bottom)
+        if inside is not None:
+            inside = (inside.minx - plan.minx, plan.maxy - inside.maxy,
+                      inside.maxx - plan.minx, plan.maxy - inside.miny)
+            for tile in self._rings(a, b, cx, cy, inside):
+                yield tile
+        for tile in self._rings(a, b, cx, cy, whole, inside):
+            yield tile
+
+    def _rings(self, a, b, cx, cy, bounds, skip=None):
+        """Yields the tiles within bounds, and not within skip, ring by ring
+        around the tile at a, b"""
+        x0, y0, x1, y1 = bounds
+        radius = max(abs(a - x0), abs(a - x1), abs(b - y0), abs(b - y1))
+        for r in xrange(radius + 1):
+            ring = []
+            for i in xrange(max(x0, a - r), min(x1, a + r) + 1):
+                for j in set([b - r, b + r]):
+                    if y0 <= j <= y1:
+                        ring.append((i, j))
+            for j in xrange(max(y0, b - r + 1), min(y1, b + r - 1) + 1):
+                for i in set([a - r, a + r]):
+                    if x0 <= i <= x1:
+                        ring.append((i, j))
+            if skip is not None:
+                ring = [(i, j) for i, j in ring
+                        if not (skip[0] <= i <= skip[2] and
+                                skip[1] <= j <= skip[3])]
+            for d, x, y, i, j in sorted([self._distance(i, j, cx, cy)
+                                         for i, j in ring]):
+                yield Tile(x, y, self.plan.Zone, self.Theme, self.plan.Scale,
+                           i, j)
+
+    def _distance(self, i, j, cx, cy):
+        # ties go in TileSet order, x then y
+        dx = (i + 0.5) * side - cx
+        dy = (j + 0.5) * side - cy
+        return (dx * dx + dy * dy, self.plan.minx + i, self.plan.maxy - j,
+                i, j)
+
+def center_out(plan, Theme, viewport=None):
+    """Returns the :class:`Tile` objects of plan for Theme, nearest to the
+    center of the mosaic first, as a :class:`CenterOut`.  With a viewport,
+    a (left, top, right, bottom) pixel window, the tiles it intersects come
+    first, and all are ordered from its center"""
+    return CenterOut(plan, Theme, viewport)
+
+def plan_rect(minx, miny, maxx, maxy, scale, zone):
+    """Returns the :class:`TilePlan` covering a UTM bounding box"""
+    size = tile_size(scale)
+    return TilePlan(math.floor(min(minx, maxx) / size),
+                    math.floor(min(miny, maxy) / size),
+                    math.floor(max(minx, maxx) / size),
+                    math.floor(max(miny, maxy) / size), scale, zone)
+
+def plan_extent(upperLeft, lowerRight, scale, zone):
+    """Returns the :class:`TilePlan` covering the extent between two
+    corner points, which may be UTM or lon/lat (see :func:`to_utm`)"""
+    ulx, uly = to_utm(upperLeft, zone)
+    lrx, lry = to_utm(lowerRight, zone)
+    return plan_rect(ulx, lry, lrx, uly, scale, zone)
+
+def verify_plan(plan, upperLeft, lowerRight, theme):
+    """Checks a plan against the TerraServer's GetAreaFromRect for the same
+    corners and raises :class:`pyTerra.api.pyTerraError` if they differ.
+    Returns the TerraServer's answer"""
+    ul = api.LonLatPt(*projection.utm_to_lonlat(
+                            *(to_utm(upperLeft, plan.Zone) + (plan.Zone,))))
+    lr = api.LonLatPt(*projection.utm_to_lonlat(
+                            *(to_utm(lowerRight, plan.Zone) + (plan.Zone,))))
+    extent = api.GetAreaFromRect(ul, lr, theme, plan.Scale)
+    nw, ne = extent.NorthWest.TileMeta.Id, extent.NorthEast.TileMeta.Id
+    se = extent.SouthEast.TileMeta.Id
+    # the TerraServer's sw.Y is sometimes one lower than se.Y, use se
+    server = (int(nw.X), int(se.Y), int(ne.X), int(nw.Y))
+    local = (plan.minx, plan.miny, plan.maxx, plan.maxy)
+    if server != local or int(nw.Scene) != plan.Zone:
+        raise api.pyTerraError("Planned tiles %s in zone %d, the TerraServer "
+                               "has %s in zone %s" % (local, plan.Zone,
+                                                      server, nw.Scene))
+    return extent
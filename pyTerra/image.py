@@ -1,24 +1,106 @@
 
 import api
+import cache
+import grid
+import tiff
+import flight
+import futures
+import limit
+import manifest
 
 from threading import Thread
 import Queue
+import itertools
 import os
 import sys
 import Image
 import cStringIO
-import base64
 import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 #Number of pixels on a side of a tile
-side = 200
+side = grid.side
+
+def tobytes(image):
+    """Returns the raw pixel data of a PIL image"""
+    try:
+        return image.tobytes()
+    except AttributeError:
+        return image.tostring()
+
+class TileFetchError(api.pyTerraError):
+    """Raised when some tiles could not be fetched.  failures is the list of
+    (tile, error) of each of them"""
+    def __init__(self, failures):
+        self.failures = failures
+        api.pyTerraError.__init__(self, "%d tiles could not be fetched, %r "
+                                  "failed with: %s" % (len(failures),
+                                                       failures[0][0],
+                                                       failures[0][1]))
+
+    def report(self):
+        """Returns a dict for each failed tile, with the tile's TileId
+        fields, its place in the mosaic and the error"""
+        return [dict(X=tile.X, Y=tile.Y, Scene=tile.Scene, Theme=tile.Theme,
+                     Scale=tile.Scale, xind=getattr(tile, 'xind', None),
+                     yind=getattr(tile, 'yind', None), error=str(error))
+                for tile, error in self.failures]
+
+def download_tile(tile):
+    """Downloads the tile's imagedata from the TerraServer.  Failed requests
+    are retried as api.retryPolicy says"""
+    tile.imagedata = api.GetTileData(tile)
+
+def capture_dates(tiles, engine=None, maxInFlight=16):
+    """Looks up the capture date of each of the tiles, maxInFlight at a
+    time or with engine, a futures.AsyncTerraClient.  Returns a dict of the
+    dates keyed on tile.key().  Each distinct tile is only looked up once,
+    even when another thread is looking it up too"""
+    def lookup(key, tile):
+        return flight.flights.do(('GetTileMetaFromTileId',) + key,
+                                 api.GetTileMetaFromTileId, tile).Capture
+    client = engine or futures.AsyncTerraClient(maxInFlight)
+    try:
+        pending = {}
+        for tile in tiles:
+            key = tile.key()
+            if key not in pending:
+                pending[key] = client.submit(lookup, key, tile)
+        dates = {}
+        errors = []
+        for key, future in pending.items():
+            error = future.exception()
+            if error is not None:
+                errors.append((key, error))
+            else:
+                dates[key] = future.result()
+    finally:
+        if engine is None:
+            client.close()
+    if errors:
+        raise api.pyTerraError("%d capture dates could not be fetched, %r "
+                               "failed with: %s" % (len(errors), errors[0][0],
+                                                    errors[0][1]))
+    return dates
 
 class Retriever(Thread):
     """Retrives tiles as part of a simple thread pool so that
-    trying to fetch 100 tiles doesn't create 100 threads"""
-    def __init__(self, tileq):
+    trying to fetch 100 tiles doesn't create 100 threads.  When a doneq
+    is given, each tile is put on it as (tile, error) once it has been
+    fetched, and passed to store first.  Tiles are fetched with fetch,
+    which sets their imagedata.  The tiles that fail are also kept, with
+    their errors, in failures"""
+    def __init__(self, tileq, doneq=None, store=None, fetch=download_tile):
         Thread.__init__(self)
         self.setDaemon(1)  # so we can kill the script easily
         self.tileq = tileq
+        self.doneq = doneq
+        self.store = store
+        self.fetch = fetch
+        self.failures = []
     def run(self):
         while True:
             tile = self.tileq.get()
@@ -26,132 +108,388 @@ class Retriever(Thread):
                 break
             
             try:
-                tile.imagedata = base64.decodestring(api.GetTile(tile))
-            except:
-                #sleep the thread for a second and try once more
-                time.sleep(1)
-                tile.imagedata = base64.decodestring(api.GetTile(tile))
+                self.fetch(tile)
+                if self.store is not None:
+                    self.store(tile)
+            except Exception, e:
+                self.failures.append((tile, e))
+                if self.doneq is not None:
+                    self.doneq.put((tile, e))
+            else:
+                if self.doneq is not None:
+                    self.doneq.put((tile, None))
+
 
 
+class DoneQueue(Queue.Queue):
+    """The queue of fetched tiles, as (tile, error), between the threads
+    fetching them and the consumer.  A consumer that stops early calls
+    :meth:`stop`, after which tiles are dropped rather than waiting for
+    room, so that the threads putting them are not blocked for good"""
+    def __init__(self, maxsize=0):
+        Queue.Queue.__init__(self, maxsize)
+        self.stopped = False
+
+    def put(self, item, block=True, timeout=None):
+        if not self.stopped:
+            Queue.Queue.put(self, item, block, timeout)
+
+    def stop(self):
+        self.mutex.acquire()
+        try:
+            self.stopped = True
+            self.queue.clear()
+            # wake the threads waiting for room, and never make them wait
+            self.maxsize = sys.maxint
+            self.not_full.notify_all()
+        finally:
+            self.mutex.release()
+
         
 class TerraImage(object):
-    def __init__(self, upperLeft, lowerRight, Scale, Theme, Zone, cacheDir=None):
+    def __init__(self, upperLeft, lowerRight, Scale, Theme, Zone, cacheDir=None,
+                 memoryCache=None):
         self.upperLeft = upperLeft
         self.lowerRight = lowerRight
         self.Scale = Scale
         self.Theme = Theme
         self.Zone = Zone
-        self.retrieverThreads = 5  # max number threads in retriever pool
+        # the limiter adapts the number of downloads at once to how the
+        # server responds, None for as many as there are retriever threads
+        self.limiter = limit.for_endpoint(api.url)
+        self.retrieverThreads = None  # max number threads in retriever pool, None for limiter.maximum
+        self.verifyExtent = False  # check the planned tiles with the TerraServer
+        self.engine = None  # a futures.AsyncTerraClient to fetch with instead
+        self.queueSize = 64  # max number of tiles waiting to be pasted
+        self.order = None  # 'center', or a (left, top, right, bottom) viewport to fetch first, see ordered_tiles
+        self.preview = None  # called as preview(image, done, total) with the partial mosaic as tiles are pasted
+        self.decodeProcesses = None  # processes decoding tiles, see decode.DecodePool, 0 for one per core, None to decode in this thread
+        self.failures = []  # (tile, error) of the tiles that failed to download
+        self.manifest = None  # a manifest.Manifest to record the tiles done in, see resume
+        self.progress = None  # called as progress(done, failed, total) as each tile is done
+        self.tilesDone = 0  # tiles done and failed so far in this download, without a manifest
+        self.tilesFailed = 0
         self.cacheDir = None
-        if cacheDir and os.path.isdir(cacheDir):
-            # use this directory to cache tiles locally
-            self.cacheDir = cacheDir
+        self.cache = None
+        if isinstance(cacheDir, basestring):
+            if cacheDir and os.path.isdir(cacheDir):
+                # use this directory to cache tiles locally
+                self.cacheDir = cacheDir
+                self.cache = cache.DirectoryCache(cacheDir)
+        elif cacheDir is not None:
+            # a tile cache such as cache.ManagedCache
+            self.cache = cacheDir
+            self.cacheDir = getattr(cacheDir, 'root', None)
+        self.memoryCache = memoryCache
+        if memoryCache is not None:
+            # a cache.MemoryCache, usually shared between TerraImages, in
+            # front of the tile cache
+            if self.cache is None:
+                self.cache = cache.TieredCache(memoryCache)
+            else:
+                self.cache = cache.TieredCache(memoryCache, self.cache)
 
     def get_extent(self):
+        """Works out the tiles covering the image's extent.  This is done
+        locally from the tile grid (see :mod:`pyTerra.grid`), and is also
+        checked against the TerraServer when verifyExtent is set"""
+        api.normalize_theme(self.Theme)
+        plan = grid.plan_extent(self.upperLeft, self.lowerRight,
+                                self.Scale, self.Zone)
+        if self.verifyExtent:
+            grid.verify_plan(plan, self.upperLeft, self.lowerRight, self.Theme)
+        self.extent = plan
+        self.numx = plan.numx
+        self.numy = plan.numy
+        self.width = plan.width
+        self.height = plan.height
+        # the tiles are only made as they are iterated over, and are turned
+        # into suds TileIds when they are sent
+        self.tileslist = grid.TileSet(plan, self.Theme)
+        return self.tileslist
+
+    def resume(self, filename):
+        """Keeps the manifest of this image's download in filename, so that
+        if it is interrupted it can be resumed by calling resume with the
+        same filename again.  Tiles are only read back from the cache, so a
+        cache is needed.  Returns the :class:`pyTerra.manifest.Manifest`"""
+        if self.cache is None:
+            raise api.pyTerraError("Resuming a download needs a tile cache")
         try:
-            self.upperLeft.X
-            self.upperLeft = api.ConvertUtmPtToLonLatPt(self.upperLeft)
-        except AttributeError:
-            pass
-        try:
-            self.lowerRight.X
-            self.lowerRight = api.ConvertUtmPtToLonLatPt(self.lowerRight)
+            self.extent
         except AttributeError:
-            pass
-        
-        self.extent = api.GetAreaFromRect(self.upperLeft, self.lowerRight,
-                                              self.Theme, self.Scale)
-        nw, ne = self.extent.NorthWest, self.extent.NorthEast
-        sw, se = self.extent.SouthWest, self.extent.SouthEast
-        startx = int(nw.TileMeta.Id.X)
-        # TerraServer has a weird bug where sometimes the sw.Y will
-        # be one lower than the se.Y.  Until it is fixed, use se
-        starty = int(se.TileMeta.Id.Y)
-        self.numx = int(ne.TileMeta.Id.X) - int(nw.TileMeta.Id.X) + 1
-        self.numy = int(nw.TileMeta.Id.Y) - int(se.TileMeta.Id.Y) + 1
-        self.width = self.numx * side
-        self.height = self.numy * side
-        tileslist = []
-        for x in range(int(nw.TileMeta.Id.X), int(nw.TileMeta.Id.X) + self.numx):
-            for y in range(int(se.TileMeta.Id.Y), int(se.TileMeta.Id.Y) + self.numy):
-                t = api.client.factory.create("TileId")
-                t.X = int(x)
-                t.Y = int(y)
-                t.Scene = int(self.Zone)
-                t.Theme = self.Theme
-                t.Scale = self.Scale
-                t.xind = (x - startx)
-                t.yind = -1*(y - starty)+(self.numy - 1) #order of tiles is opposite in PIL
-                tileslist.append(t)
-        self.tileslist = tileslist
-        return self.tileslist
+            self.get_extent()
+        if self.manifest is not None:
+            self.manifest.close()
+        self.manifest = manifest.Manifest(filename, self.extent, self.Theme)
+        return self.manifest
+
+    def tile_done(self, tile, error=None):
+        """Records a tile as done, or failed with error, in the manifest and
+        reports the progress"""
+        if self.manifest is not None:
+            self.manifest.record(tile, error)
+            done, failed, total = self.manifest.progress()
+        else:
+            if error is None:
+                self.tilesDone += 1
+            else:
+                self.tilesFailed += 1
+            done, failed = self.tilesDone, self.tilesFailed
+            total = self.numx * self.numy
+        if self.progress is not None:
+            self.progress(done, failed, total)
+
+    def start_progress(self):
+        """Starts counting the tiles done and failed afresh, at the start of
+        a download"""
+        self.tilesDone = 0
+        self.tilesFailed = 0
 
     def get_cache_filename(self, tile):
         """Return the cache filename for this tile"""
-        tid = '%s-%s-%s-%s-%s.gif' % (tile.Theme, tile.Scene, tile.X, tile.Y,
-                                     tile.Scale)
-        cachefile = os.path.join(self.cacheDir, tid)
-        return cachefile
+        return self.cache.filename(cache.tile_key(tile))
     
     def retrieve_from_cache(self, tile):
         """Fetch the tile from cache if it exists.  Return 0 if the
         tile isn't in the cache"""
-        if not self.cacheDir: return 0
-        cachefile = self.get_cache_filename(tile)
-        if os.path.isfile(cachefile):
-            f = open(cachefile, "rb")
-            tile.imagedata = f.read()
-            f.close()
-            return 1
-        return 0
+        if self.cache is None: return 0
+        data = self.cache.get(cache.tile_key(tile))
+        if data is None:
+            return 0
+        tile.imagedata = data
+        return 1
+
+    def flush_cache(self):
+        """Saves the index of the cache, with the use order and hit counts
+        of the tiles just read, for caches that keep one.  This is done at
+        the end of a download, but not after each :meth:`read_window`"""
+        flush = getattr(self.cache, 'flush', None)
+        if flush is not None:
+            flush()
 
     def add_to_cache(self, tile):
         """Save this tile to the cache"""
-        if not self.cacheDir: return
-        cachefile = self.get_cache_filename(tile)
-        f = open(cachefile, "wb")
-        f.write(tile.imagedata)
-        f.close()
-    
-    def get_tile_data(self):
-        threadList = []
-        tileQueue = Queue.Queue()
-        # Set up the thread pool.  All the threads will read tiles from the
-        # tileQueue until they read a None
-        for i in range(self.retrieverThreads):
-            retriever = Retriever(tileQueue)
-            retriever.start()
-            threadList.append(retriever)
-
-        toCacheList = []
-        for tile in self.tileslist:
-            if not self.retrieve_from_cache(tile):
-                # this tile needs to be downloaded
-                tileQueue.put(tile)
-                toCacheList.append(tile)
+        if self.cache is None: return
+        self.cache.put(cache.tile_key(tile), tile.imagedata)
 
-        # Shut down the thread pool. And wait for them to finish.
-        for i in range(self.retrieverThreads):
-            tileQueue.put(None)
-        for retriever in threadList:
-            retriever.join()
+    def fetch_tile(self, tile):
+        """Downloads the tile and adds it to the cache.  A tile that is
+        already being downloaded into the same cache, for this or another
+        TerraImage, is not downloaded again: the download in flight is
+        waited for instead.  Processes sharing the cache directory take a
+        lock on the tile, and use the cached tile if another process stored
+        it meanwhile"""
+        # a TerraImage with another cache has to store the tile itself
+        where = self.cacheDir or (self.cache is not None and id(self.cache))
+        tile.imagedata = flight.flights.do((where,) + cache.tile_key(tile),
+                                           self._fetch_tile, tile)
 
-        # Add any newly fetched tiles to the cache
-        for tile in toCacheList:
+    def _fetch_tile(self, tile):
+        if self.cacheDir is None:
+            self.request_tile(tile)
             self.add_to_cache(tile)
+            return tile.imagedata
+        locks = flight.file_locks(self.cacheDir)
+        offset = locks.acquire(cache.tile_key(tile))
+        try:
+            # a cache with an index in memory does not know what another
+            # process stored until it looks again
+            refresh = getattr(self.cache, 'refresh', None)
+            if refresh is not None:
+                refresh(cache.tile_key(tile))
+            if not self.retrieve_from_cache(tile):
+                self.request_tile(tile)
+                self.add_to_cache(tile)
+            return tile.imagedata
+        finally:
+            locks.release(offset)
 
-        n = Image.new("RGB", (self.width, self.height))
-        for tile in self.tileslist:
+    def request_tile(self, tile):
+        """Downloads the tile's imagedata within the limits of self.limiter"""
+        if self.limiter is None:
+            download_tile(tile)
+        else:
+            self.limiter.call(download_tile, tile)
+
+    def pool_size(self, tiles):
+        """Returns the number of Retriever threads to fetch tiles with"""
+        size = self.retrieverThreads
+        if size is None:
+            size = self.limiter is not None and self.limiter.maximum or 5
+        return max(1, min(size, len(tiles)))
+
+    def decode_tile(self, tile):
+        """Returns the tile's image data as a PIL image.  Decoded images are
+        kept in the memory cache when it keeps decoded tiles"""
+        memory = self.memoryCache
+        if memory is None or not memory.decoded:
+            return Image.open(cStringIO.StringIO(tile.imagedata))
+        key = cache.tile_key(tile)
+        i = memory.get_image(key)
+        if i is None:
             i = Image.open(cStringIO.StringIO(tile.imagedata))
+            i.load()
+            memory.put_image(key, i)
+        return i
+    
+    def ordered_tiles(self, order=None):
+        """Returns the tiles in the order to fetch them.  order None is the
+        plain x then y order of self.tileslist, 'center' is center out, and
+        a (left, top, right, bottom) pixel window is that viewport first,
+        see :func:`pyTerra.grid.center_out`"""
+        if order is None:
+            return self.tileslist
+        if order == 'center':
+            return grid.center_out(self.extent, self.Theme)
+        return grid.center_out(self.extent, self.Theme, order)
+
+    def iter_progressive(self, order='center', interval=0.25):
+        """Downloads the image with its tiles fetched in order (see
+        :meth:`ordered_tiles`) and yields (image, done, total) as they are
+        pasted into it, at most every interval seconds and once complete.
+        image is the mosaic being filled in, the same image every time, so
+        copy it to keep a partial one.  The complete image is kept as
+        self.image"""
+        try:
+            self.tileslist
+        except AttributeError:
+            self.get_extent()
+        self.start_progress()
+        n = Image.new("RGB", (self.width, self.height))
+        total = len(self.tileslist)
+        done = 0
+        last = time.time()
+        for tile in self.iter_tile_data(self.ordered_tiles(order)):
+            n.paste(self.decode_tile(tile), (tile.xind * side,
+                                             tile.yind * side))
+            tile.imagedata = None
+            done += 1
+            if time.time() - last >= interval and done < total:
+                last = time.time()
+                yield n, done, total
+        self.flush_cache()
+        self.image = n
+        yield n, done, total
+
+    def get_tile_data(self):
+        self.start_progress()
+        if self.decodeProcesses is not None:
+            tiles = self.ordered_tiles(self.order)
+            pool = self.decode_pool()
+            try:
+                for tile in self.iter_tile_data(tiles):
+                    pool.paste_tile(tile)
+                    tile.imagedata = None
+                self.image = pool.image()
+            finally:
+                pool.close()
+            self.flush_cache()
+            return self.image
+        if self.order is not None or self.preview is not None:
+            for n, done, total in self.iter_progressive(self.order):
+                if self.preview is not None:
+                    self.preview(n, done, total)
+            return self.image
+        n = Image.new("RGB", (self.width, self.height))
+        for tile in self.iter_tile_data(self.tileslist):
+            i = self.decode_tile(tile)
             topx = tile.xind * side
             topy = tile.yind * side
             bottomx = (tile.xind * side) + side
             bottomy = (tile.yind * side) + side
             thebox = (topx,topy,bottomx,bottomy)
             n.paste(i,thebox)
+            tile.imagedata = None
+        self.flush_cache()
         self.image = n
         return n
 
+    def decode_pool(self):
+        """Returns a :class:`pyTerra.decode.DecodePool` of
+        self.decodeProcesses processes for the image's mosaic"""
+        import decode
+        return decode.DecodePool(self.width, self.height,
+                                 self.decodeProcesses)
+
+    def iter_tile_data(self, tiles):
+        """Yields the tiles with their imagedata in the order they arrive,
+        so they can be pasted while others are still downloading.  Tiles
+        are read from the cache or downloaded, and downloaded tiles are
+        cached straight away.  At most queueSize fetched tiles wait to be
+        consumed.  Tiles that fail to download are kept in self.failures
+        and reported with a TileFetchError once all the others have been
+        yielded.  Stopping early, with an exception or by closing the
+        generator, stops the feeding and lets the Retrievers finish"""
+        doneQueue = DoneQueue(self.queueSize)
+        feeder = Thread(target=self.feed_tiles, args=(tiles, doneQueue))
+        feeder.setDaemon(1)
+        feeder.start()
+
+        self.failures = []
+        try:
+            for i in xrange(len(tiles)):
+                tile, error = doneQueue.get()
+                if error is not None:
+                    self.failures.append((tile, error))
+                    self.tile_done(tile, error)
+                    continue
+                self.tile_done(tile)
+                yield tile
+        finally:
+            doneQueue.stop()
+        if self.failures:
+            raise TileFetchError(self.failures)
+
+    def feed_tiles(self, tiles, doneQueue):
+        """Puts cached tiles straight on the doneQueue and hands the others
+        to the Retriever pool or self.engine, which put them on the
+        doneQueue once downloaded"""
+        if self.engine is None:
+            threadList = []
+            threads = self.pool_size(tiles)
+            tileQueue = Queue.Queue(threads * 2)
+            # Set up the thread pool.  All the threads will read tiles from the
+            # tileQueue until they read a None
+            for i in range(threads):
+                retriever = Retriever(tileQueue, doneQueue,
+                                      fetch=self.fetch_tile)
+                retriever.start()
+                threadList.append(retriever)
+
+        for tile in tiles:
+            if doneQueue.stopped:
+                break
+            try:
+                cached = self.retrieve_from_cache(tile)
+            except Exception, e:
+                doneQueue.put((tile, e))
+                continue
+            if cached:
+                doneQueue.put((tile, None))
+            elif self.engine is not None:
+                self.engine.submit(self.fetch_tile, tile).add_done_callback(
+                    lambda future, tile=tile: self.engine_done(tile, future,
+                                                               doneQueue))
+            else:
+                # this tile needs to be downloaded
+                tileQueue.put(tile)
+
+        if self.engine is None:
+            if doneQueue.stopped:
+                # the tiles still queued are not wanted
+                while True:
+                    try:
+                        tileQueue.get_nowait()
+                    except Queue.Empty:
+                        break
+            # Shut down the thread pool once the queue is empty
+            for i in range(threads):
+                tileQueue.put(None)
+
+    def engine_done(self, tile, future, doneQueue):
+        doneQueue.put((tile, future.exception()))
+
     def download(self):
         """Do the download and create the image, return the PIL Image"""
         try:
@@ -165,8 +503,113 @@ class TerraImage(object):
             self.get_tile_data()
         return self.image
         
-    def write(self, filename):
-        """Do the download, create the image and save it to disk"""
+    def to_array(self, filename=None):
+        """Downloads the image straight into a (height, width, 3) uint8
+        NumPy array and returns the array itself, without copying it.  With
+        filename the array is a numpy.memmap of that file, so the mosaic
+        does not need to fit in memory.  The array is kept as self.array"""
+        if numpy is None:
+            raise ImportError("numpy is required for to_array")
+        try:
+            return self.array
+        except AttributeError:
+            pass
+        try:
+            self.extent
+        except AttributeError:
+            self.get_extent()
+        self.start_progress()
+        if self.decodeProcesses is not None and not filename:
+            pool = self.decode_pool()
+            try:
+                for tile in self.iter_tile_data(self.tileslist):
+                    pool.paste_tile(tile)
+                    tile.imagedata = None
+                self.array = pool.array()
+            finally:
+                pool.close()
+            self.flush_cache()
+            return self.array
+        shape = (self.height, self.width, 3)
+        if filename:
+            a = numpy.memmap(filename, dtype=numpy.uint8, mode='w+',
+                             shape=shape)
+        else:
+            a = numpy.zeros(shape, dtype=numpy.uint8)
+        for tile in self.iter_tile_data(self.tileslist):
+            i = self.decode_tile(tile).convert("RGB")
+            pixels = numpy.frombuffer(tobytes(i), dtype=numpy.uint8)
+            topx = tile.xind * side
+            topy = tile.yind * side
+            a[topy:topy + side, topx:topx + side] = pixels.reshape(side, side, 3)
+            tile.imagedata = None
+        if filename:
+            a.flush()
+        self.flush_cache()
+        self.array = a
+        return a
+
+    def read_window(self, window):
+        """Returns the pixels of the mosaic from (left, top) up to (right,
+        bottom), window being that tuple, as a PIL image.  Only the tiles
+        the window intersects are fetched and decoded, so a window can be
+        read from an extent far too large to download whole.  Parts of the
+        window outside the mosaic are black.  Tiles are read from the cache
+        like any others; give the TerraImage a memory cache to keep those
+        of windows read often decoded"""
+        try:
+            self.extent
+        except AttributeError:
+            self.get_extent()
+        self.start_progress()
+        return self._read_window(window)
+
+    def _read_window(self, window):
+        left, top, right, bottom = [int(v) for v in window]
+        n = Image.new("RGB", (right - left, bottom - top))
+        plan = self.extent.pixel_window(left, top, right, bottom)
+        if plan is None:
+            return n
+        # where the window's tiles start in the window
+        originx = (plan.minx - self.extent.minx) * side - left
+        originy = (self.extent.maxy - plan.maxy) * side - top
+        for tile in self.iter_tile_data(grid.TileSet(plan, self.Theme)):
+            n.paste(self.decode_tile(tile), (originx + tile.xind * side,
+                                             originy + tile.yind * side))
+            tile.imagedata = None
+        return n
+
+    def read_bbox(self, upperLeft, lowerRight):
+        """Returns the part of the mosaic between two corner points, UTM or
+        lon/lat, as a PIL image.  See :meth:`read_window`"""
+        try:
+            self.extent
+        except AttributeError:
+            self.get_extent()
+        ulx, uly = grid.to_utm(upperLeft, self.extent.Zone)
+        lrx, lry = grid.to_utm(lowerRight, self.extent.Zone)
+        return self.read_window(self.extent.to_pixels(ulx, lry, lrx, uly))
+
+    def iter_windows(self, width, height):
+        """Yields ((left, top, right, bottom), image) for each window of up
+        to width x height pixels of the mosaic, row by row, fetching the
+        tiles of each as it is read"""
+        try:
+            self.extent
+        except AttributeError:
+            self.get_extent()
+        self.start_progress()
+        for top in xrange(0, self.height, height):
+            for left in xrange(0, self.width, width):
+                window = (left, top, min(left + width, self.width),
+                          min(top + height, self.height))
+                yield window, self._read_window(window)
+        self.flush_cache()
+
+    def write(self, filename, stream=False):
+        """Do the download, create the image and save it to disk.  With
+        stream, the image is written to a TIFF a row of tiles at a time
+        (see :meth:`write_strips`) instead of being built in memory"""
         dir, fname = os.path.split(filename)
         root, ext = os.path.splitext(fname)
         if (ext.upper() == '.TIF' or ext.upper() == '.TIFF'):
@@ -178,6 +621,11 @@ class TerraImage(object):
         else:
             raise ValueError("Unsupported extention %s" % ext)
 
+        if stream:
+            if format != 'TIFF':
+                raise ValueError("Only TIFF images can be streamed")
+            return self.write_strips(filename)
+
         self.download()
 
         afile = open(filename, 'wb')
@@ -185,19 +633,50 @@ class TerraImage(object):
         afile.close()
         return True
 
+    def write_strips(self, filename, bigtiff=None):
+        """Downloads the image a row of tiles at a time and writes each row
+        to a TIFF as one strip, so memory use is bounded by a row of tiles
+        however large the image is.  The TIFF is a BigTIFF if it would
+        exceed 4GB, or if bigtiff is true"""
+        try:
+            self.extent
+        except AttributeError:
+            self.get_extent()
+        self.start_progress()
+        output = os.path.abspath(filename)
+        written = []
+        if self.manifest is not None:
+            # carry on after the strips written before an interruption
+            written = self.manifest.written_strips(output)
+        writer = tiff.StripWriter(filename, self.width, self.height, side,
+                                  bigtiff, [o for o, c in written],
+                                  [c for o, c in written])
+        for row in itertools.islice(self.extent.rows(), len(written), None):
+            strip = Image.new("RGB", (self.width, side))
+            for tile in self.iter_tile_data(grid.TileSet(row, self.Theme)):
+                i = self.decode_tile(tile)
+                strip.paste(i, (tile.xind * side, 0))
+                tile.imagedata = None
+            writer.write_strip(tobytes(strip))
+            if self.manifest is not None:
+                # the strip must be on disk before the manifest says so
+                writer.sync()
+                self.manifest.record_strip(output, writer.offsets[-1],
+                                           writer.counts[-1])
+        writer.close()
+        self.flush_cache()
+        return True
+
     def get_worldfile(self):
         """Returns the worldfile for the TerraImage instance"""
         try:
             self.extent
         except AttributeError:
             self.get_extent()
-        id = self.extent.NorthWest.TileMeta.Id
-        nwcorner = api.GetTileMetaFromTileId(id).NorthWest
-        nwcorner = api.ConvertLonLatPtToUtmPt(nwcorner)
+        minx, miny, maxx, maxy = self.extent.bounds()
         scale = self.Scale.replace('Scale','')
         scale = scale.replace('m','')
-        self.worldfile=scale+"\n"+"0.0\n0.0\n-"+scale+"\n"+str(nwcorner.X)+"\n"+str(nwcorner.Y)
-        return self.worldfile
+        return scale+"\n"+"0.0\n0.0\n-"+scale+"\n"+str(minx)+"\n"+str(maxy)
     worldfile = property(get_worldfile)
     
     def write_worldfile(self, filename):
@@ -217,19 +696,37 @@ class TerraImage(object):
     number_of_tiles = property(get_number_of_tiles)
 
         
+    def get_date_grid(self, scale='Scale16m', maxInFlight=16):
+        """Returns the capture date of every tile in the TerraImage, as a
+        list of rows of dates indexed like the tiles' yind and xind.  To
+        make fewer requests, the dates are looked up for the tiles at scale
+        that cover the image, or at the image's own scale if that is
+        coarser.  The lookups are made concurrently, see
+        :func:`capture_dates`"""
+        try:
+            plan = self.extent
+        except AttributeError:
+            self.get_extent()
+            plan = self.extent
+        if grid.scale_meters(scale) < grid.scale_meters(plan.Scale):
+            scale = plan.Scale
+        coarse = plan.covering(scale)
+        dates = capture_dates(grid.TileSet(coarse, self.Theme), self.engine,
+                              maxInFlight)
+        factor = int(grid.tile_size(scale) / grid.tile_size(plan.Scale))
+        rows = []
+        for y in range(plan.maxy, plan.miny - 1, -1):
+            rows.append([dates[(self.Theme, coarse.Zone, x // factor,
+                                y // factor, scale)]
+                         for x in range(plan.minx, plan.maxx + 1)])
+        return rows
+    date_grid = property(get_date_grid)
+
     def get_dates(self):
-        """Gets the range of dates for each tile in the TerraImage.  Could be slow as it is making a request for each tile"""
-        #Set the scale to 16 m or greater.  That way we won't have as many tiles to check
-        orig_scale = int(self.Scale[5:][:-1])
-        if orig_scale < 16:
-            self.Scale = 'Scale16m'
-        self.get_extent()
+        """Gets the distinct capture dates of the tiles in the TerraImage,
+        looked up at 16 m or coarser"""
         dates = []
-        for tile in self.tileslist:
-            date = api.GetTileMetaFromTileId(tile).Capture
-            dates.append(date)
-
-        #Set the scale back to its original value
-        self.Scale = 'Scale%sm' % orig_scale
+        for row in self.get_date_grid():
+            dates.extend(row)
         return list(set(dates))
     dates = property(get_dates)
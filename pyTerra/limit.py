@@ -0,0 +1,162 @@
+"""Adaptive limits on the requests made to the TerraServer.
+
+A fixed number of download threads is too few when the server is fast
+and too many when it starts to struggle.  :class:`AdaptiveLimiter` lets a
+varying number of requests run at once, and adjusts that number the way
+TCP adjusts its window: it creeps up while requests succeed promptly and
+is halved when they fail or their latency climbs well above the best
+seen.  A :class:`TokenBucket` can be added to cap the request rate as
+well.  :func:`for_endpoint` gives the limiter shared by everything in the
+process talking to one server::
+
+    from pyTerra import limit
+
+    limiter = limit.for_endpoint(api.url)
+    limiter.bucket = limit.TokenBucket(rate=50)
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows rate calls a second on average, in bursts of up to burst"""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.stamp = time.time()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Waits for a token"""
+        while True:
+            self._lock.acquire()
+            try:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            finally:
+                self._lock.release()
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """Lets up to limit calls run at once, where limit starts at initial
+    and stays between minimum and maximum.  Each call that succeeds adds
+    increase / limit to it, so it grows by about increase for every limit
+    calls.  A failed call, or one slower than tolerance times the fastest
+    recent call (and by more than slack seconds), multiplies it by
+    decrease, at most once per round trip.  Calls also take a token from
+    bucket when there is one"""
+    def __init__(self, initial=5, minimum=1, maximum=32, increase=1.0,
+                 decrease=0.5, tolerance=3.0, slack=0.05, bucket=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.slack = slack
+        self.bucket = bucket
+        self.inflight = 0
+        self.latency = None      # smoothed latency of successful calls
+        self.minLatency = None   # fastest recent call
+        self.lastDecrease = 0.0
+        self.successes = 0
+        self.errors = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Waits until another call may start"""
+        if self.bucket is not None:
+            self.bucket.take()
+        self._cond.acquire()
+        try:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+        finally:
+            self._cond.release()
+
+    def release(self, latency, ok=True):
+        """Ends a call that took latency seconds and adjusts the limit"""
+        self._cond.acquire()
+        try:
+            self.inflight -= 1
+            if ok:
+                self.successes += 1
+                if self.minLatency is None:
+                    self.minLatency = latency
+                else:
+                    # let the baseline drift up slowly, so a server that
+                    # has become slower for good is not held to its best
+                    self.minLatency = min(latency, self.minLatency * 1.01)
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+            else:
+                self.errors += 1
+            if not ok or (latency > self.tolerance * self.minLatency and
+                          latency > self.minLatency + self.slack):
+                self._decrease()
+            else:
+                self.limit = min(self.maximum,
+                                 self.limit + self.increase / self.limit)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _decrease(self):
+        now = time.time()
+        # the calls in flight when the trouble started all report it, only
+        # back off once for them
+        if now - self.lastDecrease < (self.latency or 0):
+            return
+        self.lastDecrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.decreases += 1
+
+    def call(self, fn, *args, **kwargs):
+        """Returns fn(*args, **kwargs), made within the limits"""
+        self.acquire()
+        start = time.time()
+        try:
+            result = fn(*args, **kwargs)
+        except:
+            self.release(time.time() - start, False)
+            raise
+        self.release(time.time() - start)
+        return result
+
+    def stats(self):
+        """Returns the current limit and counters as a dict"""
+        self._cond.acquire()
+        try:
+            return dict(limit=self.limit, inflight=self.inflight,
+                        latency=self.latency, successes=self.successes,
+                        errors=self.errors, decreases=self.decreases)
+        finally:
+            self._cond.release()
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+def for_endpoint(url, **kwargs):
+    """Returns the AdaptiveLimiter shared by all requests to url, making it
+    with kwargs on the first call"""
+    _endpoints_lock.acquire()
+    try:
+        limiter = _endpoints.get(url)
+        if limiter is None:
+            limiter = _endpoints[url] = AdaptiveLimiter(**kwargs)
+        return limiter
+    finally:
+        _endpoints_lock.release()
@@ -0,0 +1,140 @@
+"""Manifests, so that interrupted downloads can be resumed.
+
+A :class:`Manifest` is a small journal kept next to a long download.  It
+names the extent being downloaded and records each tile as it is done or
+fails, and each strip :meth:`pyTerra.image.TerraImage.write_strips` has
+written.  Give a TerraImage the same manifest after a crash and it picks
+up where it stopped: finished strips are not written again, finished
+tiles are read back from the tile cache, and progress is counted from
+where it was::
+
+    img = image.TerraImage(ul, lr, 'Scale1m', 'DOQ', 15, '/data/tiles')
+    img.resume('/data/job.manifest')
+    img.progress = lambda done, failed, total: log(done, total)
+    img.write('/data/big.tif', stream=True)
+"""
+
+import os
+import threading
+
+import api
+
+
+class Manifest(object):
+    """The journal of the download of plan's tiles for theme, kept in
+    filename.  An existing manifest is read and appended to; it must be
+    for the same plan and theme.  With sync every record is fsync'ed"""
+    def __init__(self, filename, plan, theme, sync=False):
+        self.filename = filename
+        self.plan = plan
+        self.theme = theme
+        self.sync = sync
+        self.done = set()       # (X, Y) of the finished tiles
+        self.failed = {}        # (X, Y) -> error of the last failure
+        self.strips = {}        # output filename -> [(offset, count)]
+        self._lock = threading.Lock()
+        self.header = 'plan %d %d %d %d %s %d %s' % (plan.key() + (theme,))
+        if os.path.isfile(filename):
+            self.load()
+            self.file = open(filename, 'a')
+        else:
+            self.file = open(filename, 'a')
+            self._write(self.header)
+
+    def load(self):
+        f = open(self.filename)
+        try:
+            lines = f.read().split('\n')
+        finally:
+            f.close()
+        if lines[0] != self.header:
+            raise api.pyTerraError("%s is the manifest of another download, "
+                                   "%s" % (self.filename, lines[0]))
+        # the last line is either empty or was torn by a crash
+        for line in lines[1:-1]:
+            kind, rest = line[:1], line[2:]
+            if kind == '+':
+                xy = tuple(map(int, rest.split()))
+                self.done.add(xy)
+                self.failed.pop(xy, None)
+            elif kind == '!':
+                x, y, error = rest.split(' ', 2)
+                self.failed[(int(x), int(y))] = error
+            elif kind == '=':
+                offset, count, output = rest.split(' ', 2)
+                self.strips.setdefault(output, []).append((int(offset),
+                                                           int(count)))
+            elif kind == '~':
+                self.strips.pop(rest, None)
+
+    def _write(self, line):
+        self.file.write(line + '\n')
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def record(self, tile, error=None):
+        """Records that the tile is done, or failed with error"""
+        xy = (int(tile.X), int(tile.Y))
+        self._lock.acquire()
+        try:
+            if error is None:
+                if xy in self.done:
+                    return
+                self.done.add(xy)
+                self.failed.pop(xy, None)
+                self._write('+ %d %d' % xy)
+            else:
+                message = ' '.join(str(error).split())
+                self.failed[xy] = message
+                self._write('! %d %d %s' % (xy + (message,)))
+        finally:
+            self._lock.release()
+
+    def is_done(self, tile):
+        return (int(tile.X), int(tile.Y)) in self.done
+
+    def record_strip(self, output, offset, count):
+        """Records a strip written to the output file"""
+        self._lock.acquire()
+        try:
+            self.strips.setdefault(output, []).append((offset, count))
+            self._write('= %d %d %s' % (offset, count, output))
+        finally:
+            self._lock.release()
+
+    def written_strips(self, output):
+        """Returns the (offset, count) of the strips already written to
+        output, as far as output still holds them all, and forgets the
+        strips after those"""
+        strips = self.strips.get(output, [])
+        size = os.path.isfile(output) and os.path.getsize(output) or 0
+        kept = 0
+        for offset, count in strips:
+            if offset + count > size:
+                break
+            kept += 1
+        if kept < len(strips):
+            self._lock.acquire()
+            try:
+                del self.strips[output]
+                self._write('~ %s' % output)
+                for offset, count in strips[:kept]:
+                    self.strips.setdefault(output, []).append((offset, count))
+                    self._write('= %d %d %s' % (offset, count, output))
+            finally:
+                self._lock.release()
+        return list(strips[:kept])
+
+    def progress(self):
+        """Returns the numbers of tiles (done, failed, total)"""
+        return (len(self.done), len(self.failed),
+                self.plan.numx * self.plan.numy)
+
+    def complete(self):
+        """Tests whether every tile is done"""
+        done, failed, total = self.progress()
+        return done == total
+
+    def close(self):
+        self.file.close()
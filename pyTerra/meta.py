@@ -0,0 +1,184 @@
+"""A persistent cache of TerraServer metadata responses.
+
+TerraServer metadata (tile metadata, areas, themes, the gazetteer) does
+not change, so there is no need to ask for it twice.  Set
+:data:`pyTerra.api.metadataCache` to a :class:`MetadataCache` and the
+responses of the read operations in :data:`operations` are kept in a
+SQLite database, keyed on the operation and its normalized arguments::
+
+    from pyTerra import api, meta
+
+    api.metadataCache = meta.MetadataCache()
+    api.GetTileMetaFromTileId(tile)   # asks the TerraServer
+    api.GetTileMetaFromTileId(tile)   # does not
+
+Responses are returned as :class:`Record` objects, plain copies of the
+suds objects that can be pickled, whether they came from the cache or
+not.  :meth:`MetadataCache.preload` fills the cache for many calls at once.
+"""
+
+import cPickle
+import os
+import sqlite3
+import threading
+import time
+
+import api
+import futures
+
+# The operations whose responses are cached.  GetTile is not, tiles have
+# caches of their own (see pyTerra.cache).
+operations = frozenset(['GetPlaceList', 'GetPlaceListInRect', 'GetPlaceFacts',
+                        'GetAreaFromPt', 'GetAreaFromTileId', 'GetAreaFromRect',
+                        'GetTileMetaFromTileId', 'GetTileMetaFromLonLatPt',
+                        'ConvertLonLatPtToNearestPlace',
+                        'ConvertUtmPtToLonLatPt', 'ConvertLonLatPtToUtmPt',
+                        'ConvertPlaceToLonLatPt', 'GetTheme',
+                        'CountPlacesInRect', 'GetLatLonMetrics'])
+
+
+class Record(object):
+    """A response object.  Like a suds object, its fields are attributes
+    and iterating over it gives (name, value) pairs"""
+    def __init__(self, items):
+        self._fields = [name for name, value in items]
+        for name, value in items:
+            setattr(self, name, value)
+
+    def __iter__(self):
+        for name in self._fields:
+            yield name, getattr(self, name)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '(%s)' % ', '.join(['%s=%r' % item for item in self])
+
+def to_record(value):
+    """Returns a plain copy of a suds response: suds objects become Records
+    and suds text becomes unicode"""
+    if hasattr(value, '__keylist__'):
+        return Record([(str(name), to_record(v)) for name, v in value])
+    if isinstance(value, list):
+        return [to_record(v) for v in value]
+    if isinstance(value, unicode):
+        return unicode(value)
+    return value
+
+def key(args):
+    """Returns the cache key of the arguments of a call, which may be suds
+    objects"""
+    def plain(value):
+        if hasattr(value, '__keylist__'):
+            return tuple([(str(name), plain(v)) for name, v in value])
+        if isinstance(value, (list, tuple)):
+            return tuple([plain(v) for v in value])
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+    return repr(plain(args))
+
+
+class MetadataCache(object):
+    """Keeps responses in the SQLite database filename, by default
+    metadata.db in :data:`pyTerra.api.wsdlCacheDir`.  Responses older than
+    ttl seconds, or than ttls[operation], are fetched again.  With no ttl
+    they are kept for good.  Only the responses of operations are cached"""
+    def __init__(self, filename=None, ttl=None, ttls=None):
+        if filename is None:
+            if not os.path.isdir(api.wsdlCacheDir):
+                os.makedirs(api.wsdlCacheDir)
+            filename = os.path.join(api.wsdlCacheDir, 'metadata.db')
+        self.filename = filename
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.operations = operations
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'operation TEXT, key TEXT, value BLOB, stored REAL, '
+                        'PRIMARY KEY (operation, key))')
+        self.db.commit()
+
+    def get(self, operation, key):
+        """Returns the cached response, or raises KeyError"""
+        self._lock.acquire()
+        try:
+            row = self.db.execute('SELECT value, stored FROM responses '
+                                  'WHERE operation = ? AND key = ?',
+                                  (operation, key)).fetchone()
+            ttl = self.ttls.get(operation, self.ttl)
+            if row is None or (ttl is not None and
+                               row[1] + ttl < time.time()):
+                self.misses += 1
+                raise KeyError((operation, key))
+            self.hits += 1
+        finally:
+            self._lock.release()
+        return cPickle.loads(str(row[0]))
+
+    def put(self, operation, key, value):
+        data = sqlite3.Binary(cPickle.dumps(value, 2))
+        self._lock.acquire()
+        try:
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            'VALUES (?, ?, ?, ?)',
+                            (operation, key, data, time.time()))
+            self.db.commit()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return self.db.execute('SELECT COUNT(*) FROM responses'
+                                   ).fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def expire(self, operation=None):
+        """Forgets the cached responses of operation, or of everything"""
+        self._lock.acquire()
+        try:
+            if operation is None:
+                self.db.execute('DELETE FROM responses')
+            else:
+                self.db.execute('DELETE FROM responses WHERE operation = ?',
+                                (operation,))
+            self.db.commit()
+        finally:
+            self._lock.release()
+
+    def preload(self, operation, arglist, maxInFlight=16):
+        """Calls the named :mod:`pyTerra.api` operation with each tuple of
+        arguments in arglist, maxInFlight at a time, so that their responses
+        are cached.  A single argument need not be in a tuple.  Returns the
+        number of calls that failed"""
+        fn = getattr(api, operation)
+        client = futures.AsyncTerraClient(maxInFlight)
+        try:
+            pending = []
+            for args in arglist:
+                if not isinstance(args, tuple):
+                    args = (args,)
+                pending.append(client.submit(fn, *args))
+            return len([f for f in futures.as_completed(pending)
+                        if f.exception() is not None])
+        finally:
+            client.close()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.db.close()
+        finally:
+            self._lock.release()
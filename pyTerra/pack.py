@@ -0,0 +1,360 @@
+"""A tile cache that appends tiles to a few large pack files.
+
+One file per 200x200 tile wastes inodes and makes copying or backing up a
+cache slow.  :class:`PackCache` appends each tile to the current pack file
+and keeps an in-memory index of where every tile is.  Tiles are read
+through mmap, so there is no open or close per tile.  Use it anywhere a
+tile cache is accepted, such as the cacheDir of a TerraImage.
+
+Every record carries a CRC.  When the cache is opened, anything appended
+after the last saved index is scanned back in, and a torn record at the
+end of a pack (from a crash mid-write) is cut off.  Writing a tile again
+leaves the old copy as garbage.  :meth:`PackCache.compact` rewrites the
+packs without it, and is also available from the command line::
+
+    python -m pyTerra.pack compact /path/to/cache
+
+Several PackCaches, in one process or many, can share a directory.  Each
+append is made under an exclusive lock on root/pack.lock, after indexing
+whatever the others appended since.  Without fcntl (on Windows) there is
+no lock, and only one PackCache may write to a directory at a time.
+"""
+
+import cPickle
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cache import key_name
+
+magic = 'PTPK'
+header = struct.Struct('<4sIHI')   # magic, crc32, key length, data length
+
+_pack_re = re.compile(r'^pack-(\d{5})\.dat$')
+
+
+class PackCache(object):
+    """Stores tiles in root/pack-NNNNN.dat files of up to maxPackBytes.
+    With sync, every append is fsync'ed before put returns"""
+    def __init__(self, root, maxPackBytes=2**30, sync=False):
+        self.root = root
+        self.maxPackBytes = maxPackBytes
+        self.sync = sync
+        self.index = {}      # name -> (pack, data offset, data length)
+        self.lengths = {}    # pack -> bytes of it covered by self.index
+        self.maps = {}       # pack -> mmap
+        self.writer = None
+        self.current = None
+        self._lock = threading.RLock()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.indexfile = os.path.join(root, 'pack.idx')
+        self.lockfile = None
+        self.load()
+
+    def packfile(self, pack):
+        return os.path.join(self.root, 'pack-%05d.dat' % pack)
+
+    def packs(self):
+        """Returns the numbers of the pack files on disk, in order"""
+        found = []
+        for fname in os.listdir(self.root):
+            m = _pack_re.match(fname)
+            if m:
+                found.append(int(m.group(1)))
+        found.sort()
+        return found
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key_name(key) in self.index
+
+    def get(self, key):
+        """Returns the tile's data, or None if it is not cached.  The
+        record is checked against its CRC, and forgotten if it is damaged"""
+        name = key_name(key)
+        self._lock.acquire()
+        try:
+            entry = self.index.get(name)
+            if entry is None:
+                return None
+            pack, offset, length = entry
+            start = offset - len(name) - header.size
+            m = self.maps.get(pack)
+            try:
+                if m is None or offset + length > len(m):
+                    m = self._map(pack)
+            except (IOError, OSError, ValueError):
+                # removed by another cache's compact
+                del self.index[name]
+                return None
+            record = m[start:offset + length]
+            if (len(record) == offset + length - start and
+                header.unpack(record[:header.size]) ==
+                    (magic, zlib.crc32(record[header.size:]) & 0xffffffff,
+                     len(name), length) and
+                record[header.size:header.size + len(name)] == name):
+                return record[header.size + len(name):]
+            del self.index[name]
+            return None
+        finally:
+            self._lock.release()
+
+    def _map(self, pack):
+        old = self.maps.pop(pack, None)
+        if old is not None:
+            old.close()
+        f = open(self.packfile(pack), 'rb')
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        self.maps[pack] = m
+        return m
+
+    def put(self, key, data):
+        self._append(key_name(key), data)
+
+    def refresh(self, key):
+        """Indexes what other PackCaches appended since, and returns whether
+        the tile is cached"""
+        self._lock_root()
+        try:
+            self._catch_up()
+            return key_name(key) in self.index
+        finally:
+            self._unlock_root()
+
+    def _lock_root(self):
+        """Takes the lock on the directory against other PackCaches.  flock
+        locks belong to the open file, so they also keep apart PackCaches
+        in the same process"""
+        self._lock.acquire()
+        if fcntl is not None:
+            if self.lockfile is None:
+                self.lockfile = open(os.path.join(self.root, 'pack.lock'),
+                                     'a+b')
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_root(self):
+        if fcntl is not None:
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _append(self, name, data):
+        self._lock_root()
+        try:
+            self._catch_up()
+            self._write(name, data)
+        finally:
+            self._unlock_root()
+
+    def _catch_up(self):
+        """Indexes what other PackCaches appended since, and makes the last
+        pack the one to append to.  Called with the root locked"""
+        packs = self.packs()
+        for pack in packs:
+            if os.path.getsize(self.packfile(pack)) != self.lengths.get(pack):
+                self.scan(pack, self.lengths.get(pack, 0))
+        gone = [pack for pack in self.lengths if pack not in packs]
+        if gone:
+            self.forget(gone)
+        last = packs and packs[-1] or None
+        if last != self.current:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.current = last
+
+    def _next_pack(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.current = (self.current or 0) + 1
+        self.lengths[self.current] = 0
+
+    def _write(self, name, data):
+        record = header.pack(magic, zlib.crc32(name + data) & 0xffffffff,
+                             len(name), len(data)) + name + data
+        used = self.current is not None and self.lengths[self.current]
+        if self.current is None or (used and
+                                    used + len(record) > self.maxPackBytes):
+            self._next_pack()
+        if self.writer is None:
+            self.writer = open(self.packfile(self.current), 'ab')
+        # append where the pack ends on disk, whoever wrote to it last
+        self.writer.seek(0, 2)
+        start = self.writer.tell()
+        self.writer.write(record)
+        self.writer.flush()
+        if self.sync:
+            os.fsync(self.writer.fileno())
+        self.lengths[self.current] = start + len(record)
+        self.index[name] = (self.current, start + header.size + len(name),
+                            len(data))
+
+    def load(self):
+        """Reads the saved index, then scans in whatever was appended to the
+        packs after it was saved"""
+        self._lock_root()
+        try:
+            if os.path.isfile(self.indexfile):
+                f = open(self.indexfile, 'rb')
+                try:
+                    self.index, self.lengths = cPickle.load(f)
+                finally:
+                    f.close()
+            packs = self.packs()
+            for pack in packs:
+                self.scan(pack, self.lengths.get(pack, 0))
+            # forget packs that have gone away
+            self.forget([pack for pack in self.lengths if pack not in packs])
+        finally:
+            self._unlock_root()
+
+    def forget(self, packs):
+        """Drops the packs, and the tiles in them, from the index"""
+        for pack in packs:
+            self.lengths.pop(pack, None)
+            m = self.maps.pop(pack, None)
+            if m is not None:
+                m.close()
+        packs = set(packs)
+        for name, entry in self.index.items():
+            if entry[0] in packs:
+                del self.index[name]
+
+    def scan(self, pack, start=0):
+        """Indexes the records of a pack from start, cutting the pack off at
+        the first damaged one"""
+        filename = self.packfile(pack)
+        if start > os.path.getsize(filename):
+            # the pack is not the one the index was saved for
+            for name, entry in self.index.items():
+                if entry[0] == pack:
+                    del self.index[name]
+            start = 0
+        f = open(filename, 'rb')
+        f.seek(start)
+        offset = start
+        while True:
+            head = f.read(header.size)
+            if len(head) < header.size:
+                break
+            tag, crc, keylen, datalen = header.unpack(head)
+            if tag != magic:
+                break
+            body = f.read(keylen + datalen)
+            if (len(body) < keylen + datalen or
+                zlib.crc32(body) & 0xffffffff != crc):
+                break
+            name = body[:keylen]
+            self.index[name] = (pack, offset + header.size + keylen, datalen)
+            offset += header.size + keylen + datalen
+        f.close()
+        if offset < os.path.getsize(filename):
+            f = open(filename, 'r+b')
+            f.truncate(offset)
+            f.close()
+        self.lengths[pack] = offset
+
+    def flush(self):
+        """Saves the index, so the next open does not scan the packs"""
+        self._lock_root()
+        try:
+            self._catch_up()
+            self._save_index()
+        finally:
+            self._unlock_root()
+
+    def _save_index(self):
+        tmp = '%s.%d.tmp' % (self.indexfile, os.getpid())
+        f = open(tmp, 'wb')
+        cPickle.dump((self.index, self.lengths), f, 2)
+        f.close()
+        os.rename(tmp, self.indexfile)
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+                self.current = None
+            self.flush()
+            for m in self.maps.values():
+                m.close()
+            self.maps = {}
+            if self.lockfile is not None:
+                self.lockfile.close()
+                self.lockfile = None
+        finally:
+            self._lock.release()
+
+    def garbage(self):
+        """Returns the bytes in the packs that are no longer indexed"""
+        live = sum([header.size + len(name) + entry[2]
+                    for name, entry in self.index.items()])
+        return sum(self.lengths.values()) - live
+
+    def compact(self):
+        """Rewrites the live tiles into new packs and removes the old ones"""
+        self._lock_root()
+        try:
+            self._catch_up()
+            old = self.packs()
+            entries = sorted(self.index.items(), key=lambda item: item[1])
+            if self.writer is not None:
+                self.writer.close()
+            self.writer = None
+            # new packs are numbered after the old ones, so if this is
+            # interrupted the old packs and index are still good
+            self.current = (old and old[-1] or 0)
+            self.index = {}
+            self.lengths = {}
+            self._next_pack()
+            for name, (pack, offset, length) in entries:
+                m = self.maps.get(pack)
+                if m is None or offset + length > len(m):
+                    m = self._map(pack)
+                self._write(name, m[offset:offset + length])
+            # the index no longer needs the old packs once it is saved
+            self._save_index()
+            for pack in old:
+                m = self.maps.pop(pack, None)
+                if m is not None:
+                    m.close()
+                os.remove(self.packfile(pack))
+        finally:
+            self._unlock_root()
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ('compact', 'stats'):
+        print >> sys.stderr, "usage: %s compact|stats CACHEDIR" % argv[0]
+        return 2
+    c = PackCache(argv[2])
+    if argv[1] == 'compact':
+        before = sum(c.lengths.values())
+        c.compact()
+        print "%d tiles, %d bytes reclaimed" % (len(c), before -
+                                                sum(c.lengths.values()))
+    else:
+        print "%d tiles in %d packs, %d bytes of garbage" % (len(c),
+                                                len(c.lengths), c.garbage())
+    c.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,135 @@
+"""WGS84 Universal Transverse Mercator conversions for pyTerra.
+
+The projection is computed with Krueger's series to fourth order in the
+third flattening, which is good to well under a millimeter within a UTM
+zone.  The scalar functions only need :mod:`math`.  The ``*_array``
+functions take and return NumPy arrays and convert any number of points
+in one call.
+
+TerraServer only covers the United States, so northings are always
+measured from the equator without a southern false northing.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# WGS84 ellipsoid
+a = 6378137.0
+f = 1 / 298.257223563
+
+k0 = 0.9996
+false_easting = 500000.0
+
+n = f / (2 - f)
+A = a / (1 + n) * (1 + n**2 / 4 + n**4 / 64)
+
+alpha = (n / 2 - 2 * n**2 / 3 + 5 * n**3 / 16 + 41 * n**4 / 180,
+         13 * n**2 / 48 - 3 * n**3 / 5 + 557 * n**4 / 1440,
+         61 * n**3 / 240 - 103 * n**4 / 140,
+         49561 * n**4 / 161280)
+
+beta = (n / 2 - 2 * n**2 / 3 + 37 * n**3 / 96 - n**4 / 360,
+        n**2 / 48 + n**3 / 15 - 437 * n**4 / 1440,
+        17 * n**3 / 480 - 37 * n**4 / 840,
+        4397 * n**4 / 161280)
+
+delta = (2 * n - 2 * n**2 / 3 - 2 * n**3 + 116 * n**4 / 45,
+         7 * n**2 / 3 - 8 * n**3 / 5 - 227 * n**4 / 45,
+         56 * n**3 / 15 - 136 * n**4 / 35,
+         4279 * n**4 / 630)
+
+e2n = 2 * math.sqrt(n) / (1 + n)
+
+
+class _Scalar(object):
+    sin, cos, sinh, cosh = math.sin, math.cos, math.sinh, math.cosh
+    asin, atan2, atanh, sqrt = math.asin, math.atan2, math.atanh, math.sqrt
+    radians, degrees = math.radians, math.degrees
+
+
+class _Vector(object):
+    def __init__(self):
+        self.sin, self.cos = numpy.sin, numpy.cos
+        self.sinh, self.cosh = numpy.sinh, numpy.cosh
+        self.asin, self.atan2 = numpy.arcsin, numpy.arctan2
+        self.atanh, self.sqrt = numpy.arctanh, numpy.sqrt
+        self.radians, self.degrees = numpy.radians, numpy.degrees
+
+
+def zone_for(lon):
+    """Returns the UTM zone number containing the longitude"""
+    return int((lon + 180) // 6) % 60 + 1
+
+def central_meridian(zone):
+    """Returns the central meridian of a UTM zone in degrees"""
+    return int(zone) * 6 - 183
+
+def _forward(m, lon, lat, lon0):
+    lam = m.radians(lon - lon0)
+    sinphi = m.sin(m.radians(lat))
+    t = m.sinh(m.atanh(sinphi) - e2n * m.atanh(e2n * sinphi))
+    xi = m.atan2(t, m.cos(lam))
+    eta = m.atanh(m.sin(lam) / m.sqrt(1 + t * t))
+    x, y = eta, xi
+    for j in range(4):
+        k = 2 * (j + 1)
+        x = x + alpha[j] * m.cos(k * xi) * m.sinh(k * eta)
+        y = y + alpha[j] * m.sin(k * xi) * m.cosh(k * eta)
+    return false_easting + k0 * A * x, k0 * A * y
+
+def _inverse(m, x, y, lon0):
+    xi = y / (k0 * A)
+    eta = (x - false_easting) / (k0 * A)
+    xip, etap = xi, eta
+    for j in range(4):
+        k = 2 * (j + 1)
+        xip = xip - beta[j] * m.sin(k * xi) * m.cosh(k * eta)
+        etap = etap - beta[j] * m.cos(k * xi) * m.sinh(k * eta)
+    chi = m.asin(m.sin(xip) / m.cosh(etap))
+    phi = chi
+    for j in range(4):
+        phi = phi + delta[j] * m.sin(2 * (j + 1) * chi)
+    lam = m.atan2(m.sinh(etap), m.cos(xip))
+    return lon0 + m.degrees(lam), m.degrees(phi)
+
+def lonlat_to_utm(lon, lat, zone=None):
+    """Projects a WGS84 lon/lat into UTM and returns (x, y, zone).  The zone
+    is chosen from the longitude unless one is given"""
+    lon, lat = float(lon), float(lat)
+    if zone is None:
+        zone = zone_for(lon)
+    x, y = _forward(_Scalar, lon, lat, central_meridian(zone))
+    return x, y, int(zone)
+
+def utm_to_lonlat(x, y, zone):
+    """Unprojects a UTM coordinate and returns the WGS84 (lon, lat)"""
+    return _inverse(_Scalar, float(x), float(y), central_meridian(zone))
+
+def lonlat_to_utm_array(lon, lat, zone=None):
+    """Projects arrays of WGS84 lon/lat into UTM and returns the arrays
+    (x, y, zone).  zone may be a scalar or an array, and is chosen per
+    point from the longitude when it is not given"""
+    if numpy is None:
+        raise ImportError("numpy is required for array conversions")
+    lon = numpy.asarray(lon, dtype=numpy.float64)
+    lat = numpy.asarray(lat, dtype=numpy.float64)
+    if zone is None:
+        zone = (numpy.floor_divide(lon + 180, 6) % 60 + 1).astype(numpy.int32)
+    else:
+        zone = numpy.asarray(zone, dtype=numpy.int32)
+    x, y = _forward(_Vector(), lon, lat, zone * 6 - 183)
+    return x, y, zone + numpy.zeros(x.shape, dtype=numpy.int32)
+
+def utm_to_lonlat_array(x, y, zone):
+    """Unprojects arrays of UTM coordinates and returns the arrays
+    (lon, lat).  zone may be a scalar or an array"""
+    if numpy is None:
+        raise ImportError("numpy is required for array conversions")
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    zone = numpy.asarray(zone, dtype=numpy.int32)
+    return _inverse(_Vector(), x, y, zone * 6 - 183)
@@ -0,0 +1,175 @@
+"""Building tile pyramids locally.
+
+Serving several zoom levels used to mean a TerraImage per Scale, each
+fetching its own tiles from the TerraServer.  But the scales double, so
+the tiles line up: tile (X, Y) at one scale covers tiles 2X to 2X + 1 and
+2Y to 2Y + 1 of the next finer one.  A :class:`Pyramid` fetches the tiles
+of an extent at its base scale only, and makes each coarser level from
+the one below by averaging 2 x 2 blocks of pixels.  The tiles it makes
+go into the tile cache under their own Scale, where any TerraImage at
+that scale finds them::
+
+    from pyTerra import pyramid
+
+    p = pyramid.Pyramid(ul, lr, 'Scale1m', 'DOQ', 15, '/data/tiles',
+                        top='Scale64m')
+    p.build()
+    image.TerraImage(ul, lr, 'Scale8m', 'DOQ', 15, '/data/tiles').download()
+
+Coarse tiles at the edges of the extent cover base tiles outside it.
+Those are fetched from the TerraServer instead, one request rather than
+the several it would take to fetch what they are made from.
+"""
+
+import cStringIO
+import Queue
+
+import Image
+
+import api
+import cache
+import grid
+import image
+from image import tobytes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+side = grid.side
+
+
+def downsample(img):
+    """Returns a PIL image of half the size of the RGB image img, each of
+    its pixels the mean of a 2 x 2 block"""
+    width, height = img.size[0] // 2, img.size[1] // 2
+    if numpy is None:
+        return img.resize((width, height), Image.ANTIALIAS)
+    a = numpy.frombuffer(tobytes(img), dtype=numpy.uint8)
+    a = a.reshape(height, 2, width, 2, 3).astype(numpy.uint16)
+    a = ((a.sum(axis=3).sum(axis=1) + 2) // 4).astype(numpy.uint8)
+    return Image.frombuffer("RGB", (width, height), a.tostring(), "raw",
+                            "RGB", 0, 1)
+
+
+class Pyramid(object):
+    """The tiles of an extent at Scale and at each coarser scale up to top,
+    for Theme, made in cache, a directory or cache object as for a
+    TerraImage.  Derived tiles are saved as JPEGs of the given quality
+    when the base tiles are JPEGs, and as PNGs otherwise"""
+    def __init__(self, upperLeft, lowerRight, Scale, Theme, Zone, cache,
+                 top='Scale64m', memoryCache=None, quality=90):
+        self.Scale = Scale
+        self.Theme = Theme
+        self.top = top
+        self.quality = quality
+        self.base = image.TerraImage(upperLeft, lowerRight, Scale, Theme,
+                                     Zone, cache, memoryCache)
+        if self.base.cache is None:
+            raise api.pyTerraError("A pyramid needs a tile cache")
+        self.cache = self.base.cache
+        self.base.get_extent()
+        self.format = None
+
+    def levels(self):
+        """Returns the TilePlans of the coarser levels, finest first"""
+        if grid.scale_meters(self.top) <= grid.scale_meters(self.Scale):
+            return []
+        plans = []
+        scale = self.Scale
+        while grid.scale_meters(scale) < grid.scale_meters(self.top):
+            scale = grid.coarser(scale)
+            plans.append(self.base.extent.covering(scale))
+        return plans
+
+    def build(self):
+        """Fetches the base tiles and makes the coarser levels.  Returns a
+        list of (Scale, counts) for each level, base first, where counts
+        is a dict of the numbers of tiles found already cached, derived,
+        fetched and failed"""
+        base = self.base
+        base.start_progress()
+        counts = dict(cached=0, derived=0, fetched=0, failed=0)
+        for tile in base.tileslist:
+            if cache.tile_key(tile) in self.cache:
+                counts['cached'] += 1
+        try:
+            for tile in base.iter_tile_data(base.tileslist):
+                tile.imagedata = None
+        except image.TileFetchError:
+            pass
+        counts['failed'] = len(base.failures)
+        counts['fetched'] = len(base.tileslist) - counts['cached'] - \
+                            counts['failed']
+        levels = [(self.Scale, counts)]
+        for plan in self.levels():
+            levels.append((plan.Scale, self.build_level(plan)))
+        base.flush_cache()
+        return levels
+
+    def build_level(self, plan):
+        """Makes the tiles of plan from those of the next finer level, or
+        fetches them where those are not all in the cache.  Returns the
+        counts as for :meth:`build`"""
+        counts = dict(cached=0, derived=0, fetched=0, failed=0)
+        fetch = []
+        for tile in grid.TileSet(plan, self.Theme):
+            if cache.tile_key(tile) in self.cache:
+                counts['cached'] += 1
+                continue
+            children = self.children(tile)
+            if all([cache.tile_key(c) in self.cache for c in children]):
+                self.cache.put(cache.tile_key(tile), self.derive(children))
+                counts['derived'] += 1
+            else:
+                fetch.append(tile)
+        failures = self.fetch(fetch)
+        counts['fetched'] = len(fetch) - len(failures)
+        counts['failed'] = len(failures)
+        return counts
+
+    def children(self, tile):
+        """Returns the four tiles of the next finer scale that tile covers,
+        upper left, upper right, lower left and lower right"""
+        scale = grid.scale_name(grid.scale_meters(tile.Scale) / 2)
+        x, y = 2 * tile.X, 2 * tile.Y
+        return [grid.Tile(cx, cy, tile.Scene, tile.Theme, scale)
+                for cy in (y + 1, y) for cx in (x, x + 1)]
+
+    def derive(self, children):
+        """Returns the image data of the tile made of the four children"""
+        n = Image.new("RGB", (2 * side, 2 * side))
+        for i, child in enumerate(children):
+            data = self.cache.get(cache.tile_key(child))
+            c = Image.open(cStringIO.StringIO(data))
+            if self.format is None:
+                self.format = c.format
+            n.paste(c.convert("RGB"), ((i % 2) * side, (i // 2) * side))
+        f = cStringIO.StringIO()
+        if self.format == 'JPEG':
+            downsample(n).save(f, 'JPEG', quality=self.quality)
+        else:
+            downsample(n).save(f, 'PNG')
+        return f.getvalue()
+
+    def fetch(self, tiles):
+        """Fetches the tiles from the TerraServer into the cache with a
+        Retriever pool.  Returns the Retrievers' failures"""
+        if not tiles:
+            return []
+        fetcher = self.base
+        threads = fetcher.pool_size(tiles)
+        tileQueue = Queue.Queue()
+        retrievers = [image.Retriever(tileQueue, fetch=fetcher.fetch_tile)
+                      for i in range(threads)]
+        for tile in tiles:
+            tileQueue.put(tile)
+        for retriever in retrievers:
+            tileQueue.put(None)
+            retriever.start()
+        failures = []
+        for retriever in retrievers:
+            retriever.join()
+            failures.extend(retriever.failures)
+        return failures
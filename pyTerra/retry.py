@@ -0,0 +1,150 @@
+"""Retrying of TerraServer calls.
+
+Every :mod:`pyTerra.api` call is made through :data:`pyTerra.api.retryPolicy`,
+a :class:`RetryPolicy`.  A failed call is tried again after an
+exponentially growing, jittered delay, up to a number of attempts.  The
+policy's :class:`CircuitBreaker` notices when calls keep failing, as they
+do when the TerraServer is down, and then fails calls straight away
+instead of retrying each of them, trying the server again now and then.
+Only errors in :data:`transient` are retried by default: a SOAP fault,
+such as a tile that does not exist, would only fail again, and says the
+server is up rather than down::
+
+    from pyTerra import api, retry
+
+    api.retryPolicy = retry.RetryPolicy(attempts=5, timeout=30)
+"""
+
+import httplib
+import random
+import socket
+import sys
+import threading
+import time
+import urllib2
+
+# The errors of reaching the server, rather than of the call itself.
+# socket.timeout is a socket.error.
+transient = (socket.error, httplib.HTTPException, urllib2.URLError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit breaker is open"""
+
+
+class CircuitBreaker(object):
+    """Opens after threshold failures in a row.  While it is open calls are
+    refused, until resetAfter seconds have passed and a trial call is let
+    through: if that succeeds the breaker closes again, if not it stays open
+    for another resetAfter seconds"""
+    def __init__(self, threshold=20, resetAfter=30.0):
+        self.threshold = threshold
+        self.resetAfter = resetAfter
+        self.failures = 0
+        self.openedAt = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.openedAt is not None
+
+    def allow(self):
+        """Tests whether a call may be made now"""
+        self._lock.acquire()
+        try:
+            if self.openedAt is None:
+                return True
+            if time.time() - self.openedAt >= self.resetAfter:
+                # let this call through as the trial, and hold off the
+                # others for another period
+                self.openedAt = time.time()
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.failures = 0
+            self.openedAt = None
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.openedAt is None and self.failures >= self.threshold:
+                self.openedAt = time.time()
+                self.trips += 1
+        finally:
+            self._lock.release()
+
+
+class RetryPolicy(object):
+    """Makes a call up to attempts times.  The nth retry waits
+    backoff * 2 ** (n - 1) seconds, at most maxBackoff, less a random
+    fraction of up to jitter of that so that threads do not retry in
+    step.  timeout is the socket timeout of each request, or None to leave
+    the transport's own.  Only exceptions in retryable are retried, and
+    only they count as failures for the breaker; any other exception is
+    raised at once, as the server did answer.  A breaker of None never
+    opens"""
+    def __init__(self, attempts=3, backoff=0.5, maxBackoff=30.0, jitter=0.5,
+                 timeout=None, retryable=transient, breaker=None):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.retryable = retryable
+        self.breaker = breaker
+        self.retries = 0     # calls made again
+        self.failures = 0    # calls given up on
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def delay(self, retry):
+        """Returns the seconds to wait before the given retry, counted from
+        one"""
+        delay = min(self.maxBackoff, self.backoff * 2 ** (retry - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, fn, *args, **kwargs):
+        """Returns fn(*args, **kwargs), retrying it as the policy says.
+        The exception of the last attempt is raised if none succeed"""
+        breaker = self.breaker
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError("Too many failed requests, not trying "
+                                       "again for %g seconds" %
+                                       breaker.resetAfter)
+            attempt += 1
+            try:
+                result = fn(*args, **kwargs)
+            except self.retryable:
+                exc_info = sys.exc_info()
+                if breaker is not None:
+                    breaker.failure()
+                if attempt >= self.attempts:
+                    self.count('failures')
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self.count('retries')
+                time.sleep(self.delay(attempt))
+                continue
+            except Exception:
+                # the server answered, with a fault
+                if breaker is not None:
+                    breaker.success()
+                raise
+            if breaker is not None:
+                breaker.success()
+            return result
@@ -0,0 +1,116 @@
+"""A TIFF writer that writes an image a strip at a time.
+
+PIL needs the whole image in memory to save it.  :class:`StripWriter`
+writes uncompressed RGB strips to the file as they are produced and
+the directory describing them when it is closed, so only one strip is
+ever held.  Images over 4GB are written as BigTIFF.
+"""
+
+import os
+import struct
+
+# TIFF field types
+SHORT = 3
+LONG = 4
+LONG8 = 16
+
+# Images with more bytes than this are written as BigTIFF
+bigtiff_threshold = 2**32 - 2**24
+
+_formats = {SHORT: 'H', LONG: 'I', LONG8: 'Q'}
+
+
+class StripWriter(object):
+    """Writes a width x height RGB TIFF to filename as strips of
+    rowsPerStrip rows, top to bottom.  Every strip but the last must be
+    full.  bigtiff is chosen from the image size when it is None.
+
+    To carry on with a file that was being written, pass the offsets and
+    counts of the strips already in it: the file is cut off after them and
+    the next strip written follows them"""
+    def __init__(self, filename, width, height, rowsPerStrip, bigtiff=None,
+                 offsets=None, counts=None):
+        self.width = int(width)
+        self.height = int(height)
+        self.rowsPerStrip = int(rowsPerStrip)
+        self.samples = 3
+        if bigtiff is None:
+            bigtiff = self.width * self.height * self.samples > bigtiff_threshold
+        self.bigtiff = bigtiff
+        self.offsets = []
+        self.counts = []
+        self.rows = 0
+        if offsets:
+            self.offsets = list(offsets)
+            self.counts = list(counts)
+            self.rows = min(self.height, len(offsets) * self.rowsPerStrip)
+            self.file = open(filename, 'r+b')
+            self.file.seek(offsets[-1] + counts[-1])
+            self.file.truncate()
+            return
+        self.file = open(filename, 'wb')
+        if bigtiff:
+            self.file.write(struct.pack('<2sHHHQ', 'II', 43, 8, 0, 0))
+        else:
+            self.file.write(struct.pack('<2sHI', 'II', 42, 0))
+
+    def write_strip(self, data):
+        """Appends the next strip of interleaved RGB bytes"""
+        rows = min(self.rowsPerStrip, self.height - self.rows)
+        if len(data) != rows * self.width * self.samples:
+            raise ValueError("Expected a strip of %d rows" % rows)
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+        self.rows += rows
+
+    def sync(self):
+        """Flushes the strips written so far to disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """Writes the image directory and closes the file"""
+        if self.rows != self.height:
+            self.file.close()
+            raise ValueError("Only %d of %d rows were written" % (self.rows,
+                                                                 self.height))
+        offset_type = self.bigtiff and LONG8 or LONG
+        tags = [(256, LONG, [self.width]),
+                (257, LONG, [self.height]),
+                (258, SHORT, [8] * self.samples),
+                (259, SHORT, [1]),             # no compression
+                (262, SHORT, [2]),             # RGB
+                (273, offset_type, self.offsets),
+                (277, SHORT, [self.samples]),
+                (278, LONG, [self.rowsPerStrip]),
+                (279, offset_type, self.counts),
+                (284, SHORT, [1])]             # interleaved
+        if self.bigtiff:
+            inline, entry, count, pointer = 8, '<HHQ', '<Q', '<Q'
+        else:
+            inline, entry, count, pointer = 4, '<HHI', '<H', '<I'
+
+        # values that do not fit in their entry are written ahead of the IFD
+        f = self.file
+        entries = []
+        for tag, ftype, values in tags:
+            packed = struct.pack('<%d%s' % (len(values), _formats[ftype]),
+                                 *values)
+            if len(packed) <= inline:
+                value = packed.ljust(inline, '\0')
+            else:
+                if f.tell() % 2:
+                    f.write('\0')
+                value = struct.pack(pointer, f.tell())
+                f.write(packed)
+            entries.append(struct.pack(entry, tag, ftype, len(values)) + value)
+        if f.tell() % 2:
+            f.write('\0')
+        ifd = f.tell()
+        f.write(struct.pack(count, len(entries)))
+        f.write(''.join(entries))
+        f.write(struct.pack(pointer, 0))
+        f.seek(self.bigtiff and 8 or 4)
+        f.write(struct.pack(pointer, ifd))
+        f.close()
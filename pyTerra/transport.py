@@ -0,0 +1,164 @@
+"""HTTP transport for the suds clients used by :mod:`pyTerra.api`.
+
+suds' own transport goes through urllib2 and opens a new connection for
+every request.  :class:`KeepAliveTransport` holds its connection to the
+TerraServer open between requests instead.  A transport, like the suds
+client it belongs to, is only ever used by one thread, so
+:mod:`pyTerra.api` gives each thread a client of its own.  The module
+level :data:`stats` count connection reuse across all transports.
+
+Errors reaching the server are raised as they are, socket errors and
+httplib exceptions, as is a :class:`HTTPStatusError` for a server that is
+there but unavailable, so that :mod:`pyTerra.retry` can tell them from
+SOAP faults, which suds raises as WebFaults.
+"""
+
+import httplib
+import socket
+import threading
+import urllib2
+import urlparse
+from cStringIO import StringIO
+
+from suds.transport import Transport, TransportError, Reply
+
+
+class TransportStats(object):
+    """Counts requests and connections across transports"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0      # SOAP requests sent
+        self.connections = 0   # connections opened
+        self.reused = 0        # requests sent on an already open connection
+        self.reconnects = 0    # kept connections found closed by the server
+
+    def count(self, **kwargs):
+        self._lock.acquire()
+        try:
+            for name, n in kwargs.items():
+                setattr(self, name, getattr(self, name) + n)
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Returns the counters as a dict"""
+        self._lock.acquire()
+        try:
+            return dict(requests=self.requests, connections=self.connections,
+                        reused=self.reused, reconnects=self.reconnects)
+        finally:
+            self._lock.release()
+
+stats = TransportStats()
+
+
+class HTTPStatusError(httplib.HTTPException):
+    """An HTTP 5xx status other than the 500 that carries a SOAP fault,
+    such as a 503 from a busy server or its proxy"""
+    def __init__(self, status, reason):
+        httplib.HTTPException.__init__(self, "%d %s" % (status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class KeepAliveTransport(Transport):
+    """A suds transport that keeps one persistent HTTP connection per host"""
+    def __init__(self, timeout=90, stats=stats):
+        Transport.__init__(self)
+        self.options.timeout = timeout
+        self.stats = stats
+        self.connections = {}
+
+    def __deepcopy__(self, memo):
+        # suds deep copies the options, and so the transport, when a client
+        # is cloned.  Connections must not be shared, so start afresh.
+        return self.__class__(self.options.timeout, self.stats)
+
+    def open(self, request):
+        # only used to read the WSDL and its imports
+        try:
+            return urllib2.urlopen(request.url, timeout=self.options.timeout)
+        except urllib2.HTTPError, e:
+            raise TransportError(str(e), e.code, e.fp)
+
+    def connection(self, scheme, netloc):
+        """Returns the open connection to netloc, connecting if need be"""
+        conn = self.connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(netloc,
+                                               timeout=self.options.timeout)
+            else:
+                conn = httplib.HTTPConnection(netloc,
+                                              timeout=self.options.timeout)
+            self.connections[(scheme, netloc)] = conn
+            self.stats.count(connections=1)
+        else:
+            self.stats.count(reused=1)
+            if conn.timeout != self.options.timeout:
+                # changed with set_options since the connection was made
+                conn.timeout = self.options.timeout
+                if conn.sock is not None:
+                    try:
+                        conn.sock.settimeout(conn.timeout)
+                    except socket.error:
+                        pass
+        return conn
+
+    def post(self, url, body, headers):
+        """POSTs body to url and returns the httplib response, which must be
+        read completely before the connection is used again"""
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+        self.stats.count(requests=1)
+        for attempt in (0, 1):
+            fresh = (scheme, netloc) not in self.connections
+            conn = self.connection(scheme, netloc)
+            try:
+                conn.request('POST', path or '/', body, headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                self.drop(scheme, netloc)
+                # a kept connection may have been closed by the server
+                # while idle, try once more on a new one
+                if fresh or attempt:
+                    raise
+                self.stats.count(reconnects=1)
+                continue
+            if response.getheader('connection', '').lower() == 'close':
+                # read by the caller, the socket stays with the response
+                self.connections.pop((scheme, netloc), None)
+            return response
+
+    def send(self, request):
+        try:
+            response = self.post(request.url, request.message,
+                                 request.headers)
+            body = response.read()
+        except (httplib.HTTPException, socket.error):
+            # suds only handles TransportErrors, anything else reaches the
+            # caller unchanged
+            self.close()
+            raise
+        if response.status in (202, 204):
+            return None
+        if response.status > 500:
+            raise HTTPStatusError(response.status, response.reason)
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status,
+                                 StringIO(body))
+        return Reply(response.status, dict(response.getheaders()), body)
+
+    def drop(self, scheme, netloc):
+        conn = self.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """Closes all of the transport's connections"""
+        for scheme, netloc in self.connections.keys():
+            self.drop(scheme, netloc)
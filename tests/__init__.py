@@ -1 +1,18 @@
-import api
\ No newline at end of file
+import api
+import startup
+import projection
+import grid
+import futures
+import transport
+import tiff
+import cache
+import pack
+import flight
+import meta
+import retry
+import limit
+import manifest
+import batch
+import fastpath
+import decode
+import pyramid
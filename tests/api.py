@@ -81,12 +81,22 @@ class PyTerraTest(unittest.TestCase):
         pt.Lon = -93.000
         pt.Lat = 43.000
         resp = ConvertLonLatPtToUtmPt(pt)
-        expected_x = '500000.0000000000'
-        expected_y = '4760814.7962907264'
+        # the TerraServer's answer, the local conversion agrees to a millimeter
+        expected_x = 500000.0000000000
+        expected_y = 4760814.7962907264
         expected_zone = '15'
-        self.assertEqual('%.10f' % resp.X, expected_x)
-        self.assertEqual('%.10f' % resp.Y, expected_y)
+        self.assertAlmostEqual(resp.X, expected_x, 3)
+        self.assertAlmostEqual(resp.Y, expected_y, 3)
         self.assertEqual('%d' % resp.Zone, expected_zone)
+    def testConvertLonLatPtToUtmPtremote(self):
+        """ConvertLonLatPtToUtmPt matches the TerraServer"""
+        pt.Lon = -93.000
+        pt.Lat = 43.000
+        local = ConvertLonLatPtToUtmPt(pt)
+        remote = ConvertLonLatPtToUtmPt(pt, remote=True)
+        self.assertAlmostEqual(local.X, remote.X, 3)
+        self.assertAlmostEqual(local.Y, remote.Y, 3)
+        self.assertEqual(local.Zone, remote.Zone)
     def testConvertLonLatPtToUtmPtassert(self):
         """ConvertLonLatPtToUtmPt traps bad inputs"""
         pt.Lat = 'abc'
@@ -171,8 +181,8 @@ class PyTerraTest(unittest.TestCase):
         utm.Y = '4760814.7962907264'
         utm.Zone = '15'
         resp = ConvertUtmPtToLonLatPt(utm)
-        self.assertEqual('%.10f' % resp.Lat, '43.0000000000')
-        self.assertEqual('%.10f' % resp.Lon, '-93.0000000000')
+        self.assertAlmostEqual(resp.Lat, 43.0, 8)
+        self.assertAlmostEqual(resp.Lon, -93.0, 8)
     def testGetAreaFromRectassert(self):
         """GetAreaFromRect traps bad inputs"""
         self.assertRaises(pyTerraError,
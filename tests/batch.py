@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pyTerra import api, batch, image
+
+
+geojson = '''{"type": "FeatureCollection", "features": [
+  {"type": "Feature", "properties": {"name": "a"},
+   "geometry": {"type": "Polygon", "coordinates": [[[-93.80, 42.09],
+       [-93.79, 42.09], [-93.79, 42.10], [-93.80, 42.09]]]}},
+  {"type": "Feature", "id": "b", "bbox": [-93.796, 42.09, -93.786, 42.1],
+   "geometry": null}]}
+'''
+
+csvfile = '''name,minx,miny,maxx,maxy,zone
+c,433714,4659843,434914,4661043,15
+'''
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        filename = os.path.join(self.root, name)
+        f = open(filename, 'w')
+        f.write(data)
+        f.close()
+        return filename
+
+    def testRead(self):
+        """Extents are read from GeoJSON and CSV"""
+        extents = batch.read_geojson(self.write('a.json', geojson))
+        self.assertEqual([e[0] for e in extents], ['a', 'b'])
+        name, ul, lr = extents[0]
+        self.assertEqual((ul.Lon, ul.Lat, lr.Lon, lr.Lat),
+                         (-93.80, 42.10, -93.79, 42.09))
+        extents = batch.read_csv(self.write('c.csv', csvfile))
+        name, ul, lr = extents[0]
+        self.assertEqual((name, ul.X, ul.Y, lr.X, lr.Y, lr.Zone),
+                         ('c', 433714, 4661043, 434914, 4659843, 15))
+
+    def testPlan(self):
+        """Tiles shared by extents are only planned once"""
+        b = batch.Batch('Scale2m', 'DOQ', self.root)
+        for name, ul, lr in batch.read_geojson(self.write('a.json', geojson)):
+            b.add(name, ul, lr)
+        first = b.images[0][1]
+        b.add('a again', first.upperLeft, first.lowerRight)
+        tiles, owners = b.plan()
+        total = sum([len(img.tileslist) for name, img in b.images])
+        self.assertTrue(len(tiles) < total)
+        self.assertEqual(sum([len(o) for o in owners.values()]), total)
+        self.assertEqual(b.images[0][1].Zone, 15)
+
+    def testCached(self):
+        """Extents whose tiles are all cached are yielded straight away"""
+        b = batch.Batch('Scale2m', 'DOQ', self.root)
+        extents = batch.read_geojson(self.write('a.json', geojson))
+        for name, ul, lr in extents:
+            b.add(name, ul, lr)
+        tiles, owners = b.plan()
+        for tile in tiles:
+            b.fetcher.cache.put(tile.key(), 'data')
+        done = []
+        b.progress = lambda *args: done.append(args)
+        mosaics = list(b.iter_mosaics())
+        self.assertEqual([m[0] for m in mosaics], ['a', 'b'])
+        self.assertEqual([m[2] for m in mosaics], [[], []])
+        self.assertEqual(done[-1], (len(tiles), 0, len(tiles)))
+
+    def testScales(self):
+        """Extents at other scales and themes are planned with the rest"""
+        b = batch.Batch('Scale2m', 'DOQ', self.root)
+        name, ul, lr = batch.read_geojson(self.write('a.json', geojson))[0]
+        b.add('2m', ul, lr)
+        b.add('4m', ul, lr, Scale='Scale4m')
+        b.add('topo', ul, lr, Theme='DRG')
+        tiles, owners = b.plan()
+        self.assertEqual(sorted(set([(t.Theme, t.Scale) for t in tiles])),
+                         [('DOQ', 'Scale2m'), ('DOQ', 'Scale4m'),
+                          ('DRG', 'Scale2m')])
+        self.assertEqual(len(tiles), sum([len(img.tileslist)
+                                          for name, img in b.images]))
+
+    def testImageData(self):
+        """Fetched tiles do not keep their data once they are in the cache"""
+        fetched = []
+        def download_tile(tile):
+            tile.imagedata = 'data'
+            fetched.append(tile)
+        old = image.download_tile
+        image.download_tile = download_tile
+        try:
+            b = batch.Batch('Scale2m', 'DOQ', self.root)
+            b.fetcher.limiter = None
+            for name, ul, lr in batch.read_geojson(self.write('a.json',
+                                                              geojson)):
+                b.add(name, ul, lr)
+            mosaics = list(b.iter_mosaics())
+        finally:
+            image.download_tile = old
+        self.assertEqual([m[2] for m in mosaics], [[], []])
+        self.assertEqual(len(fetched), len(b.plan()[0]))
+        self.assertEqual([t for t in fetched if t.imagedata is not None], [])
+
+    def testBounded(self):
+        """Tiles are not fetched far ahead of the mosaics being written"""
+        fetched = []
+        def download_tile(tile):
+            tile.imagedata = 'data'
+            fetched.append(tile)
+        old = image.download_tile
+        image.download_tile = download_tile
+        try:
+            b = batch.Batch('Scale1m', 'DOQ', self.root)
+            b.fetcher.limiter = None
+            b.fetcher.retrieverThreads = 2
+            b.fetcher.queueSize = 4
+            first = b.add('first', api.UtmPt(433714, 4659843, 15),
+                          api.UtmPt(433715, 4659842, 15))
+            b.add('large', api.UtmPt(433714, 4661043, 15),
+                  api.UtmPt(434914, 4659843, 15))
+            mosaics = b.iter_mosaics()
+            self.assertTrue(mosaics.next()[1] is first)
+            time.sleep(0.3)
+            # the queue, the threads and the tile queue
+            self.assertTrue(len(fetched) <= 4 + 2 + 4 + 1)
+            self.assertEqual([m[0] for m in mosaics], ['large'])
+        finally:
+            image.download_tile = old
+
+    def testNoCache(self):
+        """A batch needs a cache to make the mosaics from"""
+        self.assertRaises(api.pyTerraError, batch.Batch, 'Scale2m', 'DOQ',
+                          None)
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyTerra import cache
+
+
+def key(x):
+    return ('Ortho', 15, x, 11648, 'Scale2m')
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testDirectoryCache(self):
+        """DirectoryCache keeps the original file names"""
+        c = cache.DirectoryCache(self.root)
+        self.assertEqual(c.get(key(1)), None)
+        c.put(key(1), 'data')
+        self.assertEqual(os.listdir(self.root),
+                         ['Ortho-15-1-11648-Scale2m.gif'])
+        self.assertEqual(c.get(key(1)), 'data')
+        self.assertTrue(key(1) in c)
+
+    def testManagedCache(self):
+        """ManagedCache stores tiles in hashed subdirectories"""
+        c = cache.ManagedCache(self.root)
+        self.assertEqual(c.get(key(1)), None)
+        c.put(key(1), 'data')
+        self.assertTrue(key(1) in c)
+        self.assertFalse(key(2) in c)
+        self.assertEqual(c.get(key(1)), 'data')
+        filename = c.filename(key(1))
+        self.assertTrue(os.path.isfile(filename))
+        self.assertEqual(len(os.path.relpath(filename, self.root).split(os.sep)),
+                         3)
+        c.close()
+
+    def testLRU(self):
+        """The least recently used tiles are evicted"""
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        for x in range(10):
+            c.put(key(x), 'x' * 100)
+        c.get(key(0))
+        c.put(key(10), 'x' * 100)
+        self.assertTrue(c.size <= 900)
+        self.assertTrue(key(0) in c)
+        self.assertFalse(key(1) in c)
+        self.assertTrue(key(10) in c)
+        self.assertFalse(os.path.isfile(c.filename(key(1))))
+        c.close()
+
+    def testLFU(self):
+        """The least frequently used tiles are evicted"""
+        c = cache.ManagedCache(self.root, maxBytes=1000, policy='lfu')
+        for x in range(10):
+            c.put(key(x), 'x' * 100)
+            if x != 5:
+                c.get(key(x))
+        c.put(key(10), 'x' * 100)
+        self.assertFalse(key(5) in c)
+        self.assertTrue(key(0) in c)
+        c.close()
+
+    def testPersistence(self):
+        """The index is reloaded, or rebuilt when it is missing"""
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        for x in range(5):
+            c.put(key(x), 'x' * 100)
+        c.journal.close()
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        self.assertEqual(len(c), 5)
+        self.assertEqual(c.size, 500)
+        c.close()
+        os.remove(c.indexfile)
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        self.assertEqual(len(c), 5)
+        self.assertEqual(c.get(key(3)), 'x' * 100)
+        c.close()
+
+    def testShared(self):
+        """ManagedCaches sharing a directory keep each other's tiles in the
+        index and in the budget"""
+        a = cache.ManagedCache(self.root, maxBytes=1000)
+        b = cache.ManagedCache(self.root, maxBytes=1000)
+        a.put(key(0), 'a' * 100)
+        b.put(key(1), 'b' * 100)
+        a.flush()
+        b.flush()
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        self.assertEqual(sorted([name for name in c.entries]),
+                         ['Ortho-15-0-11648-Scale2m',
+                          'Ortho-15-1-11648-Scale2m'])
+        c.close()
+        for x in range(2, 12):
+            (x % 2 and b or a).put(key(x), 'x' * 100)
+        self.assertTrue(a.size <= 1000)
+        self.assertFalse(key(0) in b)
+        self.assertFalse(os.path.isfile(a.filename(key(0))))
+        a.flush()
+        self.assertEqual(a.entries.keys(), b.entries.keys())
+        a.close()
+        b.close()
+        c = cache.ManagedCache(self.root, maxBytes=1000)
+        self.assertEqual(c.size, 100 * len(c))
+        self.assertTrue(key(11) in c)
+        c.close()
+
+    def testMemoryCache(self):
+        """MemoryCache drops the least recently used tiles by size"""
+        c = cache.MemoryCache(maxBytes=250)
+        for x in range(3):
+            c.put(key(x), 'x' * 100)
+        self.assertEqual(c.size, 200)
+        self.assertFalse(key(0) in c)
+        self.assertEqual(c.get(key(1)), 'x' * 100)
+        c.put(key(3), 'x' * 100)
+        self.assertTrue(key(1) in c)
+        self.assertFalse(key(2) in c)
+        self.assertEqual(c.get(key(2)), None)
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+    def testTieredCache(self):
+        """TieredCache promotes disk hits into memory and counts each tier"""
+        disk = cache.DirectoryCache(self.root)
+        disk.put(key(1), 'data')
+        c = cache.TieredCache(cache.MemoryCache(), disk)
+        self.assertEqual(c.root, self.root)
+        self.assertEqual(c.get(key(1)), 'data')
+        self.assertTrue(key(1) in c.tiers[0])
+        self.assertEqual(c.get(key(1)), 'data')
+        self.assertEqual(c.get(key(2)), None)
+        self.assertEqual(c.stats(), [('MemoryCache', 1, 3, 1 / 3.0),
+                                     ('DirectoryCache', 1, 2, 0.5)])
@@ -0,0 +1,94 @@
+import cStringIO
+import os
+import signal
+import time
+import unittest
+
+import Image
+
+from pyTerra import api, decode, grid
+from pyTerra.image import tobytes
+
+side = grid.side
+
+
+def sleep(seconds, left, top):
+    time.sleep(seconds)
+
+
+def tile(x, y, mode="RGB"):
+    i = Image.new("RGB", (side, side), ((x * 70) % 256, (y * 90) % 256, 40))
+    i.paste((200, 10, 10), (x * 7, y * 11, x * 7 + 50, y * 11 + 30))
+    if mode != "RGB":
+        i = i.convert(mode)
+    f = cStringIO.StringIO()
+    i.save(f, "JPEG")
+    return f.getvalue()
+
+class DecodeTest(unittest.TestCase):
+    def testSameAsPaste(self):
+        """The pool makes the same mosaic as pasting in this process"""
+        tiles = [(x, y, tile(x, y, y == 1 and "L" or "RGB"))
+                 for x in range(3) for y in range(2)]
+        pool = decode.DecodePool(3 * side, 2 * side, 2)
+        try:
+            for x, y, data in tiles:
+                pool.paste(data, x * side, y * side)
+            mosaic = pool.image()
+        finally:
+            pool.close()
+        n = Image.new("RGB", (3 * side, 2 * side))
+        for x, y, data in tiles:
+            n.paste(Image.open(cStringIO.StringIO(data)), (x * side, y * side))
+        self.assertEqual(mosaic.size, n.size)
+        self.assertEqual(tobytes(mosaic), tobytes(n))
+
+    def testResample(self):
+        """Tiles are resampled to tileSide and clipped to the mosaic"""
+        pool = decode.DecodePool(150, 100, 1, tileSide=100)
+        try:
+            pool.paste(tile(0, 0), 0, 0)
+            pool.paste(tile(1, 0), 100, 0)
+            mosaic = pool.image()
+        finally:
+            pool.close()
+        small = Image.open(cStringIO.StringIO(tile(1, 0))).resize(
+            (100, 100), Image.ANTIALIAS)
+        self.assertEqual(mosaic.size, (150, 100))
+        self.assertEqual(mosaic.crop((100, 0, 150, 100)).getdata()[0],
+                         small.crop((0, 0, 50, 100)).getdata()[0])
+
+    def testErrors(self):
+        """Tiles that cannot be decoded raise a pyTerraError"""
+        pool = decode.DecodePool(side, side, 1)
+        try:
+            pool.paste('not a tile', 0, 0)
+            self.assertRaises(api.pyTerraError, pool.image)
+        finally:
+            pool.close()
+
+    def testDeadWorker(self):
+        """A worker killed while decoding raises a pyTerraError"""
+        paste = decode._paste
+        decode._paste = sleep
+        try:
+            pool = decode.DecodePool(side, side, 1)
+        finally:
+            decode._paste = paste
+        try:
+            pool.paste(30, 0, 0)
+            time.sleep(0.5)
+            os.kill(pool.workers[0].pid, signal.SIGKILL)
+            start = time.time()
+            try:
+                pool.wait()
+            except api.pyTerraError, e:
+                self.assertTrue('died' in str(e))
+            else:
+                self.fail("no pyTerraError")
+            self.assertTrue(time.time() - start < 10)
+        finally:
+            pool.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import BaseHTTPServer
+import base64
+import httplib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib
+
+from suds.client import Client
+
+from pyTerra import api, fastpath, transport
+
+wsdl = '''<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:s="http://www.w3.org/2001/XMLSchema" xmlns:tns="http://msrmaps.com/"
+    targetNamespace="http://msrmaps.com/"
+    xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/">
+ <wsdl:types>
+  <s:schema elementFormDefault="qualified" targetNamespace="http://msrmaps.com/">
+   <s:element name="GetTile"><s:complexType><s:sequence>
+    <s:element minOccurs="0" maxOccurs="1" name="id" type="tns:TileId" />
+   </s:sequence></s:complexType></s:element>
+   <s:complexType name="TileId"><s:sequence>
+    <s:element minOccurs="1" maxOccurs="1" name="Theme" type="s:int" />
+    <s:element minOccurs="1" maxOccurs="1" name="Scale" type="tns:Scale" />
+    <s:element minOccurs="1" maxOccurs="1" name="Scene" type="s:int" />
+    <s:element minOccurs="1" maxOccurs="1" name="X" type="s:int" />
+    <s:element minOccurs="1" maxOccurs="1" name="Y" type="s:int" />
+   </s:sequence></s:complexType>
+   <s:simpleType name="Scale"><s:restriction base="s:string">
+    <s:enumeration value="Scale1m" /><s:enumeration value="Scale2m" />
+   </s:restriction></s:simpleType>
+   <s:element name="GetTileResponse"><s:complexType><s:sequence>
+    <s:element minOccurs="0" maxOccurs="1" name="GetTileResult"
+               type="s:base64Binary" />
+   </s:sequence></s:complexType></s:element>
+  </s:schema>
+ </wsdl:types>
+ <wsdl:message name="GetTileSoapIn">
+  <wsdl:part name="parameters" element="tns:GetTile" /></wsdl:message>
+ <wsdl:message name="GetTileSoapOut">
+  <wsdl:part name="parameters" element="tns:GetTileResponse" /></wsdl:message>
+ <wsdl:portType name="TerraServiceSoap"><wsdl:operation name="GetTile">
+  <wsdl:input message="tns:GetTileSoapIn" />
+  <wsdl:output message="tns:GetTileSoapOut" />
+ </wsdl:operation></wsdl:portType>
+ <wsdl:binding name="TerraServiceSoap" type="tns:TerraServiceSoap">
+  <soap:binding transport="http://schemas.xmlsoap.org/soap/http" />
+  <wsdl:operation name="GetTile">
+   <soap:operation soapAction="http://msrmaps.com/GetTile" style="document" />
+   <wsdl:input><soap:body use="literal" /></wsdl:input>
+   <wsdl:output><soap:body use="literal" /></wsdl:output>
+  </wsdl:operation>
+ </wsdl:binding>
+ <wsdl:service name="TerraService"><wsdl:port name="TerraServiceSoap"
+     binding="tns:TerraServiceSoap">
+  <soap:address location="http://127.0.0.1:%d/TerraService2.asmx" />
+ </wsdl:port></wsdl:service>
+</wsdl:definitions>
+'''
+
+response = ('<?xml version="1.0" encoding="utf-8"?><soap:Envelope '
+            'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<soap:Body><GetTileResponse xmlns="http://msrmaps.com/">'
+            '%s</GetTileResponse></soap:Body></soap:Envelope>')
+
+fault = ('<?xml version="1.0" encoding="utf-8"?><soap:Envelope '
+         'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+         '<soap:Fault><faultcode>soap:Server</faultcode>'
+         '<faultstring>Tile &lt;624&gt; not found</faultstring>'
+         '</soap:Fault></soap:Body></soap:Envelope>')
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['content-length']))
+        self.server.requests.append((self.headers.get('soapaction'), body))
+        status, reply = self.server.reply
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    def log_message(self, *args):
+        pass
+
+class FastPathTest(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(1)
+        thread.start()
+        self.dir = tempfile.mkdtemp()
+        filename = os.path.join(self.dir, 'TerraService2.wsdl')
+        f = open(filename, 'w')
+        f.write(wsdl % self.server.server_port)
+        f.close()
+        self.transport = transport.KeepAliveTransport(
+            timeout=5, stats=transport.TransportStats())
+        self.client = Client('file://' + urllib.pathname2url(filename),
+                             cache=None, transport=self.transport)
+        self.envelope = fastpath.Envelope(self.client)
+        self.data = ''.join([chr(random.randrange(256))
+                             for i in xrange(200000)])
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def serve(self, result, status=200):
+        self.server.reply = (status, response % result)
+
+    def fast(self, x=624, y=5951):
+        return fastpath.get_tile(self.transport, 1, 'Scale1m', 15, x, y,
+                                 self.envelope)
+
+    def slow(self, x=624, y=5951):
+        t = self.client.factory.create('TileId')
+        t.Theme, t.Scale, t.Scene, t.X, t.Y = 1, 'Scale1m', 15, x, y
+        return base64.decodestring(self.client.service.GetTile(t))
+
+    def testRequest(self):
+        """The fast path sends what suds sends"""
+        self.serve('<GetTileResult>%s</GetTileResult>' %
+                   base64.b64encode('tile'))
+        self.slow(-3, 100000)
+        self.fast(-3, 100000)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0], self.server.requests[1])
+
+    def testSameBytes(self):
+        """The fast path decodes the same bytes as suds"""
+        for encoded in (base64.b64encode(self.data),
+                        base64.encodestring(self.data),
+                        base64.encodestring(self.data).replace('\n', '\r\n')):
+            self.serve('<GetTileResult>%s</GetTileResult>' % encoded)
+            self.assertEqual(self.fast(), self.data)
+            self.assertEqual(self.slow(), self.data)
+
+    def testChunks(self):
+        """Tags and data split between chunks are read"""
+        for chunkSize in (1, 3, 7, 4096):
+            f = tempfile.TemporaryFile()
+            f.write(response % ('<GetTileResult>%s</GetTileResult>' %
+                                base64.b64encode(self.data[:5000])))
+            f.seek(0)
+            self.assertEqual(fastpath.read_result(f, chunkSize),
+                             self.data[:5000])
+            self.assertEqual(f.read(), '')
+
+    def testEmpty(self):
+        """A missing or empty result is None"""
+        for result in ('', '<GetTileResult />', '<GetTileResult/>',
+                       '<GetTileResult></GetTileResult>'):
+            self.serve(result)
+            self.assertEqual(self.fast(), None)
+
+    def testFault(self):
+        """A SOAP fault is raised with its faultstring"""
+        self.server.reply = (500, fault)
+        try:
+            self.fast()
+        except api.pyTerraError, e:
+            self.assertEqual(str(e), 'Tile <624> not found')
+        else:
+            self.fail("no pyTerraError")
+        # the connection is still usable
+        self.serve('<GetTileResult>%s</GetTileResult>' %
+                   base64.b64encode('tile'))
+        self.assertEqual(self.fast(), 'tile')
+        self.assertEqual(self.transport.stats.connections, 1)
+
+    def testUnavailable(self):
+        """A 503 and a response cut short are raised as httplib exceptions,
+        which are retried, rather than pyTerraErrors"""
+        self.server.reply = (503, 'busy')
+        self.assertRaises(transport.HTTPStatusError, self.fast)
+        f = tempfile.TemporaryFile()
+        cut = response.split('%s')[0] + '<GetTileResult>'
+        f.write(cut + base64.b64encode(self.data[:5000]))
+        f.seek(0)
+        self.assertRaises(httplib.IncompleteRead, fastpath.read_result, f)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pyTerra import api, cache, flight, grid, image, pack
+
+
+class FlightTest(unittest.TestCase):
+    def testSingleFlight(self):
+        """Concurrent calls for one key share a single call"""
+        group = flight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'data'
+        def ask():
+            results.append(group.do('key', fetch))
+        threads = [threading.Thread(target=ask) for i in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while group.shared < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['data'] * 5)
+        self.assertEqual(len(group), 0)
+        # a later call is made afresh
+        self.assertEqual(group.do('key', lambda: 'new'), 'new')
+
+    def testErrors(self):
+        """The exception of a call is raised to every caller"""
+        group = flight.SingleFlight()
+        self.assertRaises(ValueError, group.do, 'key', int, 'abc')
+        self.assertEqual(len(group), 0)
+
+    def testFileLocks(self):
+        """A tile locked by another process is waited for"""
+        if flight.fcntl is None or not hasattr(os, 'fork'):
+            return
+        root = tempfile.mkdtemp()
+        try:
+            locks = flight.file_locks(root)
+            self.assertTrue(flight.file_locks(root) is locks)
+            key = ('DOQ', 15, 1, 2, 'Scale4m')
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                offset = locks.acquire(key)
+                os.write(w, 'x')
+                time.sleep(0.5)
+                locks.release(offset)
+                os._exit(0)
+            os.read(r, 1)
+            start = time.time()
+            # other keys are not held up
+            locks.release(locks.acquire(('DOQ', 15, 1, 3, 'Scale4m')))
+            self.assertTrue(time.time() - start < 0.3)
+            locks.release(locks.acquire(key))
+            self.assertTrue(time.time() - start > 0.3)
+            os.waitpid(pid, 0)
+        finally:
+            shutil.rmtree(root)
+
+    def testSharedCaches(self):
+        """A tile another process stored is not downloaded again, even by a
+        cache that keeps its index in memory"""
+        if flight.fcntl is None or not hasattr(os, 'fork'):
+            return
+        saved = image.download_tile
+        downloaded = []
+        def download_tile(tile):
+            downloaded.append(tile.key())
+            tile.imagedata = 'parent'
+        image.download_tile = download_tile
+        size = grid.tile_size('Scale1m')
+        ul = api.UtmPt(10 * size + 1, 21 * size - 1, 15)
+        lr = api.UtmPt(11 * size - 1, 20 * size + 1, 15)
+        try:
+            for make in (cache.ManagedCache, pack.PackCache):
+                root = tempfile.mkdtemp()
+                try:
+                    img = image.TerraImage(ul, lr, 'Scale1m', 'DOQ', 15,
+                                           make(root))
+                    tile = grid.Tile(10, 20, 15, 'DOQ', 'Scale1m')
+                    pid = os.fork()
+                    if pid == 0:
+                        def child(tile):
+                            tile.imagedata = 'child'
+                        image.download_tile = child
+                        other = image.TerraImage(ul, lr, 'Scale1m', 'DOQ',
+                                                 15, make(root))
+                        other.limiter = None
+                        other.fetch_tile(grid.Tile(10, 20, 15, 'DOQ',
+                                                   'Scale1m'))
+                        other.cache.close()
+                        os._exit(0)
+                    os.waitpid(pid, 0)
+                    img.limiter = None
+                    img.fetch_tile(tile)
+                    self.assertEqual(tile.imagedata, 'child')
+                    self.assertEqual(downloaded, [])
+                    img.cache.close()
+                finally:
+                    shutil.rmtree(root)
+        finally:
+            image.download_tile = saved
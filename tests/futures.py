@@ -0,0 +1,50 @@
+import threading
+import unittest
+
+from pyTerra import api, futures
+
+
+class Object:
+    pass
+
+class FuturesTest(unittest.TestCase):
+    def testSubmit(self):
+        """AsyncTerraClient runs calls and returns their results"""
+        client = futures.AsyncTerraClient(maxInFlight=4)
+        pending = [client.submit(pow, i, 2) for i in range(20)]
+        self.assertEqual([f.result() for f in pending],
+                         [i * i for i in range(20)])
+        self.assertTrue(len(client.workers) <= 4)
+        client.close()
+        self.assertEqual(client.workers, [])
+
+    def testErrors(self):
+        """Exceptions are raised from Future.result"""
+        client = futures.AsyncTerraClient()
+        future = client.submit(int, 'abc')
+        self.assertRaises(ValueError, future.result)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        client.close()
+
+    def testInFlight(self):
+        """as_completed yields every finished call"""
+        client = futures.AsyncTerraClient(maxInFlight=10)
+        barrier = threading.Event()
+        pending = [client.submit(barrier.wait, 5) for i in range(10)]
+        barrier.set()
+        for f in futures.as_completed(pending):
+            self.assertTrue(f.done())
+        client.close()
+
+    def testOperations(self):
+        """The api operations are mirrored"""
+        client = futures.AsyncTerraClient()
+        utm = Object()
+        utm.X = 500000
+        utm.Y = 4760814.7962907264
+        utm.Zone = 15
+        resp = client.ConvertUtmPtToLonLatPt(utm).result()
+        self.assertAlmostEqual(resp.Lon, -93.0, 8)
+        for name in futures.operations:
+            self.assertTrue(hasattr(api, name))
+        client.close()
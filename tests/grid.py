@@ -0,0 +1,141 @@
+import unittest
+
+from pyTerra import api, grid
+
+
+class Object:
+    pass
+
+def utm(x, y, zone=15):
+    p = Object()
+    p.X = x
+    p.Y = y
+    p.Zone = zone
+    return p
+
+# Extended around Baker field, see tests/image.py
+lg_ul = utm(433714.25, 4661043.80)
+lg_lr = utm(438603.35, 4656591.96)
+
+class GridTest(unittest.TestCase):
+    def testScaleMeters(self):
+        """scale_meters understands the Scale names"""
+        self.assertEqual(grid.scale_meters('Scale1m'), 1.0)
+        self.assertEqual(grid.scale_meters('Scale64m'), 64.0)
+        self.assertEqual(grid.scale_meters('Scale500mm'), 0.5)
+        self.assertEqual(grid.scale_meters('Scale63mm'), 0.0625)
+        self.assertEqual(grid.tile_size('Scale4m'), 800.0)
+        self.assertRaises(api.pyTerraError, grid.scale_meters, 'Scale4')
+
+    def testPlanUtm(self):
+        """plan_extent matches the TerraServer for a UTM extent"""
+        plan = grid.plan_extent(lg_ul, lg_lr, 'Scale2m', 15)
+        self.assertEqual(plan, grid.TilePlan(1084, 11641, 1096, 11652,
+                                             'Scale2m', 15))
+        self.assertEqual((plan.numx, plan.numy), (13, 12))
+        self.assertEqual((plan.width, plan.height), (2600, 2400))
+        self.assertEqual(plan.offset(1084, 11652), (0, 0))
+        self.assertEqual(plan.offset(1096, 11641), (12, 11))
+        self.assertEqual(plan.pixel_box(1085, 11651), (200, 200, 400, 400))
+        self.assertEqual(plan.bounds(), (433600.0, 4656400.0,
+                                         438800.0, 4661200.0))
+
+    def testPlanLonLat(self):
+        """plan_extent matches the TerraServer for a lon/lat extent"""
+        # GetAreaFromPt's NorthWest tile at Scale4m is 624, 5951
+        ul = Object()
+        ul.Lon = -93.0005
+        ul.Lat = 43.0001
+        plan = grid.plan_extent(ul, ul, 'Scale4m', 15)
+        self.assertEqual((plan.minx, plan.maxy), (624, 5951))
+
+    def testPlanOtherZone(self):
+        """UTM corners in another zone are reprojected"""
+        plan = grid.plan_extent(lg_ul, lg_lr, 'Scale2m', 15)
+        ul = utm(*(grid.projection.lonlat_to_utm(
+                    *grid.projection.utm_to_lonlat(lg_ul.X, lg_ul.Y, 15),
+                    zone=14)))
+        other = grid.plan_extent(ul, lg_lr, 'Scale2m', 15)
+        self.assertEqual(other, plan)
+
+    def testTileSet(self):
+        """TileSet makes the plan's tiles in x then y order"""
+        plan = grid.plan_extent(lg_ul, lg_lr, 'Scale2m', 15)
+        tiles = grid.TileSet(plan, 'Ortho')
+        self.assertEqual(len(tiles), 156)
+        listed = list(tiles)
+        self.assertEqual(len(listed), 156)
+        first, last = listed[0], listed[-1]
+        self.assertEqual((first.X, first.Y), (1084, 11641))
+        self.assertEqual((first.xind, first.yind), (0, 11))
+        self.assertEqual((last.X, last.Y), (1096, 11652))
+        self.assertEqual(last.key(), ('Ortho', 15, 1096, 11652, 'Scale2m'))
+        self.assertEqual(tiles[-1].key(), last.key())
+        self.assertEqual(tiles[12].key(), listed[12].key())
+        part = tiles[10:20]
+        self.assertEqual(len(part), 10)
+        self.assertEqual(part[0].key(), listed[10].key())
+        self.assertEqual([t.key() for t in tiles[::50]],
+                         [t.key() for t in listed[::50]])
+        chunks = list(tiles.chunks(50))
+        self.assertEqual([len(c) for c in chunks], [50, 50, 50, 6])
+        self.assertEqual(chunks[3][5].key(), last.key())
+        self.assertRaises(IndexError, tiles.__getitem__, 156)
+
+    def testCovering(self):
+        """covering gives the tiles at another scale over the same block"""
+        plan = grid.plan_extent(lg_ul, lg_lr, 'Scale2m', 15)
+        coarse = plan.covering('Scale16m')
+        self.assertEqual(coarse.key(), (135, 1455, 137, 1456, 'Scale16m', 15))
+        self.assertEqual(coarse.covering('Scale2m').key(),
+                         (1080, 11640, 1103, 11655, 'Scale2m', 15))
+        self.assertEqual(plan.covering('Scale2m'), plan)
+
+    def testPixelWindow(self):
+        """pixel_window gives the tiles a window of the mosaic needs"""
+        plan = grid.TilePlan(10, 20, 14, 23, 'Scale4m', 15)
+        self.assertEqual(plan.pixel_window(0, 0, 1000, 800), plan)
+        self.assertEqual(plan.pixel_window(-50, -50, 2000, 2000), plan)
+        self.assertEqual(plan.pixel_window(199, 399, 201, 401).key(),
+                         (10, 21, 11, 22, 'Scale4m', 15))
+        self.assertEqual(plan.pixel_window(200, 0, 400, 200).key(),
+                         (11, 23, 11, 23, 'Scale4m', 15))
+        self.assertEqual(plan.pixel_window(200, 200, 200, 400), None)
+        self.assertEqual(plan.pixel_window(1000, 0, 1200, 200), None)
+
+    def testCenterOut(self):
+        """center_out orders tiles from the center, or the viewport, out"""
+        plan = grid.TilePlan(10, 20, 14, 24, 'Scale4m', 15)
+        self.assertEqual(len(grid.center_out(plan, 'DOQ')), 25)
+        tiles = list(grid.center_out(plan, 'DOQ'))
+        self.assertEqual(tiles[0].key(), ('DOQ', 15, 12, 22, 'Scale4m'))
+        self.assertEqual(sorted([t.key() for t in tiles[1:5]]),
+                         [('DOQ', 15, 11, 22, 'Scale4m'),
+                          ('DOQ', 15, 12, 21, 'Scale4m'),
+                          ('DOQ', 15, 12, 23, 'Scale4m'),
+                          ('DOQ', 15, 13, 22, 'Scale4m')])
+        self.assertEqual(sorted([t.key() for t in tiles]),
+                         sorted([t.key() for t in grid.TileSet(plan, 'DOQ')]))
+        # the upper left 2 x 2 tiles, nearest the viewport's center first
+        tiles = list(grid.center_out(plan, 'DOQ', (0, 0, 300, 300)))
+        self.assertEqual([(t.X, t.Y) for t in tiles[:4]],
+                         [(10, 24), (10, 23), (11, 24), (11, 23)])
+        self.assertEqual((tiles[4].X, tiles[4].Y), (10, 22))
+        self.assertEqual(sorted([t.key() for t in tiles]),
+                         sorted([t.key() for t in grid.TileSet(plan, 'DOQ')]))
+        self.assertEqual([(t.xind, t.yind) for t in tiles[:2]],
+                         [(0, 0), (0, 1)])
+        # the tiles are made ring by ring, not all up front
+        tiles = iter(grid.center_out(grid.TilePlan(0, 0, 9999, 9999,
+                                                   'Scale4m', 15), 'DOQ'))
+        self.assertEqual(tiles.next().key(), ('DOQ', 15, 5000, 4999,
+                                              'Scale4m'))
+
+    def testToPixels(self):
+        """to_pixels gives the window of a UTM box"""
+        plan = grid.TilePlan(10, 20, 14, 23, 'Scale4m', 15)
+        west, south, east, north = plan.bounds()
+        self.assertEqual(plan.to_pixels(west, south, east, north),
+                         (0, 0, 1000, 800))
+        self.assertEqual(plan.to_pixels(west + 10, north - 6, west + 18,
+                                        north - 30), (2, 1, 5, 8))
@@ -1,6 +1,14 @@
+import cStringIO
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
-from pyTerra import api, image
+import Image
+
+from pyTerra import api, cache, grid, image
 import datetime
 
 
@@ -56,6 +64,118 @@ scale = 'Scale2m'
 theme = 'Ortho'
 filename = 'test.jpg'
 
+def png():
+    f = cStringIO.StringIO()
+    Image.new("RGB", (grid.side, grid.side), (10, 20, 30)).save(f, "PNG")
+    return f.getvalue()
+
+class CountingCache(cache.DirectoryCache):
+    def __init__(self, root):
+        cache.DirectoryCache.__init__(self, root)
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+class StreamTest(unittest.TestCase):
+    """Fetching tiles, with download_tile replaced so nothing is sent to the
+    TerraServer"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.downloaded = []
+        self.download_tile = image.download_tile
+        data = png()
+        def download_tile(tile):
+            self.downloaded.append(tile.key())
+            if tile.key() == self.failing:
+                raise api.pyTerraError("no tile")
+            time.sleep(0.01)
+            tile.imagedata = data
+        image.download_tile = download_tile
+        self.failing = None
+
+    def tearDown(self):
+        image.download_tile = self.download_tile
+        shutil.rmtree(self.root)
+
+    def make(self, n, cacheDir=None):
+        size = grid.tile_size('Scale4m')
+        ul = api.UtmPt(100 * size + 1, (100 + n) * size - 1, 15)
+        lr = api.UtmPt((100 + n) * size - 1, 100 * size + 1, 15)
+        img = image.TerraImage(ul, lr, 'Scale4m', 'DOQ', 15, cacheDir)
+        img.limiter = None
+        img.get_extent()
+        return img
+
+    def testStopEarly(self):
+        """A consumer that stops early leaves no threads behind"""
+        img = self.make(6)
+        img.queueSize = 2
+        img.retrieverThreads = 3
+        before = threading.active_count()
+        tiles = img.iter_tile_data(img.tileslist)
+        tiles.next()
+        tiles.close()
+        deadline = time.time() + 5
+        while threading.active_count() > before and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(threading.active_count(), before)
+        self.assertTrue(len(self.downloaded) < 36)
+
+    def testFlushOnce(self):
+        """The cache is flushed once a download is done, not for each row
+        or window"""
+        c = CountingCache(self.root)
+        img = self.make(3, c)
+        img.write_strips(os.path.join(self.root, 'out.tif'))
+        self.assertEqual(c.flushes, 1)
+        windows = list(img.iter_windows(200, 200))
+        self.assertEqual(len(windows), 9)
+        self.assertEqual(c.flushes, 2)
+        img.download()
+        self.assertEqual(c.flushes, 3)
+
+    def testProgress(self):
+        """Progress is counted afresh for each download"""
+        img = self.make(3)
+        progress = []
+        img.progress = lambda *counts: progress.append(counts)
+        self.failing = ('DOQ', 15, 101, 101, 'Scale4m')
+        self.assertRaises(image.TileFetchError, img.download)
+        self.assertEqual(progress[-1], (8, 1, 9))
+        self.failing = None
+        img.write_strips(os.path.join(self.root, 'out.tif'))
+        self.assertEqual(progress[-1], (9, 0, 9))
+        list(img.iter_windows(200, 200))
+        self.assertEqual(progress[-1], (9, 0, 9))
+
+    def testSeparateCaches(self):
+        """A tile fetched at once for two caches ends up in both"""
+        started = threading.Event()
+        release = threading.Event()
+        download_tile = image.download_tile
+        def slow(tile):
+            started.set()
+            release.wait(5)
+            download_tile(tile)
+        image.download_tile = slow
+        images = []
+        for name in ('a', 'b'):
+            os.mkdir(os.path.join(self.root, name))
+            images.append(self.make(1, os.path.join(self.root, name)))
+        threads = [threading.Thread(target=img.fetch_tile,
+                                    args=(img.tileslist[0],))
+                   for img in images]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        for img in images:
+            self.assertTrue(cache.tile_key(img.tileslist[0]) in img.cache)
+
 class ImageTest(unittest.TestCase):
     def testFetchSmallImage(self):
         """Fetching small image works"""
@@ -76,3 +196,27 @@ class ImageTest(unittest.TestCase):
         self.assertEqual(t.mode, 'RGB')
         self.assertEqual(img.number_of_tiles, 156)
 
+    def testPlannedExtent(self):
+        """The locally planned tiles match the TerraServer"""
+        img = image.TerraImage(lg_ul, lg_lr, scale, theme, lr.Zone)
+        img.verifyExtent = True
+        img.get_extent()
+        self.assertEqual(img.number_of_tiles, 156)
+
+    def testToArray(self):
+        """to_array matches the PIL image"""
+        img = image.TerraImage(ul, lr, scale, theme, lr.Zone, "/tmp")
+        a = img.to_array()
+        self.assertEqual(a.shape, (200, 200, 3))
+        self.assertTrue(img.to_array() is a)
+        t = img.download()
+        self.assertEqual(tuple(a[10, 20]), t.getpixel((20, 10)))
+
+    def testDateGrid(self):
+        """The capture dates come as a grid the shape of the mosaic"""
+        img = image.TerraImage(lg_ul, lg_lr, scale, theme, lr.Zone)
+        dates = img.get_date_grid()
+        self.assertEqual(len(dates), 12)
+        self.assertEqual(len(dates[0]), 13)
+        self.assertEqual(img.Scale, scale)
+        self.assertTrue(isinstance(dates[0][0], datetime.datetime))
@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+
+from pyTerra import limit
+
+
+class LimitTest(unittest.TestCase):
+    def testIncrease(self):
+        """The limit grows by about increase for every limit successes"""
+        limiter = limit.AdaptiveLimiter(initial=4, maximum=6)
+        for i in range(4):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertAlmostEqual(limiter.limit, 4.9, 1)
+        for i in range(100):
+            limiter.call(lambda: None)
+        self.assertEqual(limiter.limit, 6)
+
+    def testDecrease(self):
+        """Errors and slow calls halve the limit, once per round trip"""
+        limiter = limit.AdaptiveLimiter(initial=8, minimum=2)
+        limiter.acquire()
+        limiter.release(0.01)
+        limiter.acquire()
+        limiter.release(0.01, ok=False)
+        self.assertAlmostEqual(limiter.limit, 4.06, 2)
+        limiter.lastDecrease = 0
+        limiter.acquire()
+        limiter.release(1.0)
+        self.assertAlmostEqual(limiter.limit, 2.03, 2)
+        limiter.lastDecrease = 0
+        self.assertRaises(ValueError, limiter.call, int, 'abc')
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.stats()['errors'], 2)
+
+    def testConcurrency(self):
+        """No more than limit calls run at once"""
+        limiter = limit.AdaptiveLimiter(initial=3, maximum=3)
+        running = []
+        peak = []
+        def work():
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.pop()
+        threads = [threading.Thread(target=limiter.call, args=(work,))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(max(peak) <= 3)
+        self.assertEqual(limiter.inflight, 0)
+
+    def testTokenBucket(self):
+        """The bucket allows a burst, then rate calls a second"""
+        bucket = limit.TokenBucket(rate=50, burst=5)
+        start = time.time()
+        for i in range(10):
+            bucket.take()
+        self.assertTrue(0.08 < time.time() - start < 0.5)
+
+    def testEndpoint(self):
+        """Limiters are shared per endpoint"""
+        a = limit.for_endpoint('http://example.com/a', initial=2)
+        self.assertTrue(limit.for_endpoint('http://example.com/a') is a)
+        self.assertEqual(a.limit, 2)
+        self.assertFalse(limit.for_endpoint('http://example.com/b') is a)
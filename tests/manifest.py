@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from pyTerra import api, grid, manifest
+
+
+plan = grid.TilePlan(10, 20, 12, 21, 'Scale4m', 15)
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp('.manifest')
+        os.close(fd)
+        os.remove(self.filename)
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def testRecord(self):
+        """Tiles done and failed are read back from the manifest"""
+        tiles = list(grid.TileSet(plan, 'DOQ'))
+        m = manifest.Manifest(self.filename, plan, 'DOQ')
+        m.record(tiles[0])
+        m.record(tiles[1], api.pyTerraError("no\nluck"))
+        m.record(tiles[2], IOError())
+        m.record(tiles[2])
+        m.record_strip('/tmp/x.tif', 8, 100)
+        m.close()
+        f = open(self.filename, 'a')
+        f.write('+ 12')    # torn by a crash
+        f.close()
+        m = manifest.Manifest(self.filename, plan, 'DOQ')
+        self.assertEqual(m.progress(), (2, 1, 6))
+        self.assertTrue(m.is_done(tiles[2]))
+        self.assertFalse(m.is_done(tiles[1]))
+        self.assertEqual(m.failed.values(), ['no luck'])
+        self.assertEqual(m.strips, {'/tmp/x.tif': [(8, 100)]})
+        self.assertFalse(m.complete())
+        m.close()
+
+    def testOtherPlan(self):
+        """A manifest is only used for the download it was made for"""
+        manifest.Manifest(self.filename, plan, 'DOQ').close()
+        self.assertRaises(api.pyTerraError, manifest.Manifest, self.filename,
+                          plan, 'DRG')
+
+    def testStrips(self):
+        """Strips are forgotten from the first that the file they were
+        written to no longer holds"""
+        m = manifest.Manifest(self.filename, plan, 'DOQ')
+        m.record_strip(self.filename, 0, 10)
+        self.assertEqual(m.written_strips(self.filename), [(0, 10)])
+        m.record_strip(self.filename, 10, 10**6)
+        m.record_strip(self.filename, 10**6 + 10, 10)
+        self.assertEqual(m.written_strips(self.filename), [(0, 10)])
+        m.close()
+        m = manifest.Manifest(self.filename, plan, 'DOQ')
+        self.assertEqual(m.strips, {self.filename: [(0, 10)]})
+        self.assertEqual(m.written_strips('/nonexistent.tif'), [])
+        m.record_strip('/nonexistent.tif', 0, 10)
+        self.assertEqual(m.written_strips('/nonexistent.tif'), [])
+        self.assertFalse('/nonexistent.tif' in m.strips)
+        m.close()
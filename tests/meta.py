@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyTerra import api, meta, retry
+
+
+class Object:
+    pass
+
+class Service:
+    def __init__(self):
+        self.calls = []
+
+    def GetTheme(self, theme):
+        self.calls.append(theme)
+        return meta.Record([('Theme', theme), ('Name', u'Photo')])
+
+class MetaTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = api.client
+        api.client = Object()
+        api.client.service = Service()
+        # a breaker tripped by other tests must not fail these calls
+        self.retryPolicy = api.retryPolicy
+        api.retryPolicy = retry.RetryPolicy(backoff=0)
+
+    def tearDown(self):
+        api.client = self.client
+        api.retryPolicy = self.retryPolicy
+        api.metadataCache = None
+        shutil.rmtree(self.root)
+
+    def testRecord(self):
+        """Records are plain, picklable copies of responses"""
+        r = meta.Record([('Theme', 1), ('Name', u'Photo')])
+        self.assertEqual(list(r), [('Theme', 1), ('Name', u'Photo')])
+        self.assertEqual(r.Name, r['Name'])
+        self.assertEqual(meta.key((1, 'Scale4m')), meta.key((1, u'Scale4m')))
+
+    def testCache(self):
+        """Responses are cached until their ttl runs out"""
+        c = meta.MetadataCache(os.path.join(self.root, 'm.db'))
+        self.assertRaises(KeyError, c.get, 'GetTheme', 'k')
+        c.put('GetTheme', 'k', meta.Record([('Theme', 1)]))
+        self.assertEqual(c.get('GetTheme', 'k').Theme, 1)
+        c.ttls['GetTheme'] = -1
+        self.assertRaises(KeyError, c.get, 'GetTheme', 'k')
+        self.assertEqual((c.hits, c.misses), (1, 2))
+        c.close()
+
+    def testCall(self):
+        """Repeated calls are answered from the cache, even after a restart"""
+        filename = os.path.join(self.root, 'm.db')
+        api.metadataCache = meta.MetadataCache(filename)
+        first = api.GetTheme('DOQ')
+        self.assertEqual(first.Name, u'Photo')
+        self.assertEqual(api.GetTheme('1'), first)
+        api.metadataCache.close()
+        api.metadataCache = meta.MetadataCache(filename)
+        self.assertEqual(api.GetTheme(1), first)
+        self.assertEqual(api.client.service.calls, [1])
+        api.metadataCache.close()
+
+    def testPreload(self):
+        """preload caches many calls at once"""
+        api.metadataCache = meta.MetadataCache(os.path.join(self.root, 'm.db'))
+        self.assertEqual(api.metadataCache.preload('GetTheme', [1, 2, 'x']), 1)
+        self.assertEqual(len(api.metadataCache), 2)
+        api.GetTheme(2)
+        self.assertEqual(sorted(api.client.service.calls), [1, 2])
+        api.metadataCache.close()
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyTerra import pack
+
+
+def key(x):
+    return ('Ortho', 15, x, 11648, 'Scale2m')
+
+def put_many(root, first):
+    c = pack.PackCache(root, maxPackBytes=3000)
+    for x in range(first, first + 40):
+        c.put(key(x), str(x) * 20)
+    c.close()
+
+class PackTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testPutGet(self):
+        """PackCache stores tiles in pack files"""
+        c = pack.PackCache(self.root)
+        self.assertEqual(c.get(key(1)), None)
+        c.put(key(1), 'one')
+        c.put(key(2), 'two')
+        self.assertTrue(key(1) in c)
+        self.assertEqual(c.get(key(1)), 'one')
+        self.assertEqual(c.get(key(2)), 'two')
+        c.close()
+        files = ['pack-00001.dat', 'pack.idx']
+        if pack.fcntl is not None:
+            files.append('pack.lock')
+        self.assertEqual(sorted(os.listdir(self.root)), files)
+        c = pack.PackCache(self.root)
+        self.assertEqual(c.get(key(2)), 'two')
+        c.close()
+
+    def testRollover(self):
+        """A new pack is started when the current one is full"""
+        c = pack.PackCache(self.root, maxPackBytes=200)
+        for x in range(10):
+            c.put(key(x), 'x' * 50)
+        self.assertTrue(len(c.packs()) > 1)
+        for x in range(10):
+            self.assertEqual(c.get(key(x)), 'x' * 50)
+        c.close()
+
+    def testRecovery(self):
+        """Appends after the saved index are scanned, torn ones cut off"""
+        c = pack.PackCache(self.root)
+        c.put(key(1), 'one')
+        c.flush()
+        c.put(key(2), 'two')
+        c.put(key(3), 'three')
+        c.writer.close()
+        filename = c.packfile(c.current)
+        size = os.path.getsize(filename)
+        f = open(filename, 'r+b')
+        f.truncate(size - 2)
+        f.close()
+        c = pack.PackCache(self.root)
+        self.assertEqual(c.get(key(1)), 'one')
+        self.assertEqual(c.get(key(2)), 'two')
+        self.assertEqual(c.get(key(3)), None)
+        c.put(key(3), 'three')
+        c.close()
+        c = pack.PackCache(self.root)
+        self.assertEqual(c.get(key(3)), 'three')
+        c.close()
+
+    def testCompact(self):
+        """compact drops replaced tiles"""
+        c = pack.PackCache(self.root)
+        for i in range(3):
+            for x in range(5):
+                c.put(key(x), '%d' % i * 100)
+        self.assertTrue(c.garbage() > 0)
+        c.compact()
+        self.assertEqual(c.garbage(), 0)
+        self.assertEqual(c.packs(), [2])
+        for x in range(5):
+            self.assertEqual(c.get(key(x)), '2' * 100)
+        c.put(key(9), 'nine')
+        c.close()
+        c = pack.PackCache(self.root)
+        self.assertEqual(len(c), 6)
+        self.assertEqual(c.get(key(0)), '2' * 100)
+        c.close()
+
+    def testTwoWriters(self):
+        """Two PackCaches can append to the same directory"""
+        a = pack.PackCache(self.root)
+        b = pack.PackCache(self.root)
+        a.put(key(1), 'one')
+        b.put(key(2), 'two')
+        a.put(key(3), 'three')
+        b.put(key(4), 'four')
+        for c in (a, b):
+            self.assertEqual(c.get(key(1)), 'one')
+            self.assertEqual(c.get(key(3)), 'three')
+        self.assertEqual(a.get(key(4)), None)   # not appended since
+        a.flush()
+        self.assertEqual(a.get(key(4)), 'four')
+        a.close()
+        b.close()
+        c = pack.PackCache(self.root)
+        self.assertEqual([c.get(key(x)) for x in range(1, 5)],
+                         ['one', 'two', 'three', 'four'])
+        c.close()
+
+    def testTwoProcesses(self):
+        """Processes appending at the same time do not overwrite each other"""
+        workers = [multiprocessing.Process(target=put_many,
+                                           args=(self.root, first))
+                   for first in (0, 100)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        c = pack.PackCache(self.root)
+        self.assertEqual(len(c), 80)
+        self.assertEqual(c.garbage(), 0)
+        for first in (0, 100):
+            for x in range(first, first + 40):
+                self.assertEqual(c.get(key(x)), str(x) * 20)
+        c.close()
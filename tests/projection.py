@@ -0,0 +1,49 @@
+import unittest
+
+from pyTerra import projection
+
+
+class ProjectionTest(unittest.TestCase):
+    def testZones(self):
+        """UTM zones and central meridians"""
+        self.assertEqual(projection.zone_for(-93.0), 15)
+        self.assertEqual(projection.zone_for(-96.0), 15)
+        self.assertEqual(projection.zone_for(-96.1), 14)
+        self.assertEqual(projection.central_meridian(15), -93)
+
+    def testForward(self):
+        """lonlat_to_utm returns correct results"""
+        x, y, zone = projection.lonlat_to_utm(-93.0, 43.0)
+        self.assertAlmostEqual(x, 500000.0, 6)
+        self.assertAlmostEqual(y, 4760814.7961, 3)
+        self.assertEqual(zone, 15)
+        # outside the zone's own longitudes
+        x, y, zone = projection.lonlat_to_utm(-96.0, 30.0, 15)
+        self.assertAlmostEqual(x, 210590.3468, 3)
+        self.assertAlmostEqual(y, 3322575.9044, 3)
+
+    def testRoundTrip(self):
+        """utm_to_lonlat inverts lonlat_to_utm"""
+        for lon, lat in [(-93.0, 43.0), (-91.2, 41.5), (-124.3, 48.9),
+                         (-67.1, 25.0)]:
+            x, y, zone = projection.lonlat_to_utm(lon, lat)
+            rlon, rlat = projection.utm_to_lonlat(x, y, zone)
+            self.assertAlmostEqual(rlon, lon, 9)
+            self.assertAlmostEqual(rlat, lat, 9)
+
+    def testArrays(self):
+        """The array conversions match the scalar ones"""
+        if projection.numpy is None:
+            return
+        lon = [-93.0, -91.2, -124.3]
+        lat = [43.0, 41.5, 48.9]
+        x, y, zone = projection.lonlat_to_utm_array(lon, lat)
+        for i in range(3):
+            ex, ey, ezone = projection.lonlat_to_utm(lon[i], lat[i])
+            self.assertAlmostEqual(x[i], ex, 6)
+            self.assertAlmostEqual(y[i], ey, 6)
+            self.assertEqual(zone[i], ezone)
+        rlon, rlat = projection.utm_to_lonlat_array(x, y, zone)
+        for i in range(3):
+            self.assertAlmostEqual(rlon[i], lon[i], 9)
+            self.assertAlmostEqual(rlat[i], lat[i], 9)
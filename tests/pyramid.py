@@ -0,0 +1,86 @@
+import cStringIO
+import shutil
+import tempfile
+import unittest
+
+import Image
+
+from pyTerra import api, cache, grid, image, pyramid
+
+
+def png(color):
+    f = cStringIO.StringIO()
+    Image.new("RGB", (grid.side, grid.side), color).save(f, "PNG")
+    return f.getvalue()
+
+def color(tile):
+    return ((tile.X * 40) % 256, (tile.Y * 40) % 256, len(tile.Scale) * 10)
+
+class PyramidTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = cache.DirectoryCache(self.root)
+        self.downloaded = []
+        def download_tile(tile):
+            self.downloaded.append(tile.key())
+            tile.imagedata = png(color(tile))
+        self.download_tile = image.download_tile
+        image.download_tile = download_tile
+
+    def tearDown(self):
+        image.download_tile = self.download_tile
+        shutil.rmtree(self.root)
+
+    def make(self, minx, miny, maxx, maxy, top):
+        size = grid.tile_size('Scale1m')
+        ul = api.UtmPt(minx * size + 1, (maxy + 1) * size - 1, 15)
+        lr = api.UtmPt((maxx + 1) * size - 1, miny * size + 1, 15)
+        p = pyramid.Pyramid(ul, lr, 'Scale1m', 'DOQ', 15, self.cache, top)
+        p.base.limiter = None
+        return p
+
+    def testDownsample(self):
+        """downsample averages blocks of 2 x 2 pixels"""
+        i = Image.new("RGB", (4, 2))
+        i.putdata([(0, 0, 0), (2, 4, 6), (10, 10, 10), (10, 10, 10),
+                   (1, 0, 0), (1, 0, 255), (10, 10, 10), (10, 10, 10)])
+        small = pyramid.downsample(i)
+        self.assertEqual(small.size, (2, 1))
+        self.assertEqual(list(small.getdata()), [(1, 1, 65), (10, 10, 10)])
+
+    def testBuild(self):
+        """Coarse levels are derived from the base tiles"""
+        p = self.make(2160, 23300, 2167, 23307, 'Scale4m')
+        self.assertEqual([plan.key() for plan in p.levels()],
+                         [(1080, 11650, 1083, 11653, 'Scale2m', 15),
+                          (540, 5825, 541, 5826, 'Scale4m', 15)])
+        levels = p.build()
+        self.assertEqual(levels, [
+            ('Scale1m', dict(cached=0, derived=0, fetched=64, failed=0)),
+            ('Scale2m', dict(cached=0, derived=16, fetched=0, failed=0)),
+            ('Scale4m', dict(cached=0, derived=4, fetched=0, failed=0))])
+        self.assertEqual(len(self.downloaded), 64)
+        tile = grid.Tile(1081, 11651, 15, 'DOQ', 'Scale2m')
+        i = Image.open(cStringIO.StringIO(self.cache.get(cache.tile_key(tile))))
+        self.assertEqual(i.size, (grid.side, grid.side))
+        # the upper left quarter is the upper left child
+        child = grid.Tile(2162, 23303, 15, 'DOQ', 'Scale1m')
+        self.assertEqual(i.getpixel((50, 50)), color(child))
+        # nothing is made twice
+        self.assertEqual(p.build()[2][1], dict(cached=4, derived=0, fetched=0,
+                                               failed=0))
+        self.assertEqual(len(self.downloaded), 64)
+
+    def testEdges(self):
+        """Coarse tiles over base tiles outside the extent are fetched"""
+        p = self.make(2161, 23300, 2166, 23303, 'Scale2m')
+        levels = p.build()
+        self.assertEqual(levels[1], ('Scale2m', dict(cached=0, derived=4,
+                                                     fetched=4, failed=0)))
+        self.assertEqual(sorted([key for key in self.downloaded
+                                 if key[-1] == 'Scale2m']),
+                         [('DOQ', 15, x, y, 'Scale2m')
+                          for x in (1080, 1083) for y in (11650, 11651)])
+
+if __name__ == '__main__':
+    unittest.main()
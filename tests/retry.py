@@ -0,0 +1,99 @@
+import socket
+import unittest
+
+from pyTerra import api, retry
+
+
+class Flaky:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise socket.error("down")
+        return 'ok'
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.retryPolicy = api.retryPolicy
+        api.retryPolicy = retry.RetryPolicy(backoff=0)
+
+    def tearDown(self):
+        api.retryPolicy = self.retryPolicy
+
+    def testRetry(self):
+        """Calls are retried until they succeed or run out of attempts"""
+        policy = retry.RetryPolicy(attempts=3, backoff=0)
+        self.assertEqual(policy.call(Flaky(2)), 'ok')
+        self.assertEqual(policy.retries, 2)
+        self.assertRaises(socket.error, policy.call, Flaky(3))
+        self.assertEqual(policy.failures, 1)
+        flaky = Flaky(1)
+        policy.retryable = (ValueError,)
+        self.assertRaises(socket.error, policy.call, flaky)
+        self.assertEqual(flaky.calls, 1)
+
+    def testFaults(self):
+        """Faults are not retried and do not count towards the breaker"""
+        breaker = retry.CircuitBreaker(threshold=2)
+        policy = retry.RetryPolicy(attempts=3, backoff=0, breaker=breaker)
+        calls = []
+        def fault():
+            calls.append(1)
+            raise api.pyTerraError("Tile not found")
+        for i in range(5):
+            self.assertRaises(api.pyTerraError, policy.call, fault)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(policy.retries, 0)
+        self.assertFalse(breaker.is_open())
+        # an answer, even a fault, closes the breaker again
+        policy.attempts = 1
+        self.assertRaises(socket.error, policy.call, Flaky(1))
+        self.assertEqual(breaker.failures, 1)
+        self.assertRaises(api.pyTerraError, policy.call, fault)
+        self.assertEqual(breaker.failures, 0)
+
+    def testRetried(self):
+        """api.retried raises pyTerraErrors as they are, and wraps others"""
+        error = api.pyTerraError("Tile not found")
+        def fault():
+            raise error
+        try:
+            api.retried(fault)
+        except api.pyTerraError, e:
+            self.assertTrue(e is error)
+        else:
+            self.fail("no pyTerraError")
+        try:
+            api.retried(lambda: {}['x'])
+        except api.pyTerraError, e:
+            self.assertEqual(str(e), "'x'")
+        else:
+            self.fail("no pyTerraError")
+
+    def testDelay(self):
+        """Delays grow exponentially, with jitter, up to maxBackoff"""
+        policy = retry.RetryPolicy(backoff=1, maxBackoff=10, jitter=0.5)
+        for i in range(20):
+            self.assertTrue(0.5 <= policy.delay(1) <= 1)
+            self.assertTrue(2 <= policy.delay(3) <= 4)
+            self.assertTrue(5 <= policy.delay(10) <= 10)
+
+    def testBreaker(self):
+        """The breaker opens after repeated failures and lets a trial call
+        through once resetAfter has passed"""
+        breaker = retry.CircuitBreaker(threshold=3, resetAfter=60)
+        policy = retry.RetryPolicy(attempts=2, backoff=0, breaker=breaker)
+        self.assertRaises(socket.error, policy.call, Flaky(2))
+        self.assertFalse(breaker.is_open())
+        # the third failure opens the breaker before the retry
+        self.assertRaises(retry.CircuitOpenError, policy.call, Flaky(2))
+        self.assertTrue(breaker.is_open())
+        flaky = Flaky(0)
+        self.assertRaises(retry.CircuitOpenError, policy.call, flaky)
+        self.assertEqual(flaky.calls, 0)
+        breaker.openedAt -= 60
+        self.assertEqual(policy.call(flaky), 'ok')
+        self.assertFalse(breaker.is_open())
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Seconds that ``import pyTerra`` may take.  Importing must not load the
+# WSDL or touch the network, so this is generous.
+import_budget = 1.0
+
+script = """
+import time
+t = time.time()
+import pyTerra
+elapsed = time.time() - t
+print elapsed, pyTerra.api._client is None
+"""
+
+class StartupTest(unittest.TestCase):
+    def testImportIsLazy(self):
+        """Importing pyTerra does not build the suds client"""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+        out = subprocess.Popen([sys.executable, '-c', script], env=env,
+                               stdout=subprocess.PIPE).communicate()[0]
+        elapsed, lazy = out.split()
+        self.assertEqual(lazy, 'True')
+        self.assertTrue(float(elapsed) < import_budget,
+                        "import pyTerra took %ss" % elapsed)
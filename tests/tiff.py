@@ -0,0 +1,79 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import Image
+
+from pyTerra import tiff
+
+
+def strip_data(width, rows, first):
+    return ''.join([chr((x + y) % 256) * 3 for y in range(first, first + rows)
+                                            for x in range(width)])
+
+class TiffTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp('.tif')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def write(self, bigtiff):
+        writer = tiff.StripWriter(self.filename, 5, 7, 3, bigtiff)
+        writer.write_strip(strip_data(5, 3, 0))
+        writer.write_strip(strip_data(5, 3, 3))
+        self.assertRaises(ValueError, writer.write_strip, strip_data(5, 3, 6))
+        writer.write_strip(strip_data(5, 1, 6))
+        writer.close()
+
+    def testStrips(self):
+        """StripWriter writes a TIFF that PIL reads back"""
+        self.write(False)
+        img = Image.open(self.filename)
+        self.assertEqual(img.size, (5, 7))
+        self.assertEqual(img.mode, 'RGB')
+        self.assertEqual(img.getpixel((4, 6)), (10, 10, 10))
+        self.assertEqual(img.getpixel((1, 2)), (3, 3, 3))
+
+    def testBigTiff(self):
+        """StripWriter writes BigTIFF headers"""
+        self.write(True)
+        f = open(self.filename, 'rb')
+        magic, version, size, zero, ifd = struct.unpack('<2sHHHQ', f.read(16))
+        self.assertEqual((magic, version, size), ('II', 43, 8))
+        f.seek(ifd)
+        count, = struct.unpack('<Q', f.read(8))
+        tags = [struct.unpack('<HHQQ', f.read(20)) for i in range(count)]
+        f.close()
+        self.assertEqual(tags[0], (256, tiff.LONG, 1, 5))
+        self.assertEqual(tags[1], (257, tiff.LONG, 1, 7))
+        # three strip offsets do not fit in the entry
+        self.assertEqual(tags[5][:3], (273, tiff.LONG8, 3))
+        self.assertEqual(tags[5][3] % 2, 0)
+
+    def testIncomplete(self):
+        """Closing before every row is written fails"""
+        writer = tiff.StripWriter(self.filename, 5, 7, 3)
+        writer.write_strip(strip_data(5, 3, 0))
+        self.assertRaises(ValueError, writer.close)
+
+    def testResume(self):
+        """A writer carries on after the strips already in a file"""
+        writer = tiff.StripWriter(self.filename, 5, 7, 3)
+        writer.write_strip(strip_data(5, 3, 0))
+        offsets, counts = writer.offsets[:], writer.counts[:]
+        writer.write_strip(strip_data(5, 3, 3))
+        writer.sync()
+        self.assertEqual(os.path.getsize(self.filename),
+                         writer.offsets[-1] + writer.counts[-1])
+        writer.file.close()
+        writer = tiff.StripWriter(self.filename, 5, 7, 3, None, offsets, counts)
+        self.assertEqual(writer.rows, 3)
+        writer.write_strip(strip_data(5, 3, 3))
+        writer.write_strip(strip_data(5, 1, 6))
+        writer.close()
+        img = Image.open(self.filename)
+        self.assertEqual(img.getpixel((4, 6)), (10, 10, 10))
+        self.assertEqual(img.getpixel((1, 4)), (5, 5, 5))
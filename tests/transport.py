@@ -0,0 +1,82 @@
+import BaseHTTPServer
+import threading
+import unittest
+
+from suds.transport import Request, TransportError
+
+from pyTerra import transport
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['content-length']))
+        status = {'fault': 500, 'busy': 503}.get(body, 200)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(1)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/TerraService2.asmx' % \
+                                                    self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testKeepAlive(self):
+        """KeepAliveTransport reuses its connection"""
+        stats = transport.TransportStats()
+        t = transport.KeepAliveTransport(timeout=5, stats=stats)
+        for i in range(3):
+            reply = t.send(Request(self.url, 'message %d' % i))
+            self.assertEqual(reply.message, 'message %d' % i)
+        self.assertEqual(stats.snapshot(), dict(requests=3, connections=1,
+                                                reused=2, reconnects=0))
+        t.close()
+
+    def testReconnect(self):
+        """A connection closed while idle is reopened"""
+        stats = transport.TransportStats()
+        t = transport.KeepAliveTransport(timeout=5, stats=stats)
+        t.send(Request(self.url, 'first'))
+        for conn in t.connections.values():
+            conn.sock.close()
+        reply = t.send(Request(self.url, 'second'))
+        self.assertEqual(reply.message, 'second')
+        self.assertEqual(stats.connections, 2)
+        t.close()
+
+    def testFault(self):
+        """HTTP errors are raised as TransportError with the body"""
+        t = transport.KeepAliveTransport(timeout=5)
+        try:
+            t.send(Request(self.url, 'fault'))
+        except TransportError, e:
+            self.assertEqual(e.httpcode, 500)
+            self.assertEqual(e.fp.read(), 'fault')
+        else:
+            self.fail("no TransportError")
+        t.close()
+
+    def testUnavailable(self):
+        """A 503 is raised as an HTTPStatusError, and the connection kept"""
+        stats = transport.TransportStats()
+        t = transport.KeepAliveTransport(timeout=5, stats=stats)
+        try:
+            t.send(Request(self.url, 'busy'))
+        except transport.HTTPStatusError, e:
+            self.assertEqual(e.status, 503)
+        else:
+            self.fail("no HTTPStatusError")
+        t.send(Request(self.url, 'again'))
+        self.assertEqual(stats.connections, 1)
+        t.close()